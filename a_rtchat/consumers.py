@@ -3,6 +3,7 @@ from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from asgiref.sync import async_to_sync
 import json
+from .events import message_event
 from .models import *
 
 class ChatroomConsumer(WebsocketConsumer):
@@ -41,24 +42,20 @@ class ChatroomConsumer(WebsocketConsumer):
             author = self.user, 
             group = self.chatroom 
         )
-        event = {
-            'type': 'message_handler',
-            'message_id': message.id,
-        }
+        event = message_event(message)
         async_to_sync(self.channel_layer.group_send)(
             self.chatroom_name, event
         )
         
     def message_handler(self, event):
-        message_id = event['message_id']
-        message = GroupMessage.objects.get(id=message_id)
-        context = {
-            'message': message,
-            'user': self.user,
-            'chat_group': self.chatroom
-        }
-        html = render_to_string("a_rtchat/partials/chat_message_p.html", context=context)
-        self.send(text_data=html)
+        # Rendered once by the sender; recipients only pick their variant
+        if event['author_id'] == self.user.id:
+            self.send(text_data=event['own_html'])
+        else:
+            self.send(text_data=event['others_html'])
+
+    def preview_handler(self, event):
+        self.send(text_data=event['html'])
         
         
     def update_online_count(self):
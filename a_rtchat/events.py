@@ -0,0 +1,38 @@
+from django.contrib.auth.models import AnonymousUser
+from django.template.loader import render_to_string
+
+
+def message_event(message):
+    """
+    The group event announcing ``message``, carrying its HTML rendered once
+    for the author and once for everybody else, the only way it differs
+    between viewers.
+    """
+    def render(viewer):
+        context = {
+            'message': message,
+            'user': viewer,
+            'chat_group': message.group,
+        }
+        return render_to_string("a_rtchat/partials/chat_message_p.html", context=context)
+
+    return {
+        'type': 'message_handler',
+        'message_id': message.id,
+        'author_id': message.author_id,
+        'own_html': render(message.author),
+        'others_html': render(AnonymousUser()),
+    }
+
+
+def preview_event(message):
+    """
+    The group event swapping the finished preview into an image message
+    members already have, the same for every viewer.
+    """
+    return {
+        'type': 'preview_handler',
+        'message_id': message.id,
+        'html': render_to_string("a_rtchat/partials/message_image.html", {'message': message, 'oob': True}),
+    }
+
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from a_rtchat.models import GroupMessage
+
+FIELDS = ["is_image", "image_width", "image_height", "content_type", "file_size"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Detect and store the image flag, dimensions, MIME type and size of "
+        "message attachments stored before these fields existed. Safe to run "
+        "repeatedly; only rows without a file size are read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pending = GroupMessage.objects.exclude(file="").filter(file__isnull=False, file_size__isnull=True).order_by("pk")
+        last_pk = 0
+        updated = 0
+        missing = 0
+        while True:
+            messages = list(pending.filter(pk__gt=last_pk).only("pk", "file")[:batch_size])
+            if not messages:
+                break
+            last_pk = messages[-1].pk
+            detected = []
+            for message in messages:
+                try:
+                    message.detect_file_metadata()
+                except FileNotFoundError:
+                    missing += 1
+                    continue
+                finally:
+                    message.file.close()
+                detected.append(message)
+            with transaction.atomic():
+                GroupMessage.objects.bulk_update(detected, FIELDS)
+            updated += len(detected)
+            self.stdout.write(f"{updated} attachments updated")
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled metadata for {updated} attachments; {missing} files were missing."
+        ))
@@ -0,0 +1,92 @@
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from a_rtchat.models import ChatGroup, GroupMessage
+from a_rtchat.views import chat_file_upload
+
+
+def disk_usage(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload a duplicate-heavy set of attachments, once storing every "
+        "upload as its own file and once through the content-addressed "
+        "store, and report disk usage and upload latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--uploads", type=int, default=200)
+        parser.add_argument("--distinct", type=int, default=10, help="Different files among the uploads.")
+        parser.add_argument("--size", type=int, default=1024 * 1024, help="Bytes per file.")
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f"bench-{uuid.uuid4().hex[:12]}")
+        group = ChatGroup.objects.create(group_name=f"bench-{uuid.uuid4().hex[:12]}")
+        contents = [os.urandom(options["size"]) for _ in range(options["distinct"])]
+        rng = random.Random(0)
+        workload = [rng.randrange(len(contents)) for _ in range(options["uploads"])]
+        factory = RequestFactory()
+
+        def request(index, number):
+            upload = SimpleUploadedFile(f"report-{number}.zip", contents[index], "application/zip")
+            request = factory.post(f"/chat/fileupload/{group.group_name}", {"file": upload})
+            request.user = user
+            request.htmx = True
+            request._dont_enforce_csrf_checks = True
+            return request
+
+        def per_upload(request):
+            # Every upload saved as its own file, as before the store
+            message = GroupMessage(file=request.FILES["file"], author=user, group=group)
+            message.detect_file_metadata()
+            message.save()
+            async_to_sync(get_channel_layer().group_send)(group.group_name, {"type": "message_handler", "message_id": message.id})
+
+        def stored(request):
+            chat_file_upload(request, group.group_name)
+
+        try:
+            for label, upload in (("one file per upload", per_upload), ("content-addressed", stored)):
+                media_root = tempfile.mkdtemp()
+                try:
+                    with override_settings(MEDIA_ROOT=media_root, CHAT_ATTACHMENT_ROOT=media_root):
+                        timings = []
+                        for number, index in enumerate(workload):
+                            req = request(index, number)
+                            started = time.perf_counter()
+                            upload(req)
+                            timings.append((time.perf_counter() - started) * 1000)
+                            req.close()
+                        used = disk_usage(media_root)
+                        GroupMessage.objects.filter(group=group).delete()
+                        left = disk_usage(media_root)
+                finally:
+                    shutil.rmtree(media_root)
+                timings.sort()
+                self.stdout.write(
+                    f"{label}: {used / 1024 / 1024:.1f} MiB on disk, "
+                    f"upload median {statistics.median(timings):.2f} ms, "
+                    f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms; "
+                    f"{left} bytes left after deleting the messages"
+                )
+        finally:
+            group.delete()
+            user.delete()
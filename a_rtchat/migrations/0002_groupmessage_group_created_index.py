@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+from sage_ref.helpers.migrations import ConcurrentAddIndex
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('a_rtchat', '0001_initial'),
+    ]
+
+    operations = [
+        ConcurrentAddIndex(
+            model_name='groupmessage',
+            index=models.Index(fields=['group', '-created'], name='a_rtchat_msg_group_created'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# SQLite: an FTS5 index over the message body, kept in step with the
+# table by triggers. Rows already in the table are indexed by
+# ``manage.py rebuild_search_index``.
+SQLITE_FORWARDS = [
+    """
+    CREATE VIRTUAL TABLE a_rtchat_message_search USING fts5(
+        body,
+        content='a_rtchat_groupmessage',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER a_rtchat_message_search_insert AFTER INSERT ON a_rtchat_groupmessage BEGIN
+        INSERT INTO a_rtchat_message_search(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER a_rtchat_message_search_delete AFTER DELETE ON a_rtchat_groupmessage BEGIN
+        INSERT INTO a_rtchat_message_search(a_rtchat_message_search, rowid, body)
+        VALUES ('delete', old.id, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER a_rtchat_message_search_update AFTER UPDATE OF body ON a_rtchat_groupmessage BEGIN
+        INSERT INTO a_rtchat_message_search(a_rtchat_message_search, rowid, body)
+        VALUES ('delete', old.id, old.body);
+        INSERT INTO a_rtchat_message_search(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+]
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS a_rtchat_message_search_update",
+    "DROP TRIGGER IF EXISTS a_rtchat_message_search_delete",
+    "DROP TRIGGER IF EXISTS a_rtchat_message_search_insert",
+    "DROP TABLE IF EXISTS a_rtchat_message_search",
+]
+
+# PostgreSQL: a GIN index on the body's tsvector. It is an expression
+# index, so it is current without triggers and built over existing rows.
+POSTGRESQL_FORWARDS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS a_rtchat_msg_search_idx "
+    "ON a_rtchat_groupmessage USING gin (to_tsvector('simple', body))",
+]
+POSTGRESQL_BACKWARDS = [
+    "DROP INDEX CONCURRENTLY IF EXISTS a_rtchat_msg_search_idx",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('a_rtchat', '0005_stored_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRESQL_FORWARDS}),
+            _run({'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRESQL_BACKWARDS}),
+        ),
+    ]
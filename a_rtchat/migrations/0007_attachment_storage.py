@@ -0,0 +1,48 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:48
+
+import os
+import shutil
+
+import a_rtchat.uploads
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_files(apps, schema_editor):
+    # Out of the publicly served MEDIA_ROOT into the attachment storage
+    GroupMessage = apps.get_model('a_rtchat', 'GroupMessage')
+    StoredFile = apps.get_model('a_rtchat', 'StoredFile')
+    storage = a_rtchat.uploads.attachment_storage
+    names = set(StoredFile.objects.values_list('file', flat=True).iterator())
+    names.update(GroupMessage.objects.exclude(file='').exclude(file__isnull=True).values_list('file', flat=True).iterator())
+    for name in names:
+        source = os.path.join(settings.MEDIA_ROOT, name)
+        target = storage.path(name)
+        if os.path.exists(source) and not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(source, target)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0006_groupmessage_search'),
+    ]
+
+    operations = [
+        # The storage is not part of the schema; altering the column would
+        # rebuild the table on SQLite and drop its search triggers
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='groupmessage',
+                name='file',
+                field=models.FileField(blank=True, null=True, storage=a_rtchat.uploads.get_attachment_storage, upload_to='files/'),
+            ),
+            migrations.AlterField(
+                model_name='storedfile',
+                name='file',
+                field=models.FileField(storage=a_rtchat.uploads.get_attachment_storage, upload_to='files/'),
+            ),
+        ]),
+        migrations.RunPython(move_files, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,12 @@
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.urls import reverse
 from django.contrib.auth.models import User
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
+import mimetypes
 import os
+from .uploads import get_attachment_storage, release
 
 class ChatGroup(models.Model):
     group_name = models.CharField(max_length=128, unique=True, blank=True)
@@ -14,19 +19,54 @@ class ChatGroup(models.Model):
     def __str__(self):
         return self.group_name
 
+class StoredFile(models.Model):
+    """
+    Attachment bytes stored once under their SHA-256, shared by every
+    message that carries the same file.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='files/', storage=get_attachment_storage)
+    size = models.PositiveBigIntegerField()
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    ref_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
 class GroupMessage(models.Model):
     group = models.ForeignKey(ChatGroup, related_name='chat_messages', on_delete=models.CASCADE)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     body = models.CharField(max_length=300, blank=True, null=True)
-    file = models.FileField(upload_to='files/', blank=True, null=True)
+    file = models.FileField(upload_to='files/', storage=get_attachment_storage, blank=True, null=True)
+    # Shared storage of ``file``; empty for files stored before it existed
+    attachment = models.ForeignKey(StoredFile, related_name='messages', blank=True, null=True, on_delete=models.PROTECT)
+    file_name = models.CharField(max_length=255, blank=True, default='')
+    # Detected once when the file is stored, so rendering never opens it
+    is_image = models.BooleanField(default=False)
+    image_width = models.PositiveIntegerField(blank=True, null=True)
+    image_height = models.PositiveIntegerField(blank=True, null=True)
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    file_size = models.PositiveBigIntegerField(blank=True, null=True)
+    # Scaled-down copy of an image attachment, made in the background
+    file_preview = models.ImageField(upload_to='thumbnails/', blank=True, null=True, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     
     @property
     def filename(self):
         if self.file:
-            return os.path.basename(self.file.name)
+            return self.file_name or os.path.basename(self.file.name)
         else:
             return None
+
+    @property
+    def file_url(self):
+        # Shared files are served by their hash, which is all the URL
+        # needs; load ``attachment`` with the message
+        if self.attachment_id:
+            return reverse('chat-attachment', args=[self.attachment.sha256])
+        return reverse('chat-message-file', args=[self.pk])
     
     def __str__(self):
         if self.body:
@@ -36,12 +76,35 @@ class GroupMessage(models.Model):
     
     class Meta:
         ordering = ['-created']
-        
-    @property    
-    def is_image(self):
+        indexes = [
+            models.Index(fields=['group', '-created'], name='a_rtchat_msg_group_created'),
+        ]
+
+    def detect_file_metadata(self):
+        """
+        Fill in the image flag, dimensions, MIME type and size of ``file``
+        from its header. Leaves the file positioned at its start.
+        """
+        file = self.file
+        self.file_size = file.size
+        self.content_type = mimetypes.guess_type(file.name)[0] or 'application/octet-stream'
+        self.is_image, self.image_width, self.image_height = False, None, None
+        file.open('rb')
         try:
-            image = Image.open(self.file) 
-            image.verify()
-            return True 
-        except:
-            return False
+            with Image.open(file) as image:
+                width, height = image.size
+                mime = image.get_format_mimetype()
+                image.verify()
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+            pass
+        else:
+            self.is_image, self.image_width, self.image_height = True, width, height
+            self.content_type = mime or self.content_type
+        finally:
+            file.seek(0)
+
+
+@receiver(post_delete, sender=GroupMessage)
+def release_attachment(sender, instance, **kwargs):
+    if instance.attachment_id:
+        release(instance.attachment_id)
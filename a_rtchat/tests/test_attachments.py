@@ -0,0 +1,81 @@
+import hashlib
+import shutil
+import tempfile
+import unittest
+
+from django.apps import apps
+
+if not apps.is_installed('a_rtchat'):
+    raise unittest.SkipTest("a_rtchat is not in INSTALLED_APPS.")
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.views.static import serve
+
+from a_rtchat.models import ChatGroup, GroupMessage
+from a_rtchat.uploads import attachment_name, store_upload
+from a_rtchat.views import attachment_view
+
+
+class AttachmentAccessTests(TestCase):
+    """
+    Attachments are served by hash to whoever may read a group carrying
+    them, and never straight from MEDIA_ROOT.
+    """
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        media = override_settings(MEDIA_ROOT=f"{root}/media", CHAT_ATTACHMENT_ROOT=f"{root}/attachments")
+        media.enable()
+        self.addCleanup(media.disable)
+        self.author = User.objects.create(username="author")
+        self.member = User.objects.create(username="member")
+        self.stranger = User.objects.create(username="stranger")
+
+    def attach(self, group, data=b"minutes of the meeting"):
+        upload = SimpleUploadedFile("minutes.txt", data, "text/plain")
+        upload.sha256 = hashlib.sha256(data).hexdigest()
+        stored = store_upload(upload, "text/plain")
+        GroupMessage.objects.create(group=group, author=self.author, attachment=stored, file=stored.file.name)
+        return stored
+
+    def fetch(self, user, digest):
+        request = RequestFactory().get(f"/chat/files/{digest}")
+        request.user = user
+        try:
+            response = attachment_view(request, digest)
+        except Http404:
+            return 404, None
+        self.assertEqual(b"".join(response.streaming_content), b"minutes of the meeting")
+        response.close()
+        return response.status_code, response
+
+    def test_public_chat_attachment_readable_by_anyone_logged_in(self):
+        group = ChatGroup.objects.create(group_name="public-chat")
+        stored = self.attach(group)
+        status, response = self.fetch(self.stranger, stored.sha256)
+        self.assertEqual(status, 200)
+        self.assertEqual(response["Cache-Control"], "private, max-age=31536000, immutable")
+
+    def test_private_chat_attachment_only_for_members(self):
+        group = ChatGroup.objects.create(group_name="private", is_private=True)
+        group.members.add(self.member)
+        stored = self.attach(group)
+        self.assertEqual(self.fetch(self.member, stored.sha256)[0], 200)
+        self.assertEqual(self.fetch(self.author, stored.sha256)[0], 200)
+        self.assertEqual(self.fetch(self.stranger, stored.sha256)[0], 404)
+
+    def test_not_served_from_media_root(self):
+        group = ChatGroup.objects.create(group_name="private", is_private=True)
+        stored = self.attach(group)
+        self.assertEqual(stored.file.name, attachment_name(stored.sha256, "minutes.txt"))
+        # What static(MEDIA_URL, ...) serves in kernel/urls.py
+        with self.assertRaises(Http404):
+            serve(RequestFactory().get("/"), stored.file.name, document_root=settings.MEDIA_ROOT)
+        self.assertFalse(stored.file.path.startswith(str(settings.MEDIA_ROOT)))
+        with self.assertRaises(ValueError):
+            stored.file.url
@@ -0,0 +1,50 @@
+import unittest
+
+from django.apps import apps
+
+if not apps.is_installed('a_rtchat'):
+    raise unittest.SkipTest("a_rtchat is not in INSTALLED_APPS.")
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+
+from a_rtchat.models import ChatGroup, GroupMessage
+from a_rtchat.views import group_message_search
+
+
+class GroupMessageSearchTests(TestCase):
+    """
+    Search only finds messages of the groups the requester may read.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create(username="author")
+        self.member = User.objects.create(username="member")
+        self.stranger = User.objects.create(username="stranger")
+        public = ChatGroup.objects.create(group_name="public-chat")
+        private = ChatGroup.objects.create(group_name="private", is_private=True)
+        private.members.add(self.author, self.member)
+        GroupMessage.objects.create(group=public, author=self.author, body="budget meeting at noon")
+        GroupMessage.objects.create(group=private, author=self.author, body="budget cuts are coming")
+
+    def search(self, user, **params):
+        request = RequestFactory().get("/chat/search/", params)
+        request.user = user
+        response = group_message_search(request)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_member_finds_public_and_private(self):
+        content = self.search(self.member, q="budget")
+        self.assertIn("budget meeting at noon", content)
+        self.assertIn("budget cuts are coming", content)
+
+    def test_stranger_finds_public_only(self):
+        content = self.search(self.stranger, q="budget")
+        self.assertIn("budget meeting at noon", content)
+        self.assertNotIn("budget cuts are coming", content)
+
+    def test_stranger_cannot_name_a_private_group(self):
+        content = self.search(self.stranger, q="budget", group="private")
+        self.assertNotIn("budget cuts are coming", content)
+        self.assertIn('No messages match "budget"', content)
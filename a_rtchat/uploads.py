@@ -0,0 +1,167 @@
+import hashlib
+import os
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from django.db import transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+
+# Largest attachment accepted, in bytes.
+ATTACHMENT_MAX_SIZE = getattr(settings, "CHAT_ATTACHMENT_MAX_SIZE", 10 * 1024 * 1024)
+# Accepted MIME types; entries ending in "/" accept the whole family.
+ATTACHMENT_TYPES = getattr(settings, "CHAT_ATTACHMENT_TYPES", (
+    "image/",
+    "text/plain",
+    "application/pdf",
+    "application/zip",
+))
+# Room left in a request for the multipart boundaries and headers.
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+class AttachmentStorage(FileSystemStorage):
+    """
+    Local storage of chat attachments under ``CHAT_ATTACHMENT_ROOT``, a
+    directory kept out of MEDIA_ROOT. Files have no public URL; they are
+    only served by the views that check who is asking.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(
+            self._location, getattr(settings, "CHAT_ATTACHMENT_ROOT", settings.BASE_DIR / "chat_attachments")
+        )
+
+    @cached_property
+    def base_url(self):
+        return None
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == "CHAT_ATTACHMENT_ROOT":
+            self.__dict__.pop("base_location", None)
+            self.__dict__.pop("location", None)
+
+
+attachment_storage = AttachmentStorage()
+
+
+def get_attachment_storage():
+    # Referenced by the file fields, so migrations do not record the path
+    return attachment_storage
+
+
+def allowed_type(content_type):
+    return any(
+        content_type.startswith(allowed) if allowed.endswith("/") else content_type == allowed
+        for allowed in ATTACHMENT_TYPES
+    )
+
+
+def too_large(request):
+    """
+    Whether the declared body is bigger than any accepted attachment, so
+    the request can be refused before its body is read.
+    """
+    try:
+        return int(request.META.get("CONTENT_LENGTH") or 0) > ATTACHMENT_MAX_SIZE + MULTIPART_OVERHEAD
+    except ValueError:
+        return True
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Streams each uploaded file to a temporary file in chunks while computing
+    its SHA-256, which ends up on the file as ``sha256``.
+
+    Files of a type outside ``ATTACHMENT_TYPES`` or past ``max_size`` stop
+    the upload as soon as they are seen, without reading the rest of the
+    body; ``rejection`` then holds the reason and ``status`` the HTTP
+    status to answer with.
+    """
+
+    def __init__(self, request=None, max_size=ATTACHMENT_MAX_SIZE):
+        super().__init__(request)
+        self.max_size = max_size
+        self.rejection = None
+        self.status = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if not allowed_type(content_type):
+            self.reject(f"Files of type {content_type} are not accepted.", 415)
+        self.digest = hashlib.sha256()
+        self.file = TemporaryUploadedFile(file_name, content_type, 0, charset, content_type_extra)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.reject(f"Files larger than {self.max_size} bytes are not accepted.", 413)
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.digest.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        # The parser closes ``file`` whenever the handler has one
+        if hasattr(self, 'file'):
+            self.file.close()
+
+    def reject(self, reason, status):
+        self.rejection = reason
+        self.status = status
+        self.upload_interrupted()
+        raise StopUpload(connection_reset=True)
+
+
+def attachment_name(digest, file_name):
+    extension = os.path.splitext(file_name)[1].lower()[:10]
+    return f"files/{digest[:2]}/{digest}{extension}"
+
+
+def store_upload(upload, content_type):
+    """
+    The ``StoredFile`` holding the bytes of ``upload`` (as read by
+    ``HashingUploadHandler``), with one more reference. The file is only
+    written if no identical one is stored yet.
+    """
+    from .models import StoredFile
+
+    with transaction.atomic():
+        stored, created = StoredFile.objects.select_for_update().get_or_create(
+            sha256=upload.sha256,
+            defaults={
+                'file': attachment_name(upload.sha256, upload.name),
+                'size': upload.size,
+                'content_type': content_type,
+            },
+        )
+        StoredFile.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') + 1)
+        if created or not attachment_storage.exists(stored.file.name):
+            name = attachment_storage.save(stored.file.name, upload)
+            if name != stored.file.name:
+                StoredFile.objects.filter(pk=stored.pk).update(file=name)
+                stored.file.name = name
+    return stored
+
+
+def release(stored_file_id):
+    """
+    Drop one reference to a stored file, deleting it with its last one.
+    """
+    from .models import StoredFile
+
+    with transaction.atomic():
+        StoredFile.objects.filter(pk=stored_file_id).update(ref_count=F('ref_count') - 1)
+        unused = StoredFile.objects.select_for_update().filter(pk=stored_file_id, ref_count__lte=0).first()
+        if unused is not None:
+            # Still holding the row lock, so an upload of the same bytes
+            # waits and then stores the file again
+            unused.delete()
+            attachment_storage.delete(unused.file.name)
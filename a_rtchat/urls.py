@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 from .views import *
 
 urlpatterns = [
@@ -9,5 +9,8 @@ urlpatterns = [
     path('chat/edit/<chatroom_name>', chatroom_edit_view, name="edit-chatroom"),
     path('chat/delete/<chatroom_name>', chatroom_delete_view, name="chatroom-delete"),
     path('chat/leave/<chatroom_name>', chatroom_leave_view, name="chatroom-leave"),
+    path('chat/search/', group_message_search, name="chat-search"),
     path('chat/fileupload/<chatroom_name>', chat_file_upload, name="chat-file-upload"),
+    re_path(r'^chat/files/(?P<digest>[0-9a-f]{64})$', attachment_view, name="chat-attachment"),
+    path('chat/messages/<int:pk>/file', message_file_view, name="chat-message-file"),
 ]
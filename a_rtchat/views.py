@@ -1,17 +1,25 @@
 from django.shortcuts import render, get_object_or_404, redirect 
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import condition
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest
 from django.contrib import messages
+from django.db import transaction
+from django.db.models import Q
 from django.http import Http404
+from sage_ref.service.search import search_group_messages
+from sage_ref.service.thumbnails import thumbnail_pool
+from .events import message_event, preview_event
+from .uploads import HashingUploadHandler, allowed_type, store_upload, too_large
 from .models import *
 from .forms import *
 
 @login_required
 def chat_view(request, chatroom_name='public-chat'):
     chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
-    chat_messages = chat_group.chat_messages.all()[:30]
+    chat_messages = chat_group.chat_messages.select_related('attachment')[:30]
     form = ChatmessageCreateForm()
     other_user = None
     if request:
@@ -133,22 +141,119 @@ def chatroom_leave_view(request, chatroom_name):
         return redirect('home')
     
     
+# CSRF is checked once the upload handlers are in place, since checking
+# it reads the body
+@csrf_exempt
 def chat_file_upload(request, chatroom_name):
+    if too_large(request):
+        return HttpResponse('File too large.', status=413)
+    request.upload_handlers = [HashingUploadHandler(request)]
+    return _chat_file_upload(request, chatroom_name)
+
+
+@csrf_protect
+def _chat_file_upload(request, chatroom_name):
     chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
     
-    if request.htmx and request.FILES:
-        file = request.FILES['file']
-        message = GroupMessage.objects.create(
+    files = request.FILES
+    handler = request.upload_handlers[0]
+    if handler.rejection:
+        return HttpResponse(handler.rejection, status=handler.status)
+    if request.htmx and files:
+        file = files['file']
+        message = GroupMessage(
             file = file,
+            file_name = file.name,
             author = request.user, 
             group = chat_group,
         )
+        message.detect_file_metadata()
+        # The declared type was checked while reading; this is the sniffed one
+        if not allowed_type(message.content_type):
+            return HttpResponse('File type not accepted.', status=415)
+        with transaction.atomic():
+            message.attachment = store_upload(file, message.content_type)
+            message.file = message.attachment.file.name
+            message.save()
         channel_layer = get_channel_layer()
-        event = {
-            'type': 'message_handler',
-            'message_id': message.id,
-        }
         async_to_sync(channel_layer.group_send)(
-            chatroom_name, event
+            chatroom_name, message_event(message)
         )
+        if message.is_image:
+            # Runs in the worker thread once the preview is stored; a
+            # failed send is logged by the pool
+            def send_preview(pk):
+                stored = GroupMessage.objects.select_related('attachment', 'group').filter(pk=pk).first()
+                if stored is not None and stored.file_preview:
+                    async_to_sync(get_channel_layer().group_send)(chatroom_name, preview_event(stored))
+
+            thumbnail_pool.submit(message, 'file', 'file_preview', 'preview', on_done=send_preview)
     return HttpResponse()
+
+
+def readable_by(messages, user):
+    """
+    The ``messages`` ``user`` may open the files of: their own, and those
+    of groups that are public or that they are a member of.
+    """
+    return messages.filter(Q(group__is_private=False) | Q(group__members=user) | Q(author=user))
+
+
+def readable_groups(user):
+    """
+    The groups ``user`` may read the messages of: the public ones and
+    those they are a member of.
+    """
+    return ChatGroup.objects.filter(Q(is_private=False) | Q(members=user))
+
+
+@login_required
+def group_message_search(request):
+    """
+    A page of group messages matching ``?q=``, best match first, only from
+    the groups the requester may read, optionally just ``?group=``.
+    """
+    groups = readable_groups(request.user)
+    if request.GET.get('group'):
+        groups = groups.filter(group_name=request.GET['group'])
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    found, has_more = search_group_messages(request.GET.get('q', ''), group=groups, page=page)
+    query = request.GET.copy()
+    query['page'] = page + 1
+    context = {
+        'query' : request.GET.get('q', ''),
+        'found_messages' : found,
+        'next_page' : query.urlencode() if has_more else None,
+    }
+    return render(request, 'a_rtchat/partials/search_results.html', context)
+
+
+# Checked before the conditional response, so a stranger holding the hash
+# gets no 304 either
+@login_required
+def attachment_view(request, digest):
+    stored = get_object_or_404(StoredFile, sha256=digest)
+    if not readable_by(GroupMessage.objects.filter(attachment=stored), request.user).exists():
+        raise Http404()
+    return _attachment_response(request, stored)
+
+
+@condition(etag_func=lambda request, stored: stored.sha256)
+def _attachment_response(request, stored):
+    response = FileResponse(stored.file.open('rb'), content_type=stored.content_type or None)
+    # The URL names the content, so it never changes; only the requester's
+    # browser may keep it
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
+@login_required
+def message_file_view(request, pk):
+    # Files stored before the shared store, one per message
+    message = get_object_or_404(readable_by(GroupMessage.objects.exclude(file=''), request.user).distinct(), pk=pk)
+    response = FileResponse(message.file.open('rb'), content_type=message.content_type or None)
+    response['Cache-Control'] = 'private'
+    return response
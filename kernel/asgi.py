@@ -1,7 +1,6 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kernel.settings')
@@ -9,11 +8,15 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kernel.settings')
 django_asgi_app = get_asgi_application()
 
 from sage_ref import routing
+from sage_ref.service.handshake import CachedAuthMiddlewareStack
+from sage_ref.service.reaper import start_room_reaper
+
+start_room_reaper()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
+        CachedAuthMiddlewareStack(
             URLRouter(
                 routing.websocket_urlpatterns 
             )
@@ -131,4 +131,74 @@ CHANNEL_LAYERS = {
         'default': {
             "BACKEND": "channels.layers.InMemoryChannelLayer",
         }
-}
\ No newline at end of file
+}
+
+# sage_ref
+SAGE_REF_ASYNC_CONSUMER = True
+SAGE_REF_DELTA_DELIVERY = True
+SAGE_REF_HISTORY_SIZE = 50
+SAGE_REF_HISTORY_CACHE_BYTES = 32 * 1024 * 1024
+SAGE_REF_HISTORY_CACHE_TTL = 60
+# Use "sage_ref.service.presence.RedisPresence" with
+# "OPTIONS": {"address": "redis://127.0.0.1:6379/0"} when running more than
+# one worker.
+SAGE_REF_PRESENCE = {
+    "BACKEND": "sage_ref.service.presence.InMemoryPresence",
+    "TTL": 30,
+    "BROADCAST_WINDOW": 1.0,
+}
+SAGE_REF_TYPING_MIN_INTERVAL = 1.0
+SAGE_REF_TYPING_IDLE_TIMEOUT = 5.0
+# Write-behind batching for chat messages; single worker only.
+SAGE_REF_WRITE_BEHIND = {
+    "ENABLED": False,
+    "BATCH_SIZE": 200,
+    "FLUSH_INTERVAL": 0.05,
+    "MAX_QUEUE": 10000,
+    "RETRIES": 3,
+    "RETRY_DELAY": 0.1,
+    "RESERVE_SIZE": 20,
+}
+SAGE_REF_ROOM_DIRECTORY_CACHE = "default"
+SAGE_REF_ROOM_DIRECTORY_TTL = 300
+SAGE_REF_INBOX_PAGE_SIZE = 25
+SAGE_REF_MULTIPLEX_MAX_ROOMS = 50
+SAGE_REF_HANDSHAKE_CACHE = "default"
+SAGE_REF_HANDSHAKE_TTL = 60
+SAGE_REF_VISITOR_COOKIE = "sage_visitor"
+SAGE_REF_VISITOR_COOKIE_AGE = 60 * 60 * 24 * 365
+# Deletes rooms that never got a message; also available as reap_rooms.
+SAGE_REF_ROOM_REAPER = {
+    "ENABLED": False,
+    "TTL": 24 * 60 * 60,
+    "INTERVAL": 60 * 60,
+    "BATCH_SIZE": 500,
+    "PAUSE": 0.1,
+}
+# Old chat messages are moved to compressed segments by archive_messages.
+# The directory is kept out of MEDIA_ROOT, which is served publicly here.
+SAGE_REF_ARCHIVE = {
+    "DIRECTORY": BASE_DIR / "chat_archive",
+    "AGE": 90 * 24 * 60 * 60,
+    "KEEP": 50,
+    "BATCH_SIZE": 1000,
+    "INDEX_CACHE_SIZE": 1024,
+}
+# Rows per query and per username lookup in transcript exports.
+SAGE_REF_TRANSCRIPT_CHUNK_SIZE = 2000
+# Page size and page limit of message search for agents.
+SAGE_REF_SEARCH_PAGE_SIZE = 20
+SAGE_REF_SEARCH_MAX_PAGES = 50
+# Background thumbnails of agent avatars and image attachments.
+SAGE_REF_THUMBNAILS = {
+    "WORKERS": 2,
+    "DIRECTORY": "thumbnails",
+    "FORMAT": "WEBP",
+    "QUALITY": 80,
+}
+# Limits of chat attachments, enforced while the upload is read.
+CHAT_ATTACHMENT_MAX_SIZE = 10 * 1024 * 1024
+CHAT_ATTACHMENT_TYPES = ("image/", "text/plain", "application/pdf", "application/zip")
+# Where chat attachments are stored. Kept out of MEDIA_ROOT, which is
+# served publicly here; the files are only served by the chat views.
+CHAT_ATTACHMENT_ROOT = BASE_DIR / "chat_attachments"
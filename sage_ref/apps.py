@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SageRefConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "sage_ref"
+
+    def ready(self):
+        from sage_ref import signals  # noqa: F401
@@ -0,0 +1,23 @@
+import base64
+from datetime import datetime
+
+
+def encode_cursor(timestamp, pk):
+    """
+    Opaque keyset position for a row ordered by ``(timestamp, id)``.
+    """
+    value = f"{timestamp.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    The ``(timestamp, id)`` pair of a cursor; raises ``ValueError`` if it
+    is malformed.
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, pk = value.split("|")
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
@@ -0,0 +1,64 @@
+from django.db.migrations.operations import AddIndex, AlterField
+
+
+class ConcurrentAddIndex(AddIndex):
+    """
+    ``AddIndex`` that builds the index with ``CREATE INDEX CONCURRENTLY`` on
+    PostgreSQL, so writes to a large table are not blocked while it runs.
+    Other databases get a plain ``CREATE INDEX``.
+
+    PostgreSQL refuses concurrent builds inside a transaction, so migrations
+    using this operation must set ``atomic = False``.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class ConcurrentAlterFieldUnique(AlterField):
+    """
+    ``AlterField`` making a field unique. On PostgreSQL the unique index is
+    built with ``CREATE UNIQUE INDEX CONCURRENTLY`` and then attached with
+    ``ADD CONSTRAINT ... UNIQUE USING INDEX``, which only holds the table
+    lock for a moment. Other databases get a plain ``AlterField``.
+
+    Only the uniqueness may change. PostgreSQL refuses concurrent builds
+    inside a transaction, so migrations using this operation must set
+    ``atomic = False``.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        field = model._meta.get_field(self.name)
+        table = model._meta.db_table
+        name = schema_editor._create_index_name(table, [field.column], suffix="_uniq")
+        quote = schema_editor.quote_name
+        # A build that failed earlier leaves an invalid index behind
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {quote(name)}")
+        schema_editor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY {quote(name)} ON {quote(table)} ({quote(field.column)})"
+        )
+        schema_editor.execute(
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} UNIQUE USING INDEX {quote(name)}"
+        )
+        # The pattern-ops index AlterField adds along with uniqueness
+        like = schema_editor._create_like_index_sql(model, field)
+        if like is not None:
+            schema_editor.execute(schema_editor._create_index_sql(
+                model, fields=[field], suffix="_like", opclasses=like.parts['columns'].opclasses, concurrently=True,
+            ))
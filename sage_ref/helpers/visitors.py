@@ -0,0 +1,50 @@
+import uuid
+from django.conf import settings
+from django.core import signing
+
+# Signed cookie identifying an anonymous visitor, so visitors need no
+# session row.
+VISITOR_COOKIE = getattr(settings, "SAGE_REF_VISITOR_COOKIE", "sage_visitor")
+# Seconds the visitor cookie (and with it the visitor's room) is kept.
+VISITOR_COOKIE_AGE = getattr(settings, "SAGE_REF_VISITOR_COOKIE_AGE", 60 * 60 * 24 * 365)
+VISITOR_SALT = "sage_ref.visitor"
+
+
+def new_visitor_id():
+    return uuid.uuid4().hex
+
+
+def read_visitor_id(cookies):
+    """
+    The visitor id in ``cookies`` (a request's ``COOKIES`` or a socket
+    scope's ``cookies``), or ``None`` if it is missing or was tampered with.
+    """
+    value = cookies.get(VISITOR_COOKIE)
+    if not value:
+        return None
+    signer = signing.get_cookie_signer(salt=VISITOR_COOKIE + VISITOR_SALT)
+    try:
+        return signer.unsign(value, max_age=VISITOR_COOKIE_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def set_visitor_cookie(response, visitor_id):
+    response.set_signed_cookie(
+        VISITOR_COOKIE,
+        visitor_id,
+        salt=VISITOR_SALT,
+        max_age=VISITOR_COOKIE_AGE,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def anonymous_identity(session_key, cookies):
+    """
+    The identifier, and room name, of an anonymous visitor: the signed
+    visitor id, or the session key of visitors who got their room before
+    the visitor cookie existed.
+    """
+    return read_visitor_id(cookies) or session_key
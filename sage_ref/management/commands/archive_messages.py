@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sage_ref.service.archive import (
+    ARCHIVE_AGE,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_KEEP,
+    ArchiveStats,
+    MessageArchive,
+    MessageArchiver,
+    message_archive,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move chat messages older than the cutoff into compressed per-room "
+        "segment files, keeping each room's latest messages in the database. "
+        "Safe to run repeatedly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--age", type=int, default=ARCHIVE_AGE, help="Archive messages older than this many seconds.")
+        parser.add_argument("--keep", type=int, default=ARCHIVE_KEEP, help="Latest messages per room left in place.")
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument("--directory", help="Segment directory; defaults to SAGE_REF_ARCHIVE['DIRECTORY'].")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the messages that would move.")
+
+    def handle(self, *args, **options):
+        archive = MessageArchive(options["directory"]) if options["directory"] else message_archive
+        archiver = MessageArchiver(archive, keep=options["keep"], batch_size=options["batch_size"])
+        cutoff = timezone.now() - timedelta(seconds=options["age"])
+        total = ArchiveStats()
+        for room in archiver.rooms(cutoff).iterator():
+            stats = archiver.archive_room(room, cutoff, dry_run=options["dry_run"])
+            if stats.rows:
+                total.add(stats)
+                self.stdout.write(f"{room.name}: {stats.rows} messages")
+        if options["dry_run"]:
+            self.stdout.write(f"{total.rows} messages in {total.rooms} rooms would be archived.")
+            return
+        ratio = total.stored_bytes / total.raw_bytes if total.raw_bytes else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total.rows} messages from {total.rooms} rooms: "
+            f"{total.raw_bytes} bytes of messages stored in {total.stored_bytes} bytes ({ratio:.0%})."
+        ))
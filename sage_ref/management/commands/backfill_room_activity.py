@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from sage_ref.models import ChatMessage, Room
+from sage_ref.service.archive import message_archive
+from sage_ref.service.messages import room_activity
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Room.message_count, unread_count and the last message "
+        "fields from the stored and archived messages. Safe to run repeatedly; messages written to a room "
+        "while its batch is being updated can be missed until the next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        latest = ChatMessage.objects.filter(room=OuterRef("pk")).order_by("-timestamp", "-id").values("pk")[:1]
+        last_reply = (
+            ChatMessage.objects.filter(room=OuterRef("pk"), agent__isnull=False)
+            .order_by("-timestamp", "-id")
+            .values("timestamp")[:1]
+        )
+        unread = (
+            ChatMessage.objects.filter(room=OuterRef("pk"), agent__isnull=True, timestamp__gt=OuterRef("last_reply_at"))
+            .order_by()
+            .values("room")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        last_pk = 0
+        updated = 0
+        while True:
+            rooms = list(
+                Room.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .annotate(
+                    latest_message_id=Subquery(latest),
+                    last_reply_at=Coalesce(Subquery(last_reply), Value(datetime.min.replace(tzinfo=timezone.utc))),
+                )
+                .annotate(unread=Coalesce(Subquery(unread), 0))[:batch_size]
+            )
+            if not rooms:
+                break
+            last_pk = rooms[-1].pk
+            counts = dict(
+                ChatMessage.objects.filter(room__in=rooms)
+                .values_list("room")
+                .annotate(count=Count("id"))
+                .order_by()
+            )
+            messages = ChatMessage.objects.select_related("author").in_bulk(
+                [room.latest_message_id for room in rooms if room.latest_message_id]
+            )
+            for room in rooms:
+                # Archived messages still count as sent in the room
+                room.message_count = counts.get(room.pk, 0) + message_archive.count(room.pk)
+                room.unread_count = room.unread
+                message = messages.get(room.latest_message_id)
+                if message is None:
+                    room.last_message_at, room.last_message_preview, room.last_author = None, "", ""
+                else:
+                    for field, value in room_activity(message).items():
+                        setattr(room, field, value)
+            with transaction.atomic():
+                Room.objects.bulk_update(
+                    rooms,
+                    ["message_count", "unread_count", "last_message_at", "last_message_preview", "last_author"],
+                )
+            updated += len(rooms)
+            self.stdout.write(f"{updated} rooms updated")
+        self.stdout.write(self.style.SUCCESS(f"Backfilled activity for {updated} rooms."))
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import tracemalloc
+import uuid
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from sage_ref.management.commands.bench_agent_status import UserScope
+from sage_ref.models import Agent, Room
+from sage_ref.routing import websocket_urlpatterns
+from sage_ref.service.multiplex_consumer import MULTIPLEX_MAX_ROOMS
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Open R rooms for one agent, once with a socket per room and once "
+        "with a single multiplexed socket, and compare sockets and memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=min(20, MULTIPLEX_MAX_ROOMS))
+
+    def handle(self, *args, **options):
+        name = f"bench-{uuid.uuid4().hex[:12]}"
+        user = User.objects.create(username=name)
+        agent = Agent.objects.create(user=user)
+        rooms = [Room.objects.create(name=f"{name}-{i}", agent=agent) for i in range(options["rooms"])]
+        try:
+            for mode in ("per-room", "multiplexed"):
+                sockets, allocated = asyncio.run(getattr(self, mode.replace("-", "_"))(rooms, user))
+                self.stdout.write(
+                    f"{mode:>12}: rooms={len(rooms)} sockets={sockets} "
+                    f"memory={allocated / 1024:.0f} KiB ({allocated / len(rooms) / 1024:.1f} KiB/room)"
+                )
+        finally:
+            for room in rooms:
+                room.delete()
+            user.delete()
+
+    async def per_room(self, rooms, user):
+        app = URLRouter(websocket_urlpatterns)
+        tracemalloc.start()
+        sockets = []
+        for room in rooms:
+            socket = WebsocketCommunicator(UserScope(app, user), f"/ws/chatroom/{room.name}/")
+            await socket.connect()
+            sockets.append(socket)
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        for socket in sockets:
+            await socket.disconnect()
+        return len(sockets), allocated
+
+    async def multiplexed(self, rooms, user):
+        app = URLRouter(websocket_urlpatterns)
+        tracemalloc.start()
+        socket = WebsocketCommunicator(UserScope(app, user), "/ws/agent/")
+        await socket.connect()
+        for room in rooms:
+            await socket.send_to(text_data=json.dumps({"action": "subscribe", "room": room.name}))
+        # Each subscription answers with its room state
+        for _ in rooms:
+            await socket.receive_from()
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        await socket.disconnect()
+        return 1, allocated
@@ -0,0 +1,103 @@
+import asyncio
+import uuid
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+
+from sage_ref.models import Agent, Room
+from sage_ref.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+
+class UserScope:
+    def __init__(self, inner, user):
+        self.inner = inner
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=self.user, session=SessionStore(session_key=uuid.uuid4().hex))
+        return await self.inner(scope, receive, send)
+
+
+class AgentWriteCounter:
+    def __init__(self):
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(("UPDATE", "INSERT")) and Agent._meta.db_table in sql:
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        # Fires again whenever a closed connection is reopened
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Connect an agent to a room with N client sockets and check that "
+        "each agent status transition writes the Agent row at most once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, default=50)
+
+    def handle(self, *args, **options):
+        name = f"bench-{uuid.uuid4().hex[:12]}"
+        user = User.objects.create(username=name)
+        agent = Agent.objects.create(user=user)
+        room = Room.objects.create(name=name, agent=agent)
+        counter = AgentWriteCounter()
+        connection_created.connect(counter.install)
+        try:
+            connect_writes, disconnect_writes = asyncio.run(
+                self.run(room, user, options["members"], counter)
+            )
+        finally:
+            connection_created.disconnect(counter.install)
+            room.delete()
+            user.delete()
+
+        self.stdout.write(
+            f"members={options['members']} agent writes: "
+            f"connect={connect_writes} disconnect={disconnect_writes}"
+        )
+        if connect_writes > 1 or disconnect_writes > 1:
+            raise CommandError("Agent status was written more than once per transition.")
+        self.stdout.write(self.style.SUCCESS("At most one write per transition."))
+
+    async def run(self, room, user, members, counter):
+        url = f"/ws/chatroom/{room.name}/"
+        clients = [
+            WebsocketCommunicator(UserScope(URLRouter(websocket_urlpatterns), AnonymousUser()), url)
+            for _ in range(members)
+        ]
+        for client in clients:
+            await client.connect()
+
+        agent_socket = WebsocketCommunicator(UserScope(URLRouter(websocket_urlpatterns), user), url)
+        before = counter.writes
+        await agent_socket.connect()
+        await self.settle(clients)
+        connect_writes = counter.writes - before
+
+        before = counter.writes
+        await agent_socket.disconnect()
+        await self.settle(clients)
+        disconnect_writes = counter.writes - before
+
+        for client in clients:
+            await client.disconnect()
+        return connect_writes, disconnect_writes
+
+    async def settle(self, clients):
+        for client in clients:
+            while not await client.receive_nothing(timeout=0.05):
+                await client.receive_from()
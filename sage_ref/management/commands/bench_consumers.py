@@ -0,0 +1,153 @@
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.urls import path
+
+from sage_ref.models import Room
+from sage_ref.service.async_consumer import AsyncChatConsumer
+from sage_ref.service.consumer import ChatConsumer
+
+CONSUMERS = {
+    "sync": ChatConsumer,
+    "async": AsyncChatConsumer,
+}
+
+
+class AnonymousScope:
+    """
+    Stand-in for ``AuthMiddlewareStack`` that gives every socket its own
+    anonymous session without touching the session table.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(
+            scope,
+            user=AnonymousUser(),
+            session=SessionStore(session_key=uuid.uuid4().hex),
+        )
+        return await self.inner(scope, receive, send)
+
+
+class ThreadSampler:
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._task = None
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+class Command(BaseCommand):
+    help = (
+        "Open N concurrent chat sockets against the sync and async consumers "
+        "and report connect latency, broadcast latency and thread usage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sockets", type=int, nargs="+", default=[25, 50, 100, 200],
+            help="Concurrent socket counts to try.",
+        )
+        parser.add_argument(
+            "--consumer", choices=sorted(CONSUMERS), nargs="+",
+            default=sorted(CONSUMERS, reverse=True),
+        )
+        parser.add_argument(
+            "--budget", type=float, default=1.0,
+            help="Broadcast latency budget (seconds) used to report capacity.",
+        )
+        parser.add_argument("--timeout", type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        room = Room.objects.create(name=f"bench-{uuid.uuid4().hex[:12]}")
+        try:
+            for label in options["consumer"]:
+                capacity = 0
+                for sockets in options["sockets"]:
+                    result = asyncio.run(self.run_level(
+                        CONSUMERS[label], room.name, sockets, options["timeout"]
+                    ))
+                    self.stdout.write(
+                        f"{label:>5} sockets={sockets:<5} "
+                        f"connect p50={result['connect_p50'] * 1000:.1f}ms "
+                        f"p95={result['connect_p95'] * 1000:.1f}ms "
+                        f"broadcast={result['broadcast'] * 1000:.1f}ms "
+                        f"peak_threads={result['threads']}"
+                    )
+                    if result["broadcast"] <= options["budget"]:
+                        capacity = sockets
+                self.stdout.write(self.style.SUCCESS(
+                    f"{label}: {capacity} concurrent sockets within "
+                    f"{options['budget']:.1f}s broadcast budget"
+                ))
+        finally:
+            room.delete()
+
+    async def run_level(self, consumer, room_name, sockets, timeout):
+        application = AnonymousScope(URLRouter([
+            path("ws/chatroom/<str:chatroom_name>/", consumer.as_asgi()),
+        ]))
+        url = f"/ws/chatroom/{room_name}/"
+
+        async def open_socket():
+            communicator = WebsocketCommunicator(application, url)
+            started = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=timeout)
+            assert connected, "socket was rejected"
+            return communicator, time.perf_counter() - started
+
+        with ThreadSampler() as sampler:
+            opened = await asyncio.gather(*(open_socket() for _ in range(sockets)))
+            communicators = [communicator for communicator, _ in opened]
+            connect_times = sorted(elapsed for _, elapsed in opened)
+
+            # Let the presence frames from the connect phase settle so only
+            # the chat broadcast is timed.
+            await asyncio.gather(*(self.drain(communicator) for communicator in communicators))
+
+            started = time.perf_counter()
+            await communicators[0].send_json_to({"message": "bench"})
+            await asyncio.gather(*(
+                self.wait_for_chat(communicator, timeout) for communicator in communicators
+            ))
+            broadcast = time.perf_counter() - started
+
+            for communicator in communicators:
+                await communicator.disconnect(timeout=timeout)
+
+        return {
+            "connect_p50": statistics.median(connect_times),
+            "connect_p95": connect_times[int(len(connect_times) * 0.95) - 1],
+            "broadcast": broadcast,
+            "threads": sampler.peak,
+        }
+
+    async def drain(self, communicator):
+        while not await communicator.receive_nothing(timeout=0.2):
+            await communicator.receive_from()
+
+    async def wait_for_chat(self, communicator, timeout):
+        while True:
+            frame = await communicator.receive_from(timeout=timeout)
+            if "chatBody" in frame:
+                return
@@ -0,0 +1,114 @@
+import asyncio
+import statistics
+import time
+import uuid
+
+from channels.auth import AuthMiddlewareStack
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from sage_ref.helpers.visitors import VISITOR_COOKIE, VISITOR_SALT, new_visitor_id, read_visitor_id
+from sage_ref.models import Room
+from sage_ref.service.handshake import CachedAuthMiddlewareStack, handshake_users
+
+User = get_user_model()
+
+
+class AcceptConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        self.scope["user"].is_authenticated
+        await self.accept()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        # Fires again whenever a closed connection is reopened
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure websocket handshake latency and database queries with the "
+        "stock session and auth middleware and with the cached one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--handshakes", type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f"bench-{uuid.uuid4().hex[:12]}")
+        client = Client()
+        client.force_login(user)
+        anonymous = SessionStore()
+        anonymous["seen"] = True
+        anonymous.save()
+        visitor = signing.get_cookie_signer(salt=VISITOR_COOKIE + VISITOR_SALT).sign(new_visitor_id())
+        cookies = {
+            "logged in": f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}",
+            "anonymous session": f"{settings.SESSION_COOKIE_NAME}={anonymous.session_key}",
+            "visitor cookie": f"{VISITOR_COOKIE}={visitor}",
+        }
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        try:
+            for label, cookie in cookies.items():
+                for name, stack in (("stock", AuthMiddlewareStack), ("cached", CachedAuthMiddlewareStack)):
+                    latencies, queries = asyncio.run(
+                        self.run(stack(AcceptConsumer.as_asgi()), cookie, options["handshakes"], counter)
+                    )
+                    latencies.sort()
+                    self.stdout.write(
+                        f"{label:>17} {name:>6}: mean={statistics.fmean(latencies):.2f}ms "
+                        f"p95={latencies[int(len(latencies) * 0.95)]:.2f}ms "
+                        f"queries/handshake={queries / len(latencies):.2f}"
+                    )
+            sessions = Session.objects.count()
+            page = QueryCounter()
+            with connection.execute_wrapper(page):
+                response = Client().get("/home/")
+            self.stdout.write(
+                f"new visitor page view: status={response.status_code} queries={page.queries} "
+                f"sessions written={Session.objects.count() - sessions} "
+                f"visitor cookie set={VISITOR_COOKIE in response.cookies}"
+            )
+            Room.objects.filter(name=read_visitor_id({VISITOR_COOKIE: response.cookies[VISITOR_COOKIE].value})).delete()
+        finally:
+            connection_created.disconnect(counter.install)
+            handshake_users.invalidate(anonymous.session_key)
+            anonymous.delete()
+            client.logout()
+            user.delete()
+
+    async def run(self, application, cookie, handshakes, counter):
+        # One warm-up handshake fills the cache
+        await self.handshake(application, cookie)
+        before = counter.queries
+        latencies = []
+        for _ in range(handshakes):
+            start = time.perf_counter()
+            await self.handshake(application, cookie)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies, counter.queries - before
+
+    async def handshake(self, application, cookie):
+        communicator = WebsocketCommunicator(application, "/", headers=[(b"cookie", cookie.encode())])
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.disconnect()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+
+from sage_ref.models import ChatMessage, Room
+from sage_ref.service.messages import post_message
+from sage_ref.service.write_behind import MessageWriter
+
+apost_message = database_sync_to_async(post_message)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare storing chat messages one by one with the write-behind "
+        "queue, for W concurrent senders posting M messages each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=20)
+        parser.add_argument("--messages", type=int, default=50)
+
+    def handle(self, *args, **options):
+        writers, messages = options["writers"], options["messages"]
+        total = writers * messages
+        for mode in ("direct", "write-behind"):
+            room = Room.objects.create(name=f"bench-{uuid.uuid4().hex[:12]}")
+            try:
+                elapsed, failed = asyncio.run(getattr(self, mode.replace("-", "_"))(room, writers, messages))
+                stored = ChatMessage.objects.filter(room=room).count()
+            finally:
+                room.delete()
+            self.stdout.write(
+                f"{mode:>12}: {total} messages in {elapsed:.2f}s "
+                f"({total / elapsed:.0f} msg/s), stored={stored} failed={failed}"
+            )
+
+    async def direct(self, room, writers, messages):
+        async def sender(n):
+            failed = 0
+            for i in range(messages):
+                try:
+                    await apost_message(room, f"message {n}-{i}", session_key=f"bench-{n}")
+                except OperationalError:
+                    failed += 1
+            return failed
+
+        start = time.perf_counter()
+        failed = await asyncio.gather(*(sender(n) for n in range(writers)))
+        return time.perf_counter() - start, sum(failed)
+
+    async def write_behind(self, room, writers, messages):
+        writer = MessageWriter()
+        channel_layer = get_channel_layer()
+
+        async def sender(n):
+            channel = await channel_layer.new_channel()
+            for i in range(messages):
+                await writer.asubmit(room, f"message {n}-{i}", session_key=f"bench-{n}", reply_channel=channel)
+            # Done once every message of this sender has been acknowledged
+            acked, failed = 0, 0
+            while acked < messages:
+                ack = await channel_layer.receive(channel)
+                acked += len(ack["sequences"])
+                if not ack["persisted"]:
+                    failed += len(ack["sequences"])
+            return failed
+
+        start = time.perf_counter()
+        failed = await asyncio.gather(*(sender(n) for n in range(writers)))
+        elapsed = time.perf_counter() - start
+        await asyncio.to_thread(writer.close)
+        return elapsed, sum(failed)
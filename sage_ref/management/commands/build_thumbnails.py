@@ -0,0 +1,45 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from sage_ref.models import Agent
+from sage_ref.service.thumbnails import make_thumbnail
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the thumbnail variants missing for agent avatars and, when "
+        "a_rtchat is installed, for image attachments. Runs in the foreground; "
+        "new uploads are handled by the background pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        jobs = [(Agent, Agent.objects.exclude(avatar="").filter(avatar_thumbnail=""), "avatar", "avatar_thumbnail", "avatar")]
+        if apps.is_installed("a_rtchat"):
+            GroupMessage = apps.get_model("a_rtchat", "GroupMessage")
+            pending = GroupMessage.objects.filter(Q(file_preview="") | Q(file_preview__isnull=True), is_image=True)
+            jobs.append((GroupMessage, pending, "file", "file_preview", "preview"))
+        for model, pending, field, target, variant in jobs:
+            made = failed = 0
+            last_pk = 0
+            while True:
+                instances = list(pending.filter(pk__gt=last_pk).order_by("pk").only("pk", field)[:options["batch_size"]])
+                if not instances:
+                    break
+                last_pk = instances[-1].pk
+                for instance in instances:
+                    source = getattr(instance, field)
+                    try:
+                        name = make_thumbnail(source, variant)
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"{model.__name__} {instance.pk}: {e}")
+                        continue
+                    model.objects.filter(pk=instance.pk, **{field: source.name}).update(**{target: name})
+                    made += 1
+            self.stdout.write(self.style.SUCCESS(
+                f"Made {made} {variant} thumbnails for {model._meta.verbose_name_plural}; {failed} failed."
+            ))
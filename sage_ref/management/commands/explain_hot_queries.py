@@ -0,0 +1,69 @@
+import re
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from sage_ref.models import ChatMessage, Room
+from sage_ref.service.history import HISTORY_SIZE
+
+# Plan lines that mean a whole table is read.
+FULL_SCAN = re.compile(r"\bSeq Scan\b|\bSCAN (?!.*USING (COVERING )?INDEX)\w+", re.IGNORECASE)
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the EXPLAIN plan of each hot chat query and flag the ones "
+        "that read a whole table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", help="Room name to use; defaults to the room with the latest message.")
+        parser.add_argument("--group", help="a_rtchat group name to use; defaults to the first group.")
+
+    def handle(self, *args, **options):
+        room = self.sample_room(options["room"])
+        queries = [
+            ("room by name", Room.objects.filter(name=room.name)),
+            (
+                "recent messages",
+                ChatMessage.objects.filter(room=room).order_by("-timestamp", "-id")[:HISTORY_SIZE],
+            ),
+            (
+                "missed messages",
+                ChatMessage.objects.filter(room=room, sequence__gt=max(room.last_sequence - HISTORY_SIZE, 0))
+                .order_by("sequence"),
+            ),
+        ]
+        if apps.is_installed("a_rtchat"):
+            queries.extend(self.group_queries(options["group"]))
+
+        full_scans = 0
+        for label, queryset in queries:
+            plan = queryset.explain()
+            scans = [line for line in plan.splitlines() if FULL_SCAN.search(line)]
+            full_scans += bool(scans)
+            status = self.style.ERROR("FULL SCAN") if scans else self.style.SUCCESS("indexed")
+            self.stdout.write(f"== {label} [{status}]")
+            self.stdout.write(plan)
+            self.stdout.write("")
+        self.stdout.write(f"{len(queries)} queries on {connection.vendor}, {full_scans} with a full scan.")
+
+    def sample_room(self, name):
+        if name:
+            return Room.objects.get(name=name)
+        message = ChatMessage.objects.select_related("room").order_by("-id").first()
+        if message is not None:
+            return message.room
+        # Any values work for an empty database, the plan is what matters.
+        return Room(pk=0, name="", last_sequence=0)
+
+    def group_queries(self, name):
+        ChatGroup = apps.get_model("a_rtchat", "ChatGroup")
+        GroupMessage = apps.get_model("a_rtchat", "GroupMessage")
+        group = ChatGroup.objects.filter(group_name=name).first() if name else ChatGroup.objects.first()
+        group_name = group.group_name if group else ""
+        return [
+            ("chat group by name", ChatGroup.objects.filter(group_name=group_name)),
+            ("group messages", GroupMessage.objects.filter(group__group_name=group_name)[:30]),
+        ]
@@ -0,0 +1,59 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sage_ref.models import Room
+from sage_ref.service.transcripts import (
+    TRANSCRIPT_CHUNK_SIZE,
+    TRANSCRIPT_FORMATS,
+    parse_bound,
+    transcript_rows,
+    transcript_stream,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a gzip-compressed transcript of one room or of all rooms, "
+        "archived messages included, as JSON lines or CSV."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", help="Room name; all rooms when omitted.")
+        parser.add_argument("--since", help="ISO date or date-time of the first message.")
+        parser.add_argument("--until", help="ISO date or date-time the messages end before.")
+        parser.add_argument("--format", choices=TRANSCRIPT_FORMATS, default="jsonl")
+        parser.add_argument("--output", help="File to write; standard output when omitted.")
+        parser.add_argument("--chunk-size", type=int, default=TRANSCRIPT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options["since"])
+            until = parse_bound(options["until"])
+        except ValueError as e:
+            raise CommandError(e)
+        room = None
+        if options["room"]:
+            room = Room.objects.filter(name=options["room"]).first()
+            if room is None:
+                raise CommandError(f"No room named {options['room']!r}.")
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        rows = counted(transcript_rows(room, since, until, chunk_size=options["chunk_size"]))
+        output = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in transcript_stream(rows, options["format"]):
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options["output"]:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} messages in {written} bytes."))
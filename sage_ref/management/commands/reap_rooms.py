@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from sage_ref.service.reaper import ROOM_REAPER_BATCH_SIZE, ROOM_REAPER_PAUSE, ROOM_REAPER_TTL, RoomReaper
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete rooms that have had no message for longer than the TTL, in "
+        "bounded batches. Safe to run repeatedly, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl", type=int, default=ROOM_REAPER_TTL, help="Seconds a room may stay empty.")
+        parser.add_argument("--batch-size", type=int, default=ROOM_REAPER_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=ROOM_REAPER_PAUSE, help="Seconds between batches.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the rooms that would go.")
+
+    def handle(self, *args, **options):
+        reaper = RoomReaper(ttl=options["ttl"], batch_size=options["batch_size"], pause=options["pause"])
+        if options["dry_run"]:
+            self.stdout.write(f"{reaper.empty_rooms().count()} empty rooms would be deleted.")
+            return
+        deleted = reaper.reap(on_batch=lambda deleted: self.stdout.write(f"{deleted} rooms deleted"))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} empty rooms."))
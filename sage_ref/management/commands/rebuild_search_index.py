@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from sage_ref.service.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full-text indexes of chat messages (and of a_rtchat group "
+        "messages when installed) from their tables. "
+        "Run once after migrating, and after loading messages with triggers off."
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ("sqlite", "postgresql"):
+            self.stdout.write(f"{connection.vendor} has no message search index; searches scan the table.")
+            return
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the message search index."))
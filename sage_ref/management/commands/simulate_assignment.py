@@ -0,0 +1,111 @@
+import heapq
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sage_ref.service.assignment import AssignmentQueue
+
+
+class LinearQueue:
+    """
+    The straightforward version for comparison: scan every agent for the
+    lowest load and take rooms off the front of a list.
+    """
+
+    def __init__(self):
+        self._rooms = []
+        self._loads = {}
+
+    def add_room(self, room_id, waiting_since):
+        self._rooms.append(room_id)
+
+    def add_agent(self, agent_id, capacity, load=0):
+        self._loads[agent_id] = [load, capacity]
+
+    def load(self, agent_id):
+        return self._loads[agent_id][0]
+
+    def release(self, agent_id):
+        self._loads[agent_id][0] -= 1
+
+    def pop(self):
+        if not self._rooms:
+            return None
+        available = [(load, pk) for pk, (load, capacity) in self._loads.items() if load < capacity]
+        if not available:
+            return None
+        _, agent_id = min(available)
+        self._loads[agent_id][0] += 1
+        return self._rooms.pop(0), agent_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate rooms arriving for a pool of agents and compare the heap "
+        "based assignment queue with a linear scan. No database is used."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=5000)
+        parser.add_argument("--agents", type=int, default=300)
+        parser.add_argument("--capacity", type=int, default=3)
+        parser.add_argument("--duration", type=float, default=600.0, help="Mean chat length in seconds.")
+        parser.add_argument(
+            "--utilisation", type=float, default=1.1,
+            help="Arrival rate as a share of what the agents can handle; above 1 a queue builds up.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["agents"] < 1 or options["capacity"] < 1:
+            raise CommandError("--agents and --capacity must be at least 1.")
+        rate = options["utilisation"] * options["agents"] * options["capacity"] / options["duration"]
+        rng = random.Random(options["seed"])
+        arrivals, now = [], 0.0
+        for _ in range(options["rooms"]):
+            now += rng.expovariate(rate)
+            arrivals.append((now, rng.expovariate(1 / options["duration"])))
+
+        for label, queue in (("heap", AssignmentQueue()), ("linear", LinearQueue())):
+            elapsed, waits, peak = self.simulate(queue, arrivals, options["agents"], options["capacity"])
+            waits.sort()
+            self.stdout.write(
+                f"{label:>7}: rooms={len(waits)} agents={options['agents']} capacity={options['capacity']} "
+                f"wall={elapsed * 1000:.1f}ms ({elapsed / len(waits) * 1e6:.1f}us/room) "
+                f"wait mean={statistics.fmean(waits):.0f}s p95={waits[int(len(waits) * 0.95)]:.0f}s "
+                f"max={waits[-1]:.0f}s peak load={peak}"
+            )
+            if peak > options["capacity"]:
+                raise CommandError(f"{label}: an agent went over capacity.")
+
+    def simulate(self, queue, arrivals, agents, capacity):
+        """
+        Replay ``arrivals`` as a discrete event simulation and return the
+        wall time spent in the queue, every room's wait and the highest
+        load seen.
+        """
+        for agent_id in range(agents):
+            queue.add_agent(agent_id, capacity)
+        # (time, kind, id): kind 0 closes the chat of agent ``id``, 1 opens room ``id``
+        events = [(at, 1, room_id) for room_id, (at, _) in enumerate(arrivals)]
+        heapq.heapify(events)
+        waits, peak, elapsed = [], 0, 0.0
+        while events:
+            now, kind, pk = heapq.heappop(events)
+            start = time.perf_counter()
+            if kind == 1:
+                queue.add_room(pk, now)
+            else:
+                queue.release(pk)
+            assigned = []
+            while (pair := queue.pop()) is not None:
+                assigned.append(pair)
+            elapsed += time.perf_counter() - start
+            for room_id, agent_id in assigned:
+                arrived_at, duration = arrivals[room_id]
+                waits.append(now - arrived_at)
+                peak = max(peak, queue.load(agent_id))
+                heapq.heappush(events, (now + duration, 0, agent_id))
+        return elapsed, waits, peak
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+# Both statements scan the table once instead of loading every message.
+NUMBER_MESSAGES = """
+    UPDATE sage_ref_chatmessage SET sequence = numbered.sequence
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY room_id ORDER BY timestamp, id) AS sequence
+        FROM sage_ref_chatmessage
+    ) AS numbered
+    WHERE sage_ref_chatmessage.id = numbered.id
+"""
+COUNT_MESSAGES = """
+    UPDATE sage_ref_room SET last_sequence = (
+        SELECT COUNT(*) FROM sage_ref_chatmessage WHERE sage_ref_chatmessage.room_id = sage_ref_room.id
+    )
+"""
+BATCH_SIZE = 2000
+
+
+def number_existing_messages(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(NUMBER_MESSAGES)
+        schema_editor.execute(COUNT_MESSAGES)
+        return
+    # Elsewhere one room at a time, a batch of messages at a time
+    Room = apps.get_model('sage_ref', 'Room')
+    ChatMessage = apps.get_model('sage_ref', 'ChatMessage')
+    for room_id in Room.objects.values_list('pk', flat=True).iterator():
+        messages = ChatMessage.objects.filter(room_id=room_id).order_by('timestamp', 'id').only('id')
+        batch, sequence = [], 0
+        for message in messages.iterator(chunk_size=BATCH_SIZE):
+            sequence += 1
+            message.sequence = sequence
+            batch.append(message)
+            if len(batch) == BATCH_SIZE:
+                ChatMessage.objects.bulk_update(batch, ['sequence'])
+                batch = []
+        ChatMessage.objects.bulk_update(batch, ['sequence'])
+        Room.objects.filter(pk=room_id).update(last_sequence=sequence)
+
+
+class Migration(migrations.Migration):
+
+    # The new columns are committed before the renumbering, so the tables
+    # are not locked against reads and writes until every row is numbered.
+    atomic = False
+
+    dependencies = [
+        ('sage_ref', '0004_room_agent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='sequence',
+            field=models.PositiveBigIntegerField(db_comment='Per-room increasing number assigned when the message is stored.', default=0, help_text='The position of this message within its room.', verbose_name='Sequence'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_sequence',
+            field=models.PositiveBigIntegerField(db_comment='Per-room message counter used to order and gap-check delivered messages.', default=0, help_text='The sequence number of the latest message in this room.', verbose_name='Last Sequence'),
+        ),
+        migrations.RunPython(number_existing_messages, migrations.RunPython.noop),
+    ]
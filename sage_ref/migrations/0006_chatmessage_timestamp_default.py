@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sage_ref', '0005_room_last_sequence_chatmessage_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='timestamp',
+            field=models.DateTimeField(db_comment='The date and time when this message was created.', default=django.utils.timezone.now, editable=False, help_text='The time this message was sent.', verbose_name='Timestamp'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:45
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def rename_duplicate_rooms(apps, schema_editor):
+    # Rooms sharing a name keep their messages; every copy but the oldest
+    # gets its id appended so the name can become unique.
+    Room = apps.get_model('sage_ref', 'Room')
+    duplicates = Room.objects.values('name').annotate(count=Count('id'), first=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        rooms = Room.objects.filter(name=duplicate['name']).exclude(pk=duplicate['first'])
+        for room in rooms:
+            Room.objects.filter(pk=room.pk).update(name=f"{room.name[:240]}-{room.pk}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sage_ref', '0006_chatmessage_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_rooms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+from sage_ref.helpers.migrations import ConcurrentAlterFieldUnique
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('sage_ref', '0007_dedupe_room_names'),
+    ]
+
+    operations = [
+        ConcurrentAlterFieldUnique(
+            model_name='room',
+            name='name',
+            field=models.CharField(db_comment='The name assigned to this chat room.', help_text='The name of the chat room.', max_length=255, unique=True, verbose_name='Room Name'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+from sage_ref.helpers.migrations import ConcurrentAddIndex
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('sage_ref', '0008_alter_room_name'),
+    ]
+
+    operations = [
+        ConcurrentAddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'timestamp', 'id'], name='sage_ref_msg_room_ts_idx'),
+        ),
+        ConcurrentAddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'sequence'], name='sage_ref_msg_room_seq_idx'),
+        ),
+    ]
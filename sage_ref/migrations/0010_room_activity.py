@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sage_ref', '0009_chatmessage_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_author',
+            field=models.CharField(blank=True, db_comment="Username of the latest message's author, or Anonymous.", default='', help_text='Who sent the latest message.', max_length=150, verbose_name='Last Author'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, db_comment='Timestamp of the latest message, used to sort the agent inbox.', help_text='The time the latest message was sent.', null=True, verbose_name='Last Message At'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_message_preview',
+            field=models.CharField(blank=True, db_comment='Truncated text of the latest message.', default='', help_text='The beginning of the latest message.', max_length=255, verbose_name='Last Message Preview'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='message_count',
+            field=models.PositiveIntegerField(db_comment='Maintained on every message write; rebuilt by backfill_room_activity.', default=0, help_text='The number of messages sent in this room.', verbose_name='Message Count'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sage_ref', '0011_room_activity_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='unread_count',
+            field=models.PositiveIntegerField(db_comment='Reset when an agent posts, incremented for every other message.', default=0, help_text='Messages from the visitor since the agent last replied.', verbose_name='Unread Count'),
+        ),
+    ]
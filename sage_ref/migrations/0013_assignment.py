@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sage_ref', '0012_room_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='capacity',
+            field=models.PositiveSmallIntegerField(db_comment='Open rooms the scheduler assigns to this agent before marking it busy.', default=5, help_text='How many chats the agent handles at the same time.', verbose_name='Capacity'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, db_comment='Set when an agent closes the chat; cleared when the visitor writes again.', help_text='The time the chat was closed.', null=True, verbose_name='Closed At'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='waiting_since',
+            field=models.DateTimeField(blank=True, db_comment='Set while the room is queued for assignment, cleared once an agent is assigned.', help_text='When the visitor started waiting for an agent.', null=True, verbose_name='Waiting Since'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+from sage_ref.helpers.migrations import ConcurrentAddIndex
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('sage_ref', '0013_assignment'),
+    ]
+
+    operations = [
+        ConcurrentAddIndex(
+            model_name='room',
+            index=models.Index(fields=['waiting_since', 'id'], name='sage_ref_room_waiting_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# SQLite: an FTS5 index over the message column, kept in step with the
+# table by triggers. Rows already in the table are indexed by
+# ``manage.py rebuild_search_index``.
+SQLITE_FORWARDS = [
+    """
+    CREATE VIRTUAL TABLE sage_ref_message_search USING fts5(
+        message,
+        content='sage_ref_chatmessage',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER sage_ref_message_search_insert AFTER INSERT ON sage_ref_chatmessage BEGIN
+        INSERT INTO sage_ref_message_search(rowid, message) VALUES (new.id, new.message);
+    END
+    """,
+    """
+    CREATE TRIGGER sage_ref_message_search_delete AFTER DELETE ON sage_ref_chatmessage BEGIN
+        INSERT INTO sage_ref_message_search(sage_ref_message_search, rowid, message)
+        VALUES ('delete', old.id, old.message);
+    END
+    """,
+    """
+    CREATE TRIGGER sage_ref_message_search_update AFTER UPDATE OF message ON sage_ref_chatmessage BEGIN
+        INSERT INTO sage_ref_message_search(sage_ref_message_search, rowid, message)
+        VALUES ('delete', old.id, old.message);
+        INSERT INTO sage_ref_message_search(rowid, message) VALUES (new.id, new.message);
+    END
+    """,
+]
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS sage_ref_message_search_update",
+    "DROP TRIGGER IF EXISTS sage_ref_message_search_delete",
+    "DROP TRIGGER IF EXISTS sage_ref_message_search_insert",
+    "DROP TABLE IF EXISTS sage_ref_message_search",
+]
+
+# PostgreSQL: a GIN index on the message's tsvector. It is an expression
+# index, so it is current without triggers and built over existing rows.
+POSTGRESQL_FORWARDS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS sage_ref_msg_search_idx "
+    "ON sage_ref_chatmessage USING gin (to_tsvector('simple', message))",
+]
+POSTGRESQL_BACKWARDS = [
+    "DROP INDEX CONCURRENTLY IF EXISTS sage_ref_msg_search_idx",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('sage_ref', '0014_room_waiting_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRESQL_FORWARDS}),
+            _run({'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRESQL_BACKWARDS}),
+        ),
+    ]
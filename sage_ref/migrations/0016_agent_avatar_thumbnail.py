@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sage_ref', '0015_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='avatar_thumbnail',
+            field=models.ImageField(blank=True, db_comment='Content-addressed thumbnail variant of the avatar, empty until it is made.', editable=False, help_text='Small copy of the avatar shown in chats, made in the background.', upload_to='thumbnails/', verbose_name='Avatar thumbnail'),
+        ),
+    ]
@@ -33,7 +33,20 @@ class Agent(models.Model):
         help_text="Upload an avatar for the agent. This will be displayed in the chat interface.",
         db_comment="Stores the avatar image for the agent."
     )
-    
+    avatar_thumbnail = models.ImageField(
+        upload_to="thumbnails/",
+        blank=True,
+        editable=False,
+        verbose_name=_("Avatar thumbnail"),
+        help_text=_("Small copy of the avatar shown in chats, made in the background."),
+        db_comment="Content-addressed thumbnail variant of the avatar, empty until it is made."
+    )
+    capacity = models.PositiveSmallIntegerField(
+        default=5,
+        verbose_name=_("Capacity"),
+        help_text=_("How many chats the agent handles at the same time."),
+        db_comment="Open rooms the scheduler assigns to this agent before marking it busy."
+    )
 
     class Meta:
         verbose_name = _("Sage_Agent")
@@ -42,5 +55,14 @@ class Agent(models.Model):
     def __str__(self):
         return self.user.username
 
+    @property
+    def avatar_url(self):
+        """
+        The avatar's thumbnail, or the original until the thumbnail exists.
+        """
+        if self.avatar_thumbnail:
+            return self.avatar_thumbnail.url
+        return self.avatar.url if self.avatar else ""
+
     def __repr__(self):
         return f"<Sage_Agent(user={self.user.username}, status={self.status}, joined_at={self.joined_at})>"
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
@@ -43,7 +44,8 @@ class ChatMessage(models.Model):
         db_comment="The actual text content of the message sent in the chat."
     )
     timestamp = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
+        editable=False,
         verbose_name=_("Timestamp"),
         help_text=_("The time this message was sent."),
         db_comment="The date and time when this message was created."
@@ -56,10 +58,22 @@ class ChatMessage(models.Model):
         help_text=_("Session key for anonymous users."),
         db_comment="The session key of the anonymous user (if not authenticated)."
     )
+    sequence = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name=_("Sequence"),
+        help_text=_("The position of this message within its room."),
+        db_comment="Per-room increasing number assigned when the message is stored."
+    )
 
     class Meta:
         verbose_name = _("Chat Message")
         verbose_name_plural = _("Chat Messages")
+        indexes = [
+            # Latest messages of a room, newest first
+            models.Index(fields=["room", "timestamp", "id"], name="sage_ref_msg_room_ts_idx"),
+            # Messages a reconnecting client missed
+            models.Index(fields=["room", "sequence"], name="sage_ref_msg_room_seq_idx"),
+        ]
 
     def __str__(self):
         return f"Message by {self.agent} in Room {self.room} at {self.timestamp}"
@@ -4,6 +4,7 @@ from django.utils.translation import gettext_lazy as _
 class Room(models.Model):
     name = models.CharField(
         max_length=255,
+        unique=True,
         verbose_name=_("Room Name"),
         help_text=_("The name of the chat room."),
         db_comment="The name assigned to this chat room."
@@ -24,10 +25,71 @@ class Room(models.Model):
         help_text=_("The agent who come to this room."),
         db_comment="References the agent who come to this room."
     )
+    last_sequence = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name=_("Last Sequence"),
+        help_text=_("The sequence number of the latest message in this room."),
+        db_comment="Per-room message counter used to order and gap-check delivered messages."
+    )
+    message_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Message Count"),
+        help_text=_("The number of messages sent in this room."),
+        db_comment="Maintained on every message write; rebuilt by backfill_room_activity."
+    )
+    unread_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Unread Count"),
+        help_text=_("Messages from the visitor since the agent last replied."),
+        db_comment="Reset when an agent posts, incremented for every other message."
+    )
+    last_message_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Last Message At"),
+        help_text=_("The time the latest message was sent."),
+        db_comment="Timestamp of the latest message, used to sort the agent inbox."
+    )
+    last_message_preview = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        verbose_name=_("Last Message Preview"),
+        help_text=_("The beginning of the latest message."),
+        db_comment="Truncated text of the latest message."
+    )
+    last_author = models.CharField(
+        max_length=150,
+        blank=True,
+        default="",
+        verbose_name=_("Last Author"),
+        help_text=_("Who sent the latest message."),
+        db_comment="Username of the latest message's author, or Anonymous."
+    )
+    waiting_since = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Waiting Since"),
+        help_text=_("When the visitor started waiting for an agent."),
+        db_comment="Set while the room is queued for assignment, cleared once an agent is assigned."
+    )
+    closed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Closed At"),
+        help_text=_("The time the chat was closed."),
+        db_comment="Set when an agent closes the chat; cleared when the visitor writes again."
+    )
 
     class Meta:
         verbose_name = _("Room")
         verbose_name_plural = _("Rooms")
+        indexes = [
+            # Agent inbox, most recently active rooms first
+            models.Index(fields=["-last_message_at", "-id"], name="sage_ref_room_activity_idx"),
+            # Assignment queue, longest waiting rooms first
+            models.Index(fields=["waiting_since", "id"], name="sage_ref_room_waiting_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -1,8 +1,21 @@
 # chat/routing.py
+from django.conf import settings
 from django.urls import path
 from sage_ref.service.consumer import ChatConsumer
+from sage_ref.service.async_consumer import AsyncChatConsumer
+from sage_ref.service.inbox_consumer import AgentInboxConsumer
+from sage_ref.service.multiplex_consumer import AgentMultiplexConsumer
+
+# ``SAGE_REF_ASYNC_CONSUMER = False`` falls back to the thread-per-socket
+# ``ChatConsumer``.
+if getattr(settings, "SAGE_REF_ASYNC_CONSUMER", True):
+    chat_consumer = AsyncChatConsumer
+else:
+    chat_consumer = ChatConsumer
 
 websocket_urlpatterns = [
-    path("ws/chatroom/<str:chatroom_name>/", ChatConsumer.as_asgi()),
+    path("ws/chatroom/<str:chatroom_name>/", chat_consumer.as_asgi()),
+    path("ws/agent/inbox/", AgentInboxConsumer.as_asgi()),
+    path("ws/agent/", AgentMultiplexConsumer.as_asgi()),
 
 ]
@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from types import SimpleNamespace
+from channels.layers import get_channel_layer
+from django.dispatch import Signal
+from sage_ref.models.agent import Agent
+from sage_ref.models.room import Room
+from sage_ref.helpers.enums import AgentStatus
+from sage_ref.service.presence import PresenceSession, presence
+from sage_ref.service.room_directory import room_directory
+
+# Sent (with ``asend``) when an agent's first socket connects and when its
+# last one closes, with ``agent`` and ``online``. Unlike the status, this
+# always matches the live sockets, even if the stored status was stale.
+agent_presence_changed = Signal()
+
+
+@dataclass(frozen=True)
+class AgentState:
+    """
+    Plain data view of an agent, enough to render ``agent_info.html``
+    without touching the database.
+    """
+    id: int
+    username: str
+    status: str
+    avatar_url: str
+
+    def __str__(self):
+        return self.username
+
+    @property
+    def avatar(self):
+        return SimpleNamespace(url=self.avatar_url)
+
+    @classmethod
+    def from_agent(cls, agent, status=None):
+        return cls(
+            id=agent.pk,
+            username=agent.user.username,
+            status=status or agent.status,
+            avatar_url=agent.avatar_url,
+        )
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'status': self.status,
+            'avatar_url': self.avatar_url,
+        }
+
+    def as_event(self):
+        return {
+            'type': 'agent_status_update',
+            'disconnect': self.status == AgentStatus.OFFLINE,
+            'agent': self.as_dict(),
+        }
+
+
+class AgentStatusTracker:
+    """
+    The only component that writes ``Agent.status``.
+
+    Every agent socket (any tab, any room) is counted through the presence
+    backend under ``agent:<id>``. The agent goes ONLINE when its first
+    socket connects and OFFLINE when its last one closes; BUSY is set
+    explicitly by the assignment scheduler. Each real transition is persisted with one conditional
+    UPDATE and broadcast as data to every room the agent is assigned to.
+
+    When the agent comes online, the scheduler picks ONLINE or BUSY from
+    its open chats, so an agent back at capacity goes straight to BUSY.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or presence
+
+    def session(self, agent, connection):
+        return PresenceSession(f"agent:{agent.pk}", connection, backend=self.backend)
+
+    async def connect(self, agent, session):
+        if await session.start():
+            await agent_presence_changed.asend(sender=Agent, agent=agent, online=True)
+            # ONLINE unless the scheduler set a status or the agent has left
+            if agent.status == AgentStatus.OFFLINE and await self.backend.count(session.identifier):
+                await self.transition(agent, AgentStatus.ONLINE)
+
+    async def disconnect(self, agent, session):
+        if await session.stop():
+            await self.transition(agent, AgentStatus.OFFLINE)
+            await agent_presence_changed.asend(sender=Agent, agent=agent, online=False)
+
+    async def transition(self, agent, status):
+        """
+        Move the agent to ``status``; return ``True`` if it was a real change.
+
+        The UPDATE only matches when the stored status differs, so racing
+        workers cannot both persist or announce the same transition.
+        """
+        updated = await Agent.objects.filter(pk=agent.pk).exclude(status=status).aupdate(status=status)
+        if not updated:
+            return False
+        agent.status = status
+        await self.broadcast(AgentState.from_agent(agent, status))
+        return True
+
+    async def broadcast(self, state):
+        channel_layer = get_channel_layer()
+        event = state.as_event()
+        names = [name async for name in Room.objects.filter(agent_id=state.id).values_list('name', flat=True)]
+        if names:
+            # Cached room snapshots carry the agent's status
+            await room_directory.ainvalidate(*names)
+        for name in names:
+            group = f'chat_{name}'
+            await channel_layer.group_send(group, dict(event, group=group))
+
+
+agent_status_tracker = AgentStatusTracker()
+
+
+def agent_state_from_event(event):
+    return AgentState(**event['agent'])
@@ -0,0 +1,306 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from sage_ref.models.chat import ChatMessage
+from sage_ref.models.room import Room
+
+User = get_user_model()
+
+ARCHIVE = getattr(settings, "SAGE_REF_ARCHIVE", {})
+# Where segment files are written. Keep it out of a publicly served
+# MEDIA_ROOT in production.
+ARCHIVE_DIRECTORY = ARCHIVE.get("DIRECTORY") or os.path.join(settings.MEDIA_ROOT, "chat_archive")
+# Messages older than this many seconds are archived...
+ARCHIVE_AGE = ARCHIVE.get("AGE", 90 * 24 * 60 * 60)
+# ...except for each room's latest messages, so the live window never
+# needs the archive.
+ARCHIVE_KEEP = ARCHIVE.get("KEEP", getattr(settings, "SAGE_REF_HISTORY_SIZE", 50))
+# Messages per compressed block, and per delete transaction.
+ARCHIVE_BATCH_SIZE = ARCHIVE.get("BATCH_SIZE", 1000)
+# Rooms whose segment index is kept in memory, least recently read
+# dropped first.
+ARCHIVE_INDEX_CACHE_SIZE = ARCHIVE.get("INDEX_CACHE_SIZE", 1024)
+
+
+def _key(message):
+    return message.timestamp, message.pk
+
+
+@dataclass
+class ArchiveStats:
+    rooms: int = 0
+    rows: int = 0
+    raw_bytes: int = 0
+    stored_bytes: int = 0
+
+    def add(self, other):
+        self.rooms += other.rooms
+        self.rows += other.rows
+        self.raw_bytes += other.raw_bytes
+        self.stored_bytes += other.stored_bytes
+
+
+@dataclass(frozen=True)
+class Block:
+    """
+    One entry of a segment's index: where a compressed block starts and
+    the ``(timestamp, id)`` range of the messages in it.
+    """
+    offset: int
+    length: int
+    count: int
+    first: tuple
+    last: tuple
+
+    @classmethod
+    def from_line(cls, line):
+        data = json.loads(line)
+        return cls(
+            offset=data['offset'],
+            length=data['length'],
+            count=data['count'],
+            first=(datetime.fromisoformat(data['first'][0]), data['first'][1]),
+            last=(datetime.fromisoformat(data['last'][0]), data['last'][1]),
+        )
+
+    def as_line(self):
+        return json.dumps({
+            'offset': self.offset,
+            'length': self.length,
+            'count': self.count,
+            'first': [self.first[0].isoformat(), self.first[1]],
+            'last': [self.last[0].isoformat(), self.last[1]],
+        }) + "\n"
+
+
+class MessageArchive:
+    """
+    Append-only archive of old chat messages, one segment per room.
+
+    ``<room id>.seg`` is a series of gzip members, each holding a block of
+    messages as JSON lines in ``(timestamp, id)`` order. ``<room id>.idx``
+    has one line per block with its offset and key range, and is written
+    after the block, so a block only counts once it is indexed. Readers
+    look blocks up in the index and decompress only the ones they need.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIRECTORY, index_cache_size=ARCHIVE_INDEX_CACHE_SIZE):
+        self.directory = str(directory)
+        self.index_cache_size = index_cache_size
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, room_id, suffix):
+        return os.path.join(self.directory, f"{room_id // 1000:04d}", f"{room_id}{suffix}")
+
+    def index(self, room_id):
+        """
+        The room's blocks, oldest first; empty if nothing was archived.
+        """
+        path = self.path(room_id, ".idx")
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return []
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._indexes.get(room_id)
+            if cached is not None and cached[0] == version:
+                self._indexes.move_to_end(room_id)
+                return cached[1]
+        with open(path) as f:
+            blocks = [Block.from_line(line) for line in f if line.strip()]
+        with self._lock:
+            self._indexes[room_id] = (version, blocks)
+            self._indexes.move_to_end(room_id)
+            while len(self._indexes) > self.index_cache_size:
+                self._indexes.popitem(last=False)
+        return blocks
+
+    def count(self, room_id):
+        return sum(block.count for block in self.index(room_id))
+
+    def last_key(self, room_id):
+        blocks = self.index(room_id)
+        return blocks[-1].last if blocks else None
+
+    def append(self, room_id, messages):
+        """
+        Store ``messages`` (oldest first) as a new block; return the raw and
+        the compressed size in bytes.
+        """
+        raw = "".join(json.dumps({
+            'id': message.pk,
+            'timestamp': message.timestamp.isoformat(),
+            'sequence': message.sequence,
+            'author': message.author_id,
+            'agent': message.agent_id,
+            'session_key': message.session_key,
+            'message': message.message,
+        }) + "\n" for message in messages).encode()
+        data = gzip.compress(raw, mtime=0)
+        os.makedirs(os.path.dirname(self.path(room_id, ".seg")), exist_ok=True)
+        with open(self.path(room_id, ".seg"), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        block = Block(offset, len(data), len(messages), _key(messages[0]), _key(messages[-1]))
+        with open(self.path(room_id, ".idx"), "a") as f:
+            f.write(block.as_line())
+            f.flush()
+            os.fsync(f.fileno())
+        return len(raw), len(data)
+
+    def read_records(self, room_id, block):
+        with open(self.path(room_id, ".seg"), "rb") as f:
+            f.seek(block.offset)
+            data = gzip.decompress(f.read(block.length))
+        return [json.loads(line) for line in data.splitlines()]
+
+    def records(self, room_id, since=None, until=None):
+        """
+        The raw records of the room's archived messages sent in
+        ``[since, until)``, oldest first, one block in memory at a time.
+        """
+        for block in self.index(room_id):
+            if (since is not None and block.last[0] < since) or (until is not None and block.first[0] >= until):
+                continue
+            for record in self.read_records(room_id, block):
+                timestamp = datetime.fromisoformat(record['timestamp'])
+                if (since is None or timestamp >= since) and (until is None or timestamp < until):
+                    yield record
+
+    def read_block(self, room_id, block):
+        return [
+            ChatMessage(
+                pk=record['id'],
+                room_id=room_id,
+                timestamp=datetime.fromisoformat(record['timestamp']),
+                sequence=record['sequence'],
+                author_id=record['author'],
+                agent_id=record['agent'],
+                session_key=record['session_key'],
+                message=record['message'],
+            )
+            for record in self.read_records(room_id, block)
+        ]
+
+    def before(self, room_id, key, limit):
+        """
+        Up to ``limit`` archived messages older than ``key``, oldest first,
+        and whether there are more beyond them.
+        """
+        if limit == 0:
+            return [], any(key is None or block.first < key for block in self.index(room_id))
+        messages = []
+        for block in reversed(self.index(room_id)):
+            if key is not None and block.first >= key:
+                continue
+            older = [m for m in self.read_block(room_id, block) if key is None or _key(m) < key]
+            messages = older + messages
+            if len(messages) > limit:
+                break
+        return self._with_authors(messages[-limit:]), len(messages) > limit
+
+    def after(self, room_id, key, limit):
+        """
+        Up to ``limit`` archived messages newer than ``key``, oldest first,
+        and whether the archive has more beyond them.
+        """
+        messages = []
+        for block in self.index(room_id):
+            if block.last <= key:
+                continue
+            messages += [m for m in self.read_block(room_id, block) if _key(m) > key]
+            if len(messages) > limit:
+                break
+        return self._with_authors(messages[:limit]), len(messages) > limit
+
+    def _with_authors(self, messages):
+        # One query for the page, like select_related on live messages
+        users = User.objects.in_bulk({m.author_id for m in messages if m.author_id})
+        for message in messages:
+            message.author = users.get(message.author_id)
+        return messages
+
+
+message_archive = MessageArchive()
+
+
+class MessageArchiver:
+    """
+    Moves old messages from the database into ``MessageArchive``.
+
+    Each block is written and indexed before its rows are deleted in their
+    own short transaction. Rows a crashed run had already indexed are
+    deleted first, so running again never archives a message twice.
+
+    ``Room.message_count`` is left alone: archived messages are still part
+    of the room's history, so the count includes them.
+    """
+
+    def __init__(self, archive=message_archive, keep=ARCHIVE_KEEP, batch_size=ARCHIVE_BATCH_SIZE):
+        self.archive = archive
+        self.keep = keep
+        self.batch_size = batch_size
+
+    def rooms(self, cutoff):
+        # Only rooms that can have messages older than the cutoff and more
+        # than the kept window
+        return Room.objects.filter(created_at__lt=cutoff, message_count__gt=self.keep).order_by('pk')
+
+    def boundary(self, room, cutoff):
+        """
+        The ``(timestamp, id)`` below which the room's messages are
+        archived, or ``None`` if the room has no more than the kept window.
+        """
+        if not self.keep:
+            return (cutoff, 0)
+        kept = ChatMessage.objects.filter(room=room).order_by('-timestamp', '-id').values_list('timestamp', 'id')
+        oldest_kept = list(kept[self.keep - 1:self.keep])
+        if not oldest_kept:
+            return None
+        return min(oldest_kept[0], (cutoff, 0))
+
+    def archive_room(self, room, cutoff, dry_run=False):
+        stats = ArchiveStats()
+        boundary = self.boundary(room, cutoff)
+        if boundary is None:
+            return stats
+        timestamp, pk = boundary
+        old = ChatMessage.objects.filter(room=room, timestamp__lte=timestamp).exclude(timestamp=timestamp, id__gte=pk)
+        if dry_run:
+            stats.rows = old.count()
+            stats.rooms = int(stats.rows > 0)
+            return stats
+        archived = self.archive.last_key(room.pk)
+        if archived is not None:
+            self.delete(old.filter(timestamp__lte=archived[0]).exclude(timestamp=archived[0], id__gt=archived[1]))
+        while True:
+            messages = list(old.order_by('timestamp', 'id')[:self.batch_size])
+            if not messages:
+                break
+            raw_bytes, stored_bytes = self.archive.append(room.pk, messages)
+            with transaction.atomic():
+                ChatMessage.objects.filter(pk__in=[message.pk for message in messages]).delete()
+            stats.rows += len(messages)
+            stats.raw_bytes += raw_bytes
+            stats.stored_bytes += stored_bytes
+        stats.rooms = int(stats.rows > 0)
+        return stats
+
+    def delete(self, queryset):
+        while True:
+            pks = list(queryset.values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                return
+            with transaction.atomic():
+                ChatMessage.objects.filter(pk__in=pks).delete()
@@ -0,0 +1,266 @@
+import heapq
+import itertools
+from channels.layers import get_channel_layer
+from django.core.exceptions import PermissionDenied
+from django.utils import timezone
+from sage_ref.helpers.enums import AgentStatus
+from sage_ref.models.room import Room
+from sage_ref.service.agent_status import AgentState, agent_status_tracker
+from sage_ref.service.inbox import notify_inbox
+from sage_ref.service.room_directory import room_directory
+
+
+class AssignmentQueue:
+    """
+    Waiting rooms and available agents, without any I/O.
+
+    Rooms sit in a min-heap on the time they started waiting. Agents with
+    spare capacity sit in a min-heap on their number of open chats, ties
+    going to the agent whose load changed longest ago. Changes push a new
+    heap entry and outdated entries are dropped when they reach the top,
+    so every operation is O(log n).
+    """
+
+    def __init__(self):
+        self._rooms = []
+        self._waiting = {}
+        self._agents = []
+        # agent id -> [load, capacity, stamp of its live heap entry]
+        self._loads = {}
+        self._stamps = itertools.count()
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def is_waiting(self, room_id):
+        return room_id in self._waiting
+
+    def add_room(self, room_id, waiting_since):
+        if room_id not in self._waiting:
+            self._waiting[room_id] = waiting_since
+            heapq.heappush(self._rooms, (waiting_since, room_id))
+
+    def remove_room(self, room_id):
+        self._waiting.pop(room_id, None)
+
+    def add_agent(self, agent_id, capacity, load=0):
+        self._loads[agent_id] = [load, capacity, None]
+        self._push_agent(agent_id)
+
+    def remove_agent(self, agent_id):
+        self._loads.pop(agent_id, None)
+
+    def load(self, agent_id):
+        entry = self._loads.get(agent_id)
+        return entry[0] if entry else 0
+
+    def is_full(self, agent_id):
+        entry = self._loads.get(agent_id)
+        return entry is not None and entry[0] >= entry[1]
+
+    def release(self, agent_id):
+        """
+        Free one of the agent's chats.
+        """
+        entry = self._loads.get(agent_id)
+        if entry is not None and entry[0] > 0:
+            entry[0] -= 1
+            self._push_agent(agent_id)
+
+    def pop(self):
+        """
+        Pair the longest waiting room with the least loaded agent that has
+        capacity left and count the chat in the agent's load.
+
+        Returns ``(room_id, agent_id)``, or ``None`` if no room is waiting
+        or every agent is full.
+        """
+        room_id = self._peek_room()
+        agent_id = self._peek_agent() if room_id is not None else None
+        if agent_id is None:
+            return None
+        heapq.heappop(self._rooms)
+        del self._waiting[room_id]
+        heapq.heappop(self._agents)
+        self._loads[agent_id][0] += 1
+        self._push_agent(agent_id)
+        return room_id, agent_id
+
+    def _peek_room(self):
+        while self._rooms:
+            waiting_since, room_id = self._rooms[0]
+            if self._waiting.get(room_id) == waiting_since:
+                return room_id
+            heapq.heappop(self._rooms)
+        return None
+
+    def _peek_agent(self):
+        while self._agents:
+            _, stamp, agent_id = self._agents[0]
+            entry = self._loads.get(agent_id)
+            if entry is not None and entry[2] == stamp:
+                return agent_id
+            heapq.heappop(self._agents)
+        return None
+
+    def _push_agent(self, agent_id):
+        entry = self._loads[agent_id]
+        entry[2] = next(self._stamps)
+        if entry[0] < entry[1]:
+            heapq.heappush(self._agents, (entry[0], entry[2], agent_id))
+        if len(self._agents) > 2 * len(self._loads) + 64:
+            # Outdated entries only leave at the top; rebuild before they pile up
+            self._agents = [
+                (load, stamp, pk) for pk, (load, capacity, stamp) in self._loads.items() if load < capacity
+            ]
+            heapq.heapify(self._agents)
+
+
+class AssignmentScheduler:
+    """
+    Assigns waiting rooms to online agents as their capacity frees up, and
+    moves agents between ONLINE and BUSY as they fill up and free up.
+
+    A room starts waiting with the first visitor message while it has no
+    agent and stops when it is assigned. Closing a chat unassigns the room
+    and frees the agent's slot.
+
+    The queue lives in this process and is only touched from the event
+    loop, so like the in-memory presence backend it is only correct with a
+    single worker. Every step changes the queue before it awaits, so
+    concurrent calls never see it half updated, and the conditional
+    UPDATEs keep a room from being assigned twice.
+    """
+
+    def __init__(self):
+        self.queue = AssignmentQueue()
+        self.agents = {}
+        self._loaded = False
+
+    async def load(self):
+        # Rooms left waiting by a previous process, read through the waiting index
+        if self._loaded:
+            return
+        self._loaded = True
+        waiting = Room.objects.filter(agent__isnull=True, waiting_since__isnull=False)
+        async for pk, waiting_since in waiting.order_by('waiting_since', 'id').values_list('pk', 'waiting_since'):
+            self.queue.add_room(pk, waiting_since)
+
+    async def agent_online(self, agent):
+        if agent.pk in self.agents:
+            return
+        # Claimed before awaiting, so a second socket coming up meanwhile
+        # does not add the agent again
+        self.agents[agent.pk] = agent
+        await self.load()
+        load = await Room.objects.filter(agent_id=agent.pk, closed_at__isnull=True).acount()
+        if self.agents.get(agent.pk) is not agent:
+            # Went offline while its load was being counted
+            return
+        self.queue.add_agent(agent.pk, agent.capacity, load)
+        await self.dispatch()
+        await self.update_status(agent)
+
+    async def agent_offline(self, agent):
+        # Open chats stay assigned and count again when the agent is back
+        self.agents.pop(agent.pk, None)
+        self.queue.remove_agent(agent.pk)
+
+    async def enqueue(self, room):
+        """
+        Queue ``room`` for an agent, reopening it if it was closed.
+
+        Called for every visitor message in a room without an agent; only
+        the first one costs a query.
+        """
+        await self.load()
+        if self.queue.is_waiting(room.pk):
+            return
+        now = timezone.now()
+        queued = await Room.objects.filter(
+            pk=room.pk, agent__isnull=True, waiting_since__isnull=True
+        ).aupdate(waiting_since=now, closed_at=None)
+        if queued:
+            self.queue.add_room(room.pk, now)
+            await self.dispatch()
+
+    async def close(self, room, user):
+        """
+        Close the chat in ``room`` on behalf of ``user`` and give its
+        agent's slot to the next waiting room. Return ``False`` if it was
+        already closed.
+
+        Only the agent assigned to the room or a staff member may close it;
+        anyone else gets ``PermissionDenied``.
+        """
+        now = timezone.now()
+        rooms = Room.objects.filter(pk=room.pk, closed_at__isnull=True)
+        # Checked in the UPDATE itself, so a room reassigned meanwhile is
+        # not closed by its previous agent
+        allowed = rooms if user.is_staff else rooms.filter(agent__user_id=user.pk)
+        closed = await allowed.aupdate(closed_at=now, agent=None, waiting_since=None)
+        if not closed:
+            if await rooms.aexists():
+                raise PermissionDenied
+            return False
+        self.queue.remove_room(room.pk)
+        agent_id = room.agent_id
+        room.closed_at, room.agent, room.waiting_since = now, None, None
+        await self.announce(room, None)
+        agent = self.agents.get(agent_id)
+        if agent is not None:
+            self.queue.release(agent_id)
+            await self.dispatch()
+            await self.update_status(agent)
+        return True
+
+    async def dispatch(self):
+        """
+        Assign waiting rooms for as long as an agent has capacity left, then
+        update the status of each agent that got any, once.
+        """
+        assigned_agents = {}
+        while (pair := self.queue.pop()) is not None:
+            room_id, agent_id = pair
+            agent = self.agents[agent_id]
+            assigned = await Room.objects.filter(pk=room_id, agent__isnull=True).aupdate(
+                agent=agent, waiting_since=None
+            )
+            if not assigned:
+                # Assigned elsewhere or deleted since it was queued
+                self.queue.release(agent_id)
+                continue
+            room = await Room.objects.aget(pk=room_id)
+            await self.announce(room, agent)
+            assigned_agents[agent.pk] = agent
+        for agent in assigned_agents.values():
+            await self.update_status(agent)
+
+    async def update_status(self, agent):
+        """
+        Mark the agent BUSY at capacity and ONLINE below it.
+        """
+        if agent.pk not in self.agents:
+            return
+        status = AgentStatus.BUSY if self.queue.is_full(agent.pk) else AgentStatus.ONLINE
+        if agent.status != status:
+            await agent_status_tracker.transition(agent, status)
+
+    async def announce(self, room, agent):
+        """
+        Tell the room's sockets and the agent inboxes who now handles the room.
+        """
+        await room_directory.ainvalidate(room.name)
+        state = AgentState.from_agent(agent) if agent else None
+        group = f'chat_{room.name}'
+        await get_channel_layer().group_send(group, {
+            'type': 'room_agent_update',
+            'room_id': room.pk,
+            'group': group,
+            'agent': state.as_dict() if state else None,
+        })
+        if room.last_message_at is not None:
+            await notify_inbox(room, state.username if state else "")
+
+
+assignment_scheduler = AssignmentScheduler()
@@ -0,0 +1,299 @@
+import json
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from asgiref.sync import sync_to_async
+from django.template.loader import render_to_string
+from sage_ref.models.room import Room
+from sage_ref.models.agent import Agent
+from sage_ref.service.agent_status import AgentState, agent_status_tracker, agent_state_from_event
+from sage_ref.helpers.visitors import anonymous_identity
+from sage_ref.service.assignment import assignment_scheduler
+from sage_ref.service.room_directory import RoomSnapshot, room_directory
+from sage_ref.service.inbox import notify_inbox
+from sage_ref.service.history import arecent_messages, amissed_messages, older_cursor
+from sage_ref.service.typing import TypingThrottle
+from sage_ref.service.write_behind import WRITE_BEHIND_ENABLED, message_writer
+from sage_ref.service.presence import (
+    PresenceSession,
+    diff_status,
+    presence,
+    presence_broadcaster,
+)
+from sage_ref.service.messages import (
+    DELTA_DELIVERY,
+    dropped_sequences,
+    post_message,
+    message_event,
+    message_fragment_context,
+    render_message_fragments,
+    requested_last_sequence,
+)
+from django.contrib.auth import get_user_model
+
+User = get_user_model()
+
+# Template rendering is CPU work, so it runs in the thread pool instead of
+# on the event loop. Contexts are fully loaded before rendering, so the
+# templates never touch the database from the worker thread.
+render_async = sync_to_async(render_to_string, thread_sensitive=False)
+render_fragments_async = sync_to_async(render_message_fragments, thread_sensitive=False)
+apost_message = database_sync_to_async(post_message)
+
+
+class AsyncChatConsumer(AsyncWebsocketConsumer):
+    """
+    Native asyncio version of ``ChatConsumer``.
+
+    Handles the same group events (``chat_message``, ``user_typing``,
+    ``agent_typing``, ``agent_status_update`` and ``client_status_update``)
+    without holding a sync worker thread per socket.
+    """
+
+    async def connect(self):
+        self.chatroom_name = self.scope['url_route']['kwargs']['chatroom_name']
+        self.room_group_name = f'chat_{self.chatroom_name}'
+        self.user = self.scope['user']
+
+        if not self.user.is_authenticated:
+            # The visitor id; stored as the messages' ``session_key``
+            self.session_key = anonymous_identity(self.scope['session'].session_key, self.scope.get('cookies', {}))
+            self.agent = None
+            self.is_agent = False
+            identifier = self.session_key
+        else:
+            self.session_key = None
+            self.agent = await Agent.objects.select_related('user').filter(user=self.user).afirst()
+            self.is_agent = self.agent is not None
+            identifier = self.user.username
+
+        # Loaded once from the room directory and kept for the whole connection
+        snapshot = await room_directory.aget(self.chatroom_name)
+        if snapshot is None:
+            if identifier != self.chatroom_name:
+                await self.close()
+                return
+            # The visitor's own room is only created with its first message
+            snapshot = RoomSnapshot.pending(self.chatroom_name)
+        self.set_room(snapshot)
+
+        self.presence = PresenceSession(identifier, self.channel_name)
+        self.typing = TypingThrottle(self.broadcast_typing)
+        if await self.presence.start():
+            await self.set_client_status("online", is_authenticated=self.user.is_authenticated)
+
+        await self.channel_layer.group_add(
+            self.room_group_name,
+            self.channel_name
+        )
+
+        # Mark agent online if applicable
+        if self.is_agent:
+            self.agent_session = agent_status_tracker.session(self.agent, self.channel_name)
+            await agent_status_tracker.connect(self.agent, self.agent_session)
+
+        await self.accept()
+
+        last_sequence = requested_last_sequence(self.scope)
+        if last_sequence is not None and self.room.pk is not None:
+            await self.resume(last_sequence)
+
+    def set_room(self, snapshot):
+        self.room_snapshot = snapshot
+        self.room = snapshot.as_room()
+        self.room_agent = AgentState(**snapshot.agent) if snapshot.agent else None
+
+    async def resume(self, last_sequence):
+        """
+        Bring a reconnecting client up to date: send only the messages after
+        ``last_sequence`` plus the current agent and client status.
+        """
+        self.room.last_sequence = await Room.objects.filter(pk=self.room.pk).values_list(
+            'last_sequence', flat=True
+        ).aget()
+        missed = await amissed_messages(self.room, last_sequence)
+        if missed is None:
+            await self.send_room_state()
+            return
+        if missed:
+            html_message = await render_fragments_async(missed, self.user)
+            await self.send(text_data=html_message)
+        if self.room_agent:
+            html_message = await render_async("agent_info.html", {'agent': self.room_agent})
+            await self.send(text_data=html_message)
+        html_message = await render_async("client_info.html", {
+            'client_status': await presence.status(self.chatroom_name),
+            'identifier': self.chatroom_name,
+            'is_authenticated': None,
+        })
+        await self.send(text_data=html_message)
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'room'):
+            return
+        await self.typing.stop()
+        await self.channel_layer.group_discard(
+            self.room_group_name,
+            self.channel_name
+        )
+
+        if await self.presence.stop():
+            await self.set_client_status("offline", is_authenticated=self.user.is_authenticated)
+        if self.is_agent:
+            await agent_status_tracker.disconnect(self.agent, self.agent_session)
+
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+        typing = text_data_json.get('typing', None)
+        message = text_data_json.get('message', '')
+
+        if typing is not None:
+            await self.typing.update(typing)
+            return
+
+        if not message:
+            return
+
+        await self.typing.stop()
+        if self.room.pk is None:
+            self.set_room(await room_directory.acreate(self.chatroom_name))
+        author = self.user if self.user.is_authenticated else None
+        session_key = None if author else self.session_key
+        if WRITE_BEHIND_ENABLED:
+            chat_message = await message_writer.asubmit(
+                self.room, message, author=author, session_key=session_key, agent=self.agent,
+                group=self.room_group_name, reply_channel=self.channel_name,
+            )
+        else:
+            chat_message = await apost_message(
+                self.room, message, author=author, session_key=session_key, agent=self.agent
+            )
+
+        await self.channel_layer.group_send(
+            self.room_group_name, message_event(chat_message, pending=WRITE_BEHIND_ENABLED)
+        )
+        if not WRITE_BEHIND_ENABLED:
+            # The write-behind flusher notifies the inbox once it has stored the batch
+            await notify_inbox(self.room, self.room_agent.username if self.room_agent else "")
+        if self.room.agent_id is None and not self.is_agent:
+            await assignment_scheduler.enqueue(self.room)
+
+    async def chat_message(self, event):
+        if DELTA_DELIVERY and 'sequence' in event:
+            await self.send_message_fragment(event)
+        else:
+            await self.send_room_state()
+
+    async def send_message_fragment(self, event):
+        context = message_fragment_context(event, self.user, self.session_key)
+        html_message = await render_async("chat_message.html", context)
+        await self.send(text_data=html_message)
+
+    async def message_ack(self, event):
+        # Sent to this socket only, once its messages have been stored
+        html_message = await render_async("message_ack.html", event)
+        await self.send(text_data=html_message)
+
+    async def message_dropped(self, event):
+        # Broadcast ahead of a write that failed
+        sequences = dropped_sequences(event, self.channel_name)
+        html_message = await render_async("message_dropped.html", {'sequences': sequences})
+        await self.send(text_data=html_message)
+
+    async def send_room_state(self):
+        if self.room.pk is None:
+            # Created meanwhile by another of the visitor's sockets
+            snapshot = await room_directory.aget(self.chatroom_name)
+            if snapshot is None:
+                return
+            self.set_room(snapshot)
+        messages = await arecent_messages(self.room)
+        first_message = messages[0] if messages else None
+        if first_message is None:
+            # Nothing said yet in a pending or just created room
+            username = "Anonymous"
+            first_identifier = self.chatroom_name
+        elif first_message.author:
+            username = getattr(first_message.author, User.USERNAME_FIELD, "Anonymous")
+            first_identifier = first_message.author.username
+        else:
+            username = "Anonymous"
+            first_identifier = first_message.session_key
+        is_agent = str(self.room_agent) == str(self.user.username)
+        context = {
+            'chatroom_name': self.chatroom_name,
+            'messages': messages,
+            'older_cursor': older_cursor(messages),
+            'user': self.user,
+            'agent': self.room_agent,
+            'room': self.room_snapshot,
+            'username': username,
+            'is_agent': is_agent,
+            'client_status': await presence.status(first_identifier),
+        }
+        html_message = await render_async("chat.html", context)
+        await self.send(text_data=html_message)
+
+    async def broadcast_typing(self, typing):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'agent_typing' if self.is_agent else 'user_typing',
+                'room_id': self.room.pk,
+                'username': self.user.username if self.user.is_authenticated else "Anonymous",
+                'typing': typing,
+            }
+        )
+
+    async def user_typing(self, event):
+        html_message = await render_async("type_agent.html", {'typing': event['typing'] is True})
+        await self.send(text_data=html_message)
+
+    async def agent_typing(self, event):
+        html_message = await render_async("typing2.html", {'typing': event['typing'] is True})
+        await self.send(text_data=html_message)
+
+    async def agent_status_update(self, event):
+        # The event carries the agent's new state, so nothing is re-read here
+        agent = agent_state_from_event(event)
+        if self.room.agent_id == agent.id:
+            self.room_agent = agent
+        html_message = await render_async("agent_info.html", {'agent': agent})
+        await self.send(text_data=html_message)
+
+    async def room_agent_update(self, event):
+        # The scheduler assigned the room, or the chat was closed
+        agent = agent_state_from_event(event) if event['agent'] else None
+        self.room.agent_id = agent.id if agent else None
+        self.room_agent = agent
+        if agent:
+            html_message = await render_async("agent_info.html", {'agent': agent})
+            await self.send(text_data=html_message)
+
+    async def set_client_status(self, status, is_authenticated):
+        """
+        Queue the client's online/offline status for the room's next
+        presence diff.
+        """
+        identifier = self.user.username if is_authenticated else self.session_key
+        await presence_broadcaster.changed(self.room_group_name, identifier, status)
+
+    async def presence_diff(self, event):
+        # The chat header only shows the room's own client
+        status = diff_status(event, self.chatroom_name)
+        if status is None:
+            return
+        html_message = await render_async("client_info.html", {
+            'client_status': status,
+            'identifier': self.chatroom_name,
+            'is_authenticated': None,
+        })
+        await self.send(text_data=html_message)
+
+    async def client_status_update(self, event):
+        context = {
+            'client_status': event['status'],
+            'identifier': event['identifier'],
+            'is_authenticated': event['is_authenticated'],
+        }
+        html_message = await render_async("client_info.html", context)
+        await self.send(text_data=html_message)
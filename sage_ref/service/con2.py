@@ -6,15 +6,18 @@ from django.shortcuts import get_object_or_404
 from sage_ref.models.room import Room
 from sage_ref.models.chat import ChatMessage
 from sage_ref.helpers.enums import AgentStatus
+from sage_ref.service.presence import (
+    PresenceSession,
+    diff_status,
+    presence,
+    presence_broadcaster,
+)
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-online_clients = {}
-
 class ChatConsumer(WebsocketConsumer):
     def connect(self):
-        global online_clients
         self.chatroom_name = self.scope['url_route']['kwargs']['chatroom_name']
         print(f"Chat room name: {self.chatroom_name}")
         self.room = get_object_or_404(Room, name=self.chatroom_name)
@@ -24,12 +27,12 @@ class ChatConsumer(WebsocketConsumer):
         if not self.user.is_authenticated:
             self.session_key = self.scope['session'].session_key
             identifier = self.session_key
-            self.set_client_status("online", is_authenticated=False)
         else:
             self.session_key = None
             identifier = self.user.username
-            self.set_client_status("online", is_authenticated=True)
-        online_clients[identifier] = "online"
+        self.presence = PresenceSession(identifier, self.channel_name)
+        if async_to_sync(self.presence.start)():
+            self.set_client_status("online", is_authenticated=self.user.is_authenticated)
 
         async_to_sync(self.channel_layer.group_add)(
             self.room_group_name,
@@ -45,18 +48,14 @@ class ChatConsumer(WebsocketConsumer):
         self.accept()
 
     def disconnect(self, close_code):
-        global online_clients
-        identifier = self.user.username if self.user.is_authenticated else self.session_key
-        online_clients[identifier] = "offline"
         async_to_sync(self.channel_layer.group_discard)(
             self.room_group_name,
             self.channel_name
         )
 
-        if not self.user.is_authenticated:
-            self.set_client_status("offline", is_authenticated=False)
-        elif self.user.is_authenticated:
-            self.set_client_status("offline", is_authenticated=True)
+        if async_to_sync(self.presence.stop)():
+            self.set_client_status("offline", is_authenticated=self.user.is_authenticated)
+        if self.user.is_authenticated:
             if hasattr(self.user, 'agent'):
                 self.room.agent.status = AgentStatus.OFFLINE
                 self.room.agent.save()
@@ -102,7 +101,6 @@ class ChatConsumer(WebsocketConsumer):
         )
 
     def chat_message(self, event):
-        global online_clients
         messages = list(ChatMessage.objects.filter(room=self.room).order_by('timestamp')[:50])
         first_message = messages[0]
         username = getattr(first_message.author, User.USERNAME_FIELD, "Anonymous") if first_message.author else "Anonymous"
@@ -115,7 +113,7 @@ class ChatConsumer(WebsocketConsumer):
             'room': self.room,
             'username': username,
             'is_agent': is_agent,
-            'client_status': online_clients.get(first_message.author.username),
+            'client_status': async_to_sync(presence.status)(first_message.author.username if first_message.author else first_message.session_key),
         }
         html_message = render_to_string("chat.html", context)
         self.send(text_data=html_message)
@@ -146,23 +144,20 @@ class ChatConsumer(WebsocketConsumer):
         self.send(text_data=html_message)
 
     def set_client_status(self, status, is_authenticated):
-        """
-        Broadcast the client's online/offline status to the agent.
-        """
-        if is_authenticated:
-            identifier = self.user.username
-        else:
-            identifier = self.session_key
+        identifier = self.user.username if is_authenticated else self.session_key
+        async_to_sync(presence_broadcaster.changed)(self.room_group_name, identifier, status)
 
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name,
-            {
-                'type': 'client_status_update',
-                'status': status,
-                'identifier': identifier,
-                'is_authenticated': is_authenticated,
-            }
-        )
+    def presence_diff(self, event):
+        # The chat header only shows the room's own client
+        status = diff_status(event, self.chatroom_name)
+        if status is None:
+            return
+        html_message = render_to_string("client_info.html", {
+            'client_status': status,
+            'identifier': self.chatroom_name,
+            'is_authenticated': None,
+        })
+        self.send(text_data=html_message)
 
     def client_status_update(self, event):
         status = event['status']
@@ -1,39 +1,68 @@
 import json
+import logging
 from channels.generic.websocket import WebsocketConsumer
 from asgiref.sync import async_to_sync
 from django.template.loader import render_to_string
-from django.shortcuts import get_object_or_404
 from sage_ref.models.room import Room
-from sage_ref.models.chat import ChatMessage
 from sage_ref.models.agent import  Agent
-from sage_ref.helpers.enums import AgentStatus
+from sage_ref.service.agent_status import AgentState, agent_status_tracker, agent_state_from_event
+from sage_ref.helpers.visitors import anonymous_identity
+from sage_ref.service.assignment import assignment_scheduler
+from sage_ref.service.room_directory import RoomSnapshot, room_directory
+from sage_ref.service.inbox import notify_inbox
+from sage_ref.service.history import recent_messages, missed_messages, older_cursor
+from sage_ref.service.typing import TypingThrottle
+from sage_ref.service.write_behind import WRITE_BEHIND_ENABLED, message_writer
+from sage_ref.service.presence import (
+    PresenceSession,
+    diff_status,
+    presence,
+    presence_broadcaster,
+)
+from sage_ref.service.messages import (
+    DELTA_DELIVERY,
+    dropped_sequences,
+    post_message,
+    message_event,
+    message_fragment_context,
+    render_message_fragments,
+    requested_last_sequence,
+)
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
-
-online_clients = {}
-
+logger = logging.getLogger(__name__)
 
 class ChatConsumer(WebsocketConsumer):
     def connect(self):
-        global online_clients
         self.chatroom_name = self.scope['url_route']['kwargs']['chatroom_name']
-        print(f"Chat room name: {self.chatroom_name}")
-        self.room = get_object_or_404(Room, name=self.chatroom_name)
+        logger.debug("Chat room name: %s", self.chatroom_name)
         self.room_group_name = f'chat_{self.chatroom_name}'
         self.user = self.scope['user']
 
         # Identify the user or session for tracking online status
         if not self.user.is_authenticated:
-            self.session_key = self.scope['session'].session_key
+            # The visitor id; stored as the messages' ``session_key``
+            self.session_key = anonymous_identity(self.scope['session'].session_key, self.scope.get('cookies', {}))
             identifier = self.session_key
-            self.set_client_status("online", is_authenticated=False)
         else:
             self.session_key = None
             identifier = self.user.username
-            self.set_client_status("online", is_authenticated=True)
 
-        online_clients[identifier] = "online"
+        # Loaded once from the room directory and kept for the whole connection
+        snapshot = room_directory.get(self.chatroom_name)
+        if snapshot is None:
+            if identifier != self.chatroom_name:
+                self.close()
+                return
+            # The visitor's own room is only created with its first message
+            snapshot = RoomSnapshot.pending(self.chatroom_name)
+        self.set_room(snapshot)
+
+        self.presence = PresenceSession(identifier, self.channel_name)
+        self.typing = TypingThrottle(self.broadcast_typing)
+        if async_to_sync(self.presence.start)():
+            self.set_client_status("online", is_authenticated=self.user.is_authenticated)
 
         async_to_sync(self.channel_layer.group_add)(
             self.room_group_name,
@@ -41,34 +70,56 @@ class ChatConsumer(WebsocketConsumer):
         )
 
         # Mark agent online if applicable
-        if self.user.is_authenticated and hasattr(self.user, 'agent'):
-            self.room.agent.status = AgentStatus.ONLINE
-            self.room.agent.save()
-            self.send_agent_status_to_clients()
+        self.agent = Agent.objects.select_related('user').filter(user=self.user).first() if self.user.is_authenticated else None
+        if self.agent:
+            self.agent_session = agent_status_tracker.session(self.agent, self.channel_name)
+            async_to_sync(agent_status_tracker.connect)(self.agent, self.agent_session)
 
         self.accept()
 
-    def disconnect(self, close_code):
-        global online_clients
-        identifier = self.user.username if self.user.is_authenticated else self.session_key
-        online_clients[identifier] = "offline"
+        last_sequence = requested_last_sequence(self.scope)
+        if last_sequence is not None and self.room.pk is not None:
+            self.resume(last_sequence)
 
+    def set_room(self, snapshot):
+        self.room_snapshot = snapshot
+        self.room = snapshot.as_room()
+        self.room_agent = AgentState(**snapshot.agent) if snapshot.agent else None
+
+    def resume(self, last_sequence):
+        # Only send what a reconnecting client missed, plus the status snapshot
+        self.room.last_sequence = Room.objects.filter(pk=self.room.pk).values_list(
+            'last_sequence', flat=True
+        ).get()
+        missed = missed_messages(self.room, last_sequence)
+        if missed is None:
+            self.chat_message({})
+            return
+        if missed:
+            self.send(text_data=render_message_fragments(missed, self.user))
+        if self.room_agent:
+            self.send(text_data=render_to_string("agent_info.html", {'agent': self.room_agent}))
+        self.send(text_data=render_to_string("client_info.html", {
+            'client_status': async_to_sync(presence.status)(self.chatroom_name),
+            'identifier': self.chatroom_name,
+            'is_authenticated': None,
+        }))
+
+    def disconnect(self, close_code):
+        if not hasattr(self, 'room'):
+            return
+        async_to_sync(self.typing.stop)()
         async_to_sync(self.channel_layer.group_discard)(
             self.room_group_name,
             self.channel_name
         )
 
-        if not self.user.is_authenticated:
-            self.set_client_status("offline", is_authenticated=False)
-        elif self.user.is_authenticated:
-            self.set_client_status("offline", is_authenticated=True)
-            if hasattr(self.user, 'agent'):
-                self.room.agent.status = AgentStatus.OFFLINE
-                self.room.agent.save()
-                self.send_agent_status_to_clients(True)
+        if async_to_sync(self.presence.stop)():
+            self.set_client_status("offline", is_authenticated=self.user.is_authenticated)
+        if self.agent:
+            async_to_sync(agent_status_tracker.disconnect)(self.agent, self.agent_session)
 
     def receive(self, text_data):
-        print(f"Message received: {text_data}")
         text_data_json = json.loads(text_data)
 
         # Separate handling for typing and actual message
@@ -76,74 +127,93 @@ class ChatConsumer(WebsocketConsumer):
         message = text_data_json.get('message', '')
 
         if typing is not None:
-            agent = Agent.objects.filter(user=self.user)
-            html_message = None
-            if self.user.is_authenticated and agent:
-                async_to_sync(self.channel_layer.group_send)(
-                    self.room_group_name,
-                    {
-                        'type': 'agent_typing',
-                        'username': self.user.username if self.user.is_authenticated else "Anonymous",
-                        'typing': typing,
-                    }
-                )
-            else:
-                async_to_sync(self.channel_layer.group_send)(
-                    self.room_group_name,
-                    {
-                        'type': 'user_typing',
-                        'username': self.user.username if self.user.is_authenticated else "Anonymous",
-                        'typing': typing,
-                    }
-                )
-
-            return 
+            async_to_sync(self.typing.update)(typing)
+            return
 
         if message:
-            if self.user.is_authenticated:
-                chat_message = ChatMessage.objects.create(
-                    room=self.room,
-                    author=self.user,
-                    message=message
+            async_to_sync(self.typing.stop)()
+            if self.room.pk is None:
+                self.set_room(room_directory.create(self.chatroom_name))
+            author = self.user if self.user.is_authenticated else None
+            session_key = None if author else self.session_key
+            if WRITE_BEHIND_ENABLED:
+                chat_message = message_writer.submit(
+                    self.room, message, author=author, session_key=session_key, agent=self.agent,
+                    group=self.room_group_name, reply_channel=self.channel_name,
                 )
             else:
-                chat_message = ChatMessage.objects.create(
-                    room=self.room,
-                    session_key=self.session_key,
-                    message=message
+                chat_message = post_message(
+                    self.room, message, author=author, session_key=session_key, agent=self.agent
                 )
 
             async_to_sync(self.channel_layer.group_send)(
                 self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'username': self.user.username if self.user.is_authenticated else "Anonymous",
-                    'timestamp': chat_message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                }
+                message_event(chat_message, pending=WRITE_BEHIND_ENABLED)
             )
+            if not WRITE_BEHIND_ENABLED:
+                # The write-behind flusher notifies the inbox once it has stored the batch
+                async_to_sync(notify_inbox)(self.room, self.room_agent.username if self.room_agent else "")
+            if self.room.agent_id is None and not self.agent:
+                async_to_sync(assignment_scheduler.enqueue)(self.room)
 
     def chat_message(self, event):
-        global online_clients
-        messages = list(ChatMessage.objects.filter(room=self.room).order_by('timestamp')[:50])
-        first_message = messages[0]
-        username = getattr(first_message.author, User.USERNAME_FIELD, "Anonymous") if first_message.author else "Anonymous"
-        is_agent = str(self.room.agent) == str(self.scope['user'].username)
+        if DELTA_DELIVERY and 'sequence' in event:
+            context = message_fragment_context(event, self.scope['user'], self.session_key)
+            self.send(text_data=render_to_string("chat_message.html", context))
+            return
+        if self.room.pk is None:
+            # Created meanwhile by another of the visitor's sockets
+            snapshot = room_directory.get(self.chatroom_name)
+            if snapshot is None:
+                return
+            self.set_room(snapshot)
+        messages = recent_messages(self.room)
+        first_message = messages[0] if messages else None
+        if first_message is None:
+            # Nothing said yet in a pending or just created room
+            username = "Anonymous"
+            first_identifier = self.chatroom_name
+        else:
+            username = getattr(first_message.author, User.USERNAME_FIELD, "Anonymous") if first_message.author else "Anonymous"
+            first_identifier = first_message.author.username if first_message.author else first_message.session_key
+        is_agent = str(self.room_agent) == str(self.scope['user'].username)
         context = {
             'chatroom_name': self.chatroom_name,
             'messages': messages,
+            'older_cursor': older_cursor(messages),
             'user': self.scope['user'],
-            'agent': self.room.agent,
-            'room': self.room,
+            'agent': self.room_agent,
+            'room': self.room_snapshot,
             'username': username,
             'is_agent': is_agent,
-            'client_status': online_clients.get(first_message.author.username),
+            'client_status': async_to_sync(presence.status)(first_identifier),
         }
         html_message = render_to_string("chat.html", context)
         self.send(text_data=html_message)
 
+    def message_ack(self, event):
+        # Sent to this socket only, once its messages have been stored
+        self.send(text_data=render_to_string("message_ack.html", event))
+
+    def message_dropped(self, event):
+        # Broadcast ahead of a write that failed
+        sequences = dropped_sequences(event, self.channel_name)
+        self.send(text_data=render_to_string("message_dropped.html", {'sequences': sequences}))
+
+    async def broadcast_typing(self, typing):
+        # Called on the event loop by the typing throttle
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'agent_typing' if self.agent else 'user_typing',
+                'room_id': self.room.pk,
+                'username': self.user.username if self.user.is_authenticated else "Anonymous",
+                'typing': typing,
+            }
+        )
+
     def user_typing(self, event):
-        print(f"Typing event: {event}")
+        logger.debug("Typing event: %s", event)
         typing = False
         if event['typing'] == True:
             typing = True
@@ -151,44 +221,46 @@ class ChatConsumer(WebsocketConsumer):
         self.send(text_data=html_message)
     
     def agent_typing(self, event):
-        print(f"Typing event: {event}")
+        logger.debug("Typing event: %s", event)
         typing = False
         if event['typing'] == True:
             typing = True
-        print("Agent is typing")
         html_message = render_to_string("typing2.html", {'typing': typing})
         self.send(text_data=html_message)
 
-    def send_agent_status_to_clients(self, disconnect=False):
-        # Broadcast agent status to all clients
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name,
-            {
-                'type': 'agent_status_update',
-                'disconnect': disconnect,
-            }
-        )
-
     def agent_status_update(self, event):
-        # Broadcast agent status update
-        self.room = get_object_or_404(Room, name=self.chatroom_name)
-        self.room.agent.status = AgentStatus.OFFLINE if event['disconnect'] else AgentStatus.ONLINE
-        self.room.agent.save()
-        context = {'agent': self.room.agent}
+        # The event carries the agent's new state, so nothing is re-read here
+        agent = agent_state_from_event(event)
+        if self.room.agent_id == agent.id:
+            self.room_agent = agent
+        context = {'agent': agent}
         html_message = render_to_string("agent_info.html", context)
         self.send(text_data=html_message)
 
+    def room_agent_update(self, event):
+        # The scheduler assigned the room, or the chat was closed
+        agent = agent_state_from_event(event) if event['agent'] else None
+        self.room.agent_id = agent.id if agent else None
+        self.room_agent = agent
+        if agent:
+            html_message = render_to_string("agent_info.html", {'agent': agent})
+            self.send(text_data=html_message)
+
     def set_client_status(self, status, is_authenticated):
         identifier = self.user.username if is_authenticated else self.session_key
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name,
-            {
-                'type': 'client_status_update',
-                'status': status,
-                'identifier': identifier,
-                'is_authenticated': is_authenticated,
-            }
-        )
+        async_to_sync(presence_broadcaster.changed)(self.room_group_name, identifier, status)
+
+    def presence_diff(self, event):
+        # The chat header only shows the room's own client
+        status = diff_status(event, self.chatroom_name)
+        if status is None:
+            return
+        html_message = render_to_string("client_info.html", {
+            'client_status': status,
+            'identifier': self.chatroom_name,
+            'is_authenticated': None,
+        })
+        self.send(text_data=html_message)
 
     def client_status_update(self, event):
         # Broadcast client status update
@@ -0,0 +1,73 @@
+import hashlib
+from channels.auth import AuthMiddleware, get_user
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+
+# Cache alias holding resolved handshake users. Use a shared backend when
+# running more than one worker, so logouts reach every process.
+HANDSHAKE_CACHE = getattr(settings, "SAGE_REF_HANDSHAKE_CACHE", "default")
+# Seconds a session keeps resolving to the same user without touching the
+# database. Logouts invalidate at once; anything else (a password change,
+# a deactivated user) takes effect within this many seconds.
+HANDSHAKE_TTL = getattr(settings, "SAGE_REF_HANDSHAKE_TTL", 60)
+
+# Cached for sessions without a logged in user.
+ANONYMOUS = "anonymous"
+
+
+class HandshakeUsers:
+    """
+    The user behind each session key, kept in the Django cache so a socket
+    handshake usually reads neither the session nor the user table.
+
+    Entries are dropped on logout (see ``sage_ref.signals``).
+    """
+
+    def __init__(self, alias=HANDSHAKE_CACHE, ttl=HANDSHAKE_TTL):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, session_key):
+        return "sage_ref:handshake:" + hashlib.md5(session_key.encode()).hexdigest()
+
+    async def resolve(self, scope):
+        """
+        The user of the scope's session, like ``channels.auth.get_user``.
+        """
+        session_key = scope["session"].session_key
+        if not session_key:
+            # Visitors without a session (see ``sage_ref.helpers.visitors``)
+            return AnonymousUser()
+        cached = await self.cache.aget(self.key(session_key))
+        if cached == ANONYMOUS:
+            return AnonymousUser()
+        if cached is not None:
+            return cached
+        user = await get_user(scope)
+        await self.cache.aset(self.key(session_key), user if user.is_authenticated else ANONYMOUS, self.ttl)
+        return user
+
+    def invalidate(self, session_key):
+        self.cache.delete(self.key(session_key))
+
+
+handshake_users = HandshakeUsers()
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    """
+    ``AuthMiddleware`` resolving the user through ``handshake_users``.
+    """
+
+    async def resolve_scope(self, scope):
+        scope["user"]._wrapped = await handshake_users.resolve(scope)
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
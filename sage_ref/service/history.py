@@ -0,0 +1,256 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from django.conf import settings
+from sage_ref.helpers.cursors import decode_cursor, encode_cursor
+from sage_ref.models.chat import ChatMessage
+from sage_ref.service.archive import message_archive
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent messages kept per room.
+HISTORY_SIZE = getattr(settings, "SAGE_REF_HISTORY_SIZE", 50)
+# Upper bound for the estimated size of all cached messages together.
+HISTORY_CACHE_BYTES = getattr(settings, "SAGE_REF_HISTORY_CACHE_BYTES", 32 * 1024 * 1024)
+# Buffers are refilled after this many seconds, so writes made by other
+# worker processes show up even though appends are process-local.
+HISTORY_CACHE_TTL = getattr(settings, "SAGE_REF_HISTORY_CACHE_TTL", 60)
+
+# Rough per-message cost of a model instance with its author loaded, on top
+# of the message text itself.
+MESSAGE_OVERHEAD_BYTES = 1024
+
+
+def _message_size(message):
+    return MESSAGE_OVERHEAD_BYTES + sys.getsizeof(message.message)
+
+
+class RoomBuffer:
+    __slots__ = ("messages", "nbytes", "loaded_at")
+
+    def __init__(self, messages, size):
+        self.messages = deque(messages, maxlen=size)
+        self.nbytes = sum(_message_size(message) for message in self.messages)
+        self.loaded_at = time.monotonic()
+
+
+class RecentMessageCache:
+    """
+    Bounded in-process cache holding a ring buffer of the latest messages
+    for each room.
+
+    Rooms are kept in least-recently-used order and the oldest ones are
+    dropped once the estimated size of all buffers exceeds ``max_bytes``.
+    """
+
+    def __init__(self, size=HISTORY_SIZE, max_bytes=HISTORY_CACHE_BYTES, ttl=HISTORY_CACHE_TTL):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rooms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, room_id):
+        """
+        Return the cached messages for the room, oldest first, or ``None``.
+        """
+        with self._lock:
+            buffer = self._rooms.get(room_id)
+            if buffer is not None and time.monotonic() - buffer.loaded_at > self.ttl:
+                self._drop(room_id)
+                buffer = None
+            if buffer is None:
+                self.misses += 1
+                messages = None
+            else:
+                self.hits += 1
+                self._rooms.move_to_end(room_id)
+                messages = list(buffer.messages)
+            lookups = self.hits + self.misses
+        if lookups % 1000 == 0:
+            logger.info("Recent message cache: %s", self.stats())
+        return messages
+
+    def fill(self, room_id, messages):
+        with self._lock:
+            self._drop(room_id)
+            buffer = RoomBuffer(messages, self.size)
+            self._rooms[room_id] = buffer
+            self.nbytes += buffer.nbytes
+            self._evict()
+
+    def append(self, room_id, message):
+        """
+        Add a newly written message to the room's buffer, if it is cached.
+        """
+        with self._lock:
+            buffer = self._rooms.get(room_id)
+            if buffer is None:
+                return
+            if buffer.messages and buffer.messages[-1].sequence >= message.sequence:
+                return
+            if len(buffer.messages) == buffer.messages.maxlen:
+                dropped = _message_size(buffer.messages[0])
+                buffer.nbytes -= dropped
+                self.nbytes -= dropped
+            buffer.messages.append(message)
+            added = _message_size(message)
+            buffer.nbytes += added
+            self.nbytes += added
+            self._rooms.move_to_end(room_id)
+            self._evict()
+
+    def invalidate(self, room_id):
+        with self._lock:
+            self._drop(room_id)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'rooms': len(self._rooms),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _drop(self, room_id):
+        buffer = self._rooms.pop(room_id, None)
+        if buffer is not None:
+            self.nbytes -= buffer.nbytes
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._rooms) > 1:
+            _, buffer = self._rooms.popitem(last=False)
+            self.nbytes -= buffer.nbytes
+            self.evictions += 1
+
+
+recent_message_cache = RecentMessageCache()
+
+
+def _recent_queryset(room):
+    return ChatMessage.objects.filter(room=room).select_related('author').order_by(
+        '-timestamp', '-id'
+    )[:recent_message_cache.size]
+
+
+def recent_messages(room):
+    """
+    The latest messages of a room, oldest first.
+    """
+    messages = recent_message_cache.get(room.pk)
+    if messages is None:
+        messages = list(_recent_queryset(room))[::-1]
+        recent_message_cache.fill(room.pk, messages)
+    return messages
+
+
+async def arecent_messages(room):
+    messages = recent_message_cache.get(room.pk)
+    if messages is None:
+        messages = [message async for message in _recent_queryset(room)][::-1]
+        recent_message_cache.fill(room.pk, messages)
+    return messages
+
+
+def _missed_from_cache(room, last_sequence):
+    messages = recent_message_cache.get(room.pk)
+    if not messages:
+        return None
+    if messages[0].sequence > last_sequence + 1 or messages[-1].sequence < room.last_sequence:
+        return None
+    return [message for message in messages if message.sequence > last_sequence]
+
+
+def _missed_queryset(room, last_sequence):
+    return ChatMessage.objects.filter(
+        room=room, sequence__gt=last_sequence
+    ).select_related('author').order_by('sequence')
+
+
+def missed_messages(room, last_sequence):
+    """
+    Messages a reconnecting client has not seen yet, oldest first.
+
+    Returns ``None`` when more than a history window was missed, in which
+    case the client should get the full room state instead.
+    """
+    if last_sequence >= room.last_sequence:
+        return []
+    if room.last_sequence - last_sequence > recent_message_cache.size:
+        return None
+    messages = _missed_from_cache(room, last_sequence)
+    if messages is None:
+        messages = list(_missed_queryset(room, last_sequence))
+    return messages
+
+
+async def amissed_messages(room, last_sequence):
+    if last_sequence >= room.last_sequence:
+        return []
+    if room.last_sequence - last_sequence > recent_message_cache.size:
+        return None
+    messages = _missed_from_cache(room, last_sequence)
+    if messages is None:
+        messages = [message async for message in _missed_queryset(room, last_sequence)]
+    return messages
+
+
+def older_cursor(messages):
+    """
+    Cursor for the page before a full window of recent messages, if any.
+    """
+    if len(messages) < recent_message_cache.size or messages[0].pk is None:
+        return None
+    return encode_cursor(messages[0].timestamp, messages[0].pk)
+
+
+def history_page(room, before=None, after=None, limit=HISTORY_SIZE):
+    """
+    Up to ``limit`` messages of a room next to a cursor, oldest first, and
+    whether there are more beyond them.
+
+    ``before`` pages towards older messages and ``after`` towards newer
+    ones. Both seek on the ``(room, timestamp, id)`` index, so every page
+    costs the same however deep it is. Messages moved to the archive are
+    read from it where the live ones end, with the same cursors.
+    """
+    queryset = ChatMessage.objects.filter(room=room).select_related('author')
+    if after is not None:
+        timestamp, pk = decode_cursor(after)
+        archived, has_more = message_archive.after(room.pk, (timestamp, pk), limit)
+        if has_more:
+            return archived, True
+        if archived:
+            timestamp, pk = archived[-1].timestamp, archived[-1].pk
+        limit -= len(archived)
+        queryset = queryset.filter(timestamp__gte=timestamp).exclude(
+            timestamp=timestamp, id__lte=pk
+        ).order_by('timestamp', 'id')
+        messages = list(queryset[:limit + 1])
+        return archived + messages[:limit], len(messages) > limit
+    key = None
+    if before is not None:
+        key = decode_cursor(before)
+        queryset = queryset.filter(timestamp__lte=key[0]).exclude(timestamp=key[0], id__gte=key[1])
+    messages = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+    if len(messages) > limit:
+        return messages[:limit][::-1], True
+    messages.reverse()
+    if messages:
+        key = (messages[0].timestamp, messages[0].pk)
+    archived, has_more = message_archive.before(room.pk, key, limit - len(messages))
+    return archived + messages, has_more
@@ -0,0 +1,70 @@
+from datetime import datetime
+from channels.layers import get_channel_layer
+from django.conf import settings
+from sage_ref.helpers.cursors import decode_cursor, encode_cursor
+from sage_ref.models.room import Room
+
+# Rooms per page of the agent inbox.
+INBOX_PAGE_SIZE = getattr(settings, "SAGE_REF_INBOX_PAGE_SIZE", 25)
+# Channel layer group every agent inbox socket joins.
+INBOX_GROUP = "agent_inbox"
+
+
+def inbox_page(after=None, limit=INBOX_PAGE_SIZE):
+    """
+    Rooms with at least one message, most recently active first, and the
+    cursor of the next page (``None`` on the last one).
+
+    Reads only the room table through its activity index, so a page costs
+    the same however many rooms or messages there are.
+    """
+    queryset = Room.objects.filter(last_message_at__isnull=False).select_related('agent__user')
+    if after is not None:
+        last_message_at, pk = decode_cursor(after)
+        # A range on the leading column plus a tie-break the index can seek
+        queryset = queryset.filter(last_message_at__lte=last_message_at).exclude(
+            last_message_at=last_message_at, id__gte=pk
+        )
+    rooms = list(queryset.order_by('-last_message_at', '-id')[:limit + 1])
+    if len(rooms) <= limit:
+        return rooms, None
+    rooms = rooms[:limit]
+    return rooms, encode_cursor(rooms[-1].last_message_at, rooms[-1].pk)
+
+
+def inbox_event(room, agent_username=""):
+    """
+    Build the ``inbox_update`` event for a room whose activity or agent
+    changed.
+
+    The event describes that one room only, so what an inbox socket is sent
+    does not grow with the number of rooms.
+    """
+    return {
+        'type': 'inbox_update',
+        'room': {
+            'id': room.pk,
+            'name': room.name,
+            'message_count': room.message_count,
+            'unread_count': room.unread_count,
+            'last_message_at': room.last_message_at.isoformat() if room.last_message_at else None,
+            'last_message_preview': room.last_message_preview,
+            'last_author': room.last_author,
+            'agent': agent_username,
+        },
+    }
+
+
+def inbox_room_context(event):
+    """
+    Template context for ``inbox_update.html`` built from an
+    ``inbox_update`` event.
+    """
+    room = dict(event['room'])
+    if room['last_message_at']:
+        room['last_message_at'] = datetime.fromisoformat(room['last_message_at'])
+    return {'room': room}
+
+
+async def notify_inbox(room, agent_username=""):
+    await get_channel_layer().group_send(INBOX_GROUP, inbox_event(room, agent_username))
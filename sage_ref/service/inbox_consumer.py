@@ -0,0 +1,29 @@
+from channels.generic.websocket import AsyncWebsocketConsumer
+from sage_ref.models.agent import Agent
+from sage_ref.service.async_consumer import render_async
+from sage_ref.service.inbox import INBOX_GROUP, inbox_room_context
+
+
+class AgentInboxConsumer(AsyncWebsocketConsumer):
+    """
+    Live agent inbox. Every ``inbox_update`` event is pushed as a single
+    room entry, which the panel moves to the top of its list.
+    """
+
+    async def connect(self):
+        user = self.scope['user']
+        self.joined = False
+        if not user.is_authenticated or not await Agent.objects.filter(user=user).aexists():
+            await self.close()
+            return
+        await self.channel_layer.group_add(INBOX_GROUP, self.channel_name)
+        self.joined = True
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.joined:
+            await self.channel_layer.group_discard(INBOX_GROUP, self.channel_name)
+
+    async def inbox_update(self, event):
+        html_message = await render_async("inbox_update.html", inbox_room_context(event))
+        await self.send(text_data=html_message)
@@ -0,0 +1,143 @@
+from datetime import datetime
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import Truncator
+from django.template.loader import render_to_string
+from django.db.models import F
+from sage_ref.models.room import Room
+from sage_ref.models.chat import ChatMessage
+from sage_ref.service.history import recent_message_cache
+
+# Send each new message as a single fragment instead of re-rendering the
+# whole room for every recipient.
+DELTA_DELIVERY = getattr(settings, "SAGE_REF_DELTA_DELIVERY", True)
+
+
+def room_activity(chat_message):
+    """
+    The ``Room`` activity fields describing ``chat_message`` as the room's
+    latest message.
+    """
+    author = chat_message.author
+    return {
+        'last_message_at': chat_message.timestamp,
+        'last_message_preview': Truncator(chat_message.message).chars(255),
+        'last_author': author.username if author else "Anonymous",
+    }
+
+
+def post_message(room, message, author=None, session_key=None, agent=None):
+    """
+    Store a chat message under the room's next sequence number.
+
+    The counter is bumped with a single UPDATE inside the transaction, so
+    concurrent writers to the same room are serialized on the room row and
+    never share a sequence number. The same UPDATE keeps the room's
+    activity fields current; they are copied onto ``room`` afterwards.
+    ``agent`` is set when an agent is the author.
+    """
+    chat_message = ChatMessage(
+        room=room,
+        author=author,
+        agent=agent,
+        session_key=session_key,
+        message=message,
+        timestamp=timezone.now(),
+    )
+    activity = room_activity(chat_message)
+    with transaction.atomic():
+        Room.objects.filter(pk=room.pk).update(
+            last_sequence=F('last_sequence') + 1,
+            message_count=F('message_count') + 1,
+            unread_count=0 if agent else F('unread_count') + 1,
+            **activity,
+        )
+        chat_message.sequence, room.message_count, room.unread_count = Room.objects.filter(
+            pk=room.pk
+        ).values_list('last_sequence', 'message_count', 'unread_count').get()
+        chat_message.save(force_insert=True)
+    room.last_sequence = chat_message.sequence
+    for field, value in activity.items():
+        setattr(room, field, value)
+    recent_message_cache.append(room.pk, chat_message)
+    return chat_message
+
+
+def message_event(chat_message, pending=False):
+    """
+    Build the ``chat_message`` group event for a stored message.
+
+    The event carries everything a recipient needs to render the new
+    message, so delivering it costs no queries regardless of room history.
+    ``pending`` marks a message that is still waiting in the write-behind
+    queue; its sender is sent a ``message_ack`` once it is stored. Its id is
+    reserved ahead on SQLite and PostgreSQL and ``None`` on other backends.
+    """
+    author = chat_message.author
+    return {
+        'type': 'chat_message',
+        'id': chat_message.id,
+        'room_id': chat_message.room_id,
+        'sequence': chat_message.sequence,
+        'message': chat_message.message,
+        'username': author.username if author else "Anonymous",
+        'author_id': author.pk if author else None,
+        'session_key': chat_message.session_key,
+        'timestamp': chat_message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        'created': chat_message.timestamp.isoformat(),
+        'pending': pending,
+    }
+
+
+def message_fragment_context(event, user, session_key=None):
+    """
+    Template context for ``chat_message.html`` built from a ``chat_message``
+    event, as seen by ``user`` (or the anonymous ``session_key``).
+    """
+    if event['author_id'] is not None:
+        is_sender = event['author_id'] == user.pk
+    else:
+        is_sender = session_key is not None and event['session_key'] == session_key
+    return {
+        'sequence': event['sequence'],
+        'message': event['message'],
+        'author_username': event['username'] if event['author_id'] else "",
+        'session_key': event['session_key'],
+        'is_own': event['author_id'] is not None and event['author_id'] == user.pk,
+        'pending': event.get('pending', False) and is_sender,
+        'created': datetime.fromisoformat(event['created']),
+    }
+
+
+def render_message_fragments(messages, user):
+    """
+    Render stored messages as consecutive ``chat_message.html`` fragments,
+    so a batch can be sent to a socket as a single frame.
+    """
+    return ''.join(
+        render_to_string("chat_message.html", message_fragment_context(message_event(message), user))
+        for message in messages
+    )
+
+
+def dropped_sequences(event, channel_name):
+    """
+    The sequence numbers of a ``message_dropped`` event the socket
+    ``channel_name`` has to take off its page: all but its own messages,
+    which it resends once acked with ``persisted=False``.
+    """
+    own = event['senders'].get(channel_name, [])
+    return [sequence for sequence in event['sequences'] if sequence not in own]
+
+
+def requested_last_sequence(scope):
+    """
+    The ``last_seq`` a reconnecting client passed in the socket URL, if any.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        return int(query['last_seq'][0])
+    except (KeyError, ValueError):
+        return None
@@ -0,0 +1,247 @@
+import json
+from functools import partial
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from sage_ref.models.agent import Agent
+from sage_ref.models.room import Room
+from sage_ref.service.agent_status import AgentState, agent_status_tracker, agent_state_from_event
+from sage_ref.service.assignment import assignment_scheduler
+from sage_ref.service.async_consumer import apost_message, render_async, render_fragments_async
+from sage_ref.service.history import amissed_messages, arecent_messages
+from sage_ref.service.inbox import notify_inbox
+from sage_ref.service.messages import dropped_sequences, message_event, message_fragment_context
+from sage_ref.service.presence import diff_status, presence
+from sage_ref.service.room_directory import room_directory
+from sage_ref.service.typing import TypingThrottle
+from sage_ref.service.write_behind import WRITE_BEHIND_ENABLED, message_writer
+
+# Rooms one multiplexed agent socket may be subscribed to at a time.
+MULTIPLEX_MAX_ROOMS = getattr(settings, "SAGE_REF_MULTIPLEX_MAX_ROOMS", 50)
+
+
+class RoomSubscription:
+    """
+    Per-room state of a multiplexed socket; everything else is shared.
+    """
+    __slots__ = ("name", "group", "room", "agent", "typing")
+
+    def __init__(self, snapshot, typing):
+        self.name = snapshot.name
+        self.group = f'chat_{snapshot.name}'
+        self.room = snapshot.as_room()
+        self.agent = AgentState(**snapshot.agent) if snapshot.agent else None
+        self.typing = typing
+
+
+class AgentMultiplexConsumer(AsyncWebsocketConsumer):
+    """
+    One agent socket subscribed to any number of room groups.
+
+    The client sends JSON commands, each naming its room::
+
+        {"action": "subscribe", "room": "<name>", "last_seq": 12}
+        {"action": "unsubscribe", "room": "<name>"}
+        {"action": "close", "room": "<name>"}
+        {"room": "<name>", "message": "..."}
+        {"room": "<name>", "typing": true}
+
+    Every frame sent back is ``{"room": "<name>", "html": "..."}`` holding
+    the same fragments a ``ws/chatroom/<name>/`` socket would get. The agent
+    lookup, the agent's presence and status session and the channel are
+    shared by all rooms of the socket.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.rooms = {}
+        self.agent = None
+        if self.user.is_authenticated:
+            self.agent = await Agent.objects.select_related('user').filter(user=self.user).afirst()
+        if self.agent is None:
+            await self.close()
+            return
+        self.agent_session = agent_status_tracker.session(self.agent, self.channel_name)
+        await agent_status_tracker.connect(self.agent, self.agent_session)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.agent is None:
+            return
+        for room_id in list(self.rooms):
+            await self.unsubscribe(room_id)
+        await agent_status_tracker.disconnect(self.agent, self.agent_session)
+
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        name = data.get('room')
+        action = data.get('action')
+        if action == 'subscribe':
+            await self.subscribe(name, data.get('last_seq'))
+            return
+        subscription = self.subscription(name)
+        if subscription is None:
+            await self.send_error(name, "Not subscribed to this room.")
+            return
+        if action == 'unsubscribe':
+            await self.unsubscribe(subscription.room.pk)
+        elif action == 'close':
+            room = await Room.objects.aget(pk=subscription.room.pk)
+            try:
+                await assignment_scheduler.close(room, self.user)
+            except PermissionDenied:
+                await self.send_error(name, "Only the room's agent can close it.")
+        elif data.get('typing') is not None:
+            await subscription.typing.update(data['typing'])
+        elif data.get('message'):
+            await self.post(subscription, data['message'])
+
+    def subscription(self, name):
+        for subscription in self.rooms.values():
+            if subscription.name == name:
+                return subscription
+        return None
+
+    def subscription_for_group(self, group):
+        for subscription in self.rooms.values():
+            if subscription.group == group:
+                return subscription
+        return None
+
+    async def subscribe(self, name, last_sequence=None):
+        if self.subscription(name) is not None:
+            return
+        if len(self.rooms) >= MULTIPLEX_MAX_ROOMS:
+            await self.send_error(name, "Too many rooms on one socket.")
+            return
+        snapshot = await room_directory.aget(name) if name else None
+        if snapshot is None:
+            await self.send_error(name, "No such room.")
+            return
+        subscription = RoomSubscription(snapshot, typing=None)
+        subscription.typing = TypingThrottle(partial(self.broadcast_typing, subscription))
+        self.rooms[subscription.room.pk] = subscription
+        await self.channel_layer.group_add(subscription.group, self.channel_name)
+        await self.send_room_state(subscription, last_sequence)
+
+    async def unsubscribe(self, room_id):
+        subscription = self.rooms.pop(room_id)
+        await subscription.typing.stop()
+        await self.channel_layer.group_discard(subscription.group, self.channel_name)
+
+    async def send_room_state(self, subscription, last_sequence=None):
+        """
+        Catch a new subscription up: the messages after ``last_sequence``
+        (or the latest window) plus the agent and client status.
+        """
+        room = subscription.room
+        room.last_sequence = await Room.objects.filter(pk=room.pk).values_list('last_sequence', flat=True).aget()
+        messages = None
+        if isinstance(last_sequence, int):
+            messages = await amissed_messages(room, last_sequence)
+        if messages is None:
+            messages = await arecent_messages(room)
+        html_message = await render_fragments_async(messages, self.user)
+        if subscription.agent:
+            html_message += await render_async("agent_info.html", {'agent': subscription.agent})
+        html_message += await render_async("client_info.html", {
+            'client_status': await presence.status(subscription.name),
+            'identifier': subscription.name,
+            'is_authenticated': None,
+        })
+        await self.send_room(subscription, html_message)
+
+    async def post(self, subscription, message):
+        await subscription.typing.stop()
+        if WRITE_BEHIND_ENABLED:
+            chat_message = await message_writer.asubmit(
+                subscription.room, message, author=self.user, agent=self.agent, group=subscription.group,
+                reply_channel=self.channel_name,
+            )
+        else:
+            chat_message = await apost_message(subscription.room, message, author=self.user, agent=self.agent)
+        await self.channel_layer.group_send(
+            subscription.group, message_event(chat_message, pending=WRITE_BEHIND_ENABLED)
+        )
+        if not WRITE_BEHIND_ENABLED:
+            await notify_inbox(subscription.room, subscription.agent.username if subscription.agent else "")
+
+    async def broadcast_typing(self, subscription, typing):
+        await self.channel_layer.group_send(subscription.group, {
+            'type': 'agent_typing',
+            'room_id': subscription.room.pk,
+            'username': self.user.username,
+            'typing': typing,
+        })
+
+    async def send_room(self, subscription, html_message):
+        await self.send(text_data=json.dumps({'room': subscription.name, 'html': html_message}))
+
+    async def send_error(self, name, error):
+        await self.send(text_data=json.dumps({'room': name, 'error': error}))
+
+    async def chat_message(self, event):
+        subscription = self.rooms.get(event.get('room_id'))
+        if subscription is None or 'sequence' not in event:
+            return
+        context = message_fragment_context(event, self.user)
+        await self.send_room(subscription, await render_async("chat_message.html", context))
+
+    async def message_ack(self, event):
+        subscription = self.rooms.get(event['room_id'])
+        if subscription is not None:
+            await self.send_room(subscription, await render_async("message_ack.html", event))
+
+    async def message_dropped(self, event):
+        subscription = self.rooms.get(event['room_id'])
+        if subscription is not None:
+            sequences = dropped_sequences(event, self.channel_name)
+            await self.send_room(subscription, await render_async("message_dropped.html", {'sequences': sequences}))
+
+    async def user_typing(self, event):
+        subscription = self.rooms.get(event.get('room_id'))
+        if subscription is not None:
+            html_message = await render_async("type_agent.html", {'typing': event['typing'] is True})
+            await self.send_room(subscription, html_message)
+
+    async def agent_typing(self, event):
+        # The agent's own typing comes back through the room group
+        if event.get('username') == self.user.username:
+            return
+        subscription = self.rooms.get(event.get('room_id'))
+        if subscription is not None:
+            html_message = await render_async("typing2.html", {'typing': event['typing'] is True})
+            await self.send_room(subscription, html_message)
+
+    async def agent_status_update(self, event):
+        # Sent to each of the agent's rooms, tagged with the room's group
+        subscription = self.subscription_for_group(event.get('group'))
+        if subscription is None:
+            return
+        subscription.agent = agent_state_from_event(event)
+        html_message = await render_async("agent_info.html", {'agent': subscription.agent})
+        await self.send_room(subscription, html_message)
+
+    async def room_agent_update(self, event):
+        subscription = self.rooms.get(event['room_id'])
+        if subscription is None:
+            return
+        subscription.agent = agent_state_from_event(event) if event['agent'] else None
+        subscription.room.agent_id = subscription.agent.id if subscription.agent else None
+        if subscription.agent:
+            html_message = await render_async("agent_info.html", {'agent': subscription.agent})
+            await self.send_room(subscription, html_message)
+
+    async def presence_diff(self, event):
+        subscription = self.subscription_for_group(event.get('group'))
+        if subscription is None:
+            return
+        status = diff_status(event, subscription.name)
+        if status is None:
+            return
+        html_message = await render_async("client_info.html", {
+            'client_status': status,
+            'identifier': subscription.name,
+            'is_authenticated': None,
+        })
+        await self.send_room(subscription, html_message)
@@ -0,0 +1,273 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+import weakref
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+PRESENCE = getattr(settings, "SAGE_REF_PRESENCE", {})
+# Seconds a connection stays registered without a heartbeat. Sockets of a
+# crashed worker stop heartbeating and drop out after this long.
+PRESENCE_TTL = PRESENCE.get("TTL", 30)
+# Status changes within this many seconds are sent to a room as one diff.
+PRESENCE_BROADCAST_WINDOW = PRESENCE.get("BROADCAST_WINDOW", 1.0)
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+class BasePresence(ABC):
+    """
+    Registry of live connections per identifier (username or anonymous
+    session key).
+
+    An identifier is online while at least one of its connections has been
+    registered or heartbeated within ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL):
+        self.ttl = ttl
+
+    @abstractmethod
+    async def connect(self, identifier, connection):
+        """
+        Register a connection and return the identifier's live connection count.
+        """
+
+    @abstractmethod
+    async def heartbeat(self, identifier, connection):
+        """
+        Keep a registered connection alive for another ``ttl`` seconds. An
+        unknown connection is not registered.
+        """
+
+    @abstractmethod
+    async def disconnect(self, identifier, connection):
+        """
+        Remove a connection and return the identifier's live connection count.
+        """
+
+    @abstractmethod
+    async def count(self, identifier):
+        """
+        The identifier's live connection count.
+        """
+
+    async def status(self, identifier):
+        return ONLINE if await self.count(identifier) else OFFLINE
+
+
+class InMemoryPresence(BasePresence):
+    """
+    Process-local backend, only correct when running a single worker.
+
+    Identifiers are removed as soon as their last connection goes away, so
+    memory follows the number of live sockets rather than every session key
+    ever seen.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL, sweep_interval=None):
+        super().__init__(ttl)
+        self.sweep_interval = sweep_interval or ttl
+        self._connections = {}
+        self._last_sweep = time.monotonic()
+
+    async def connect(self, identifier, connection):
+        now = time.monotonic()
+        self._sweep(now)
+        connections = self._connections.setdefault(identifier, {})
+        connections[connection] = now + self.ttl
+        return self._live(identifier, now)
+
+    async def heartbeat(self, identifier, connection):
+        connections = self._connections.get(identifier)
+        if connections is not None and connection in connections:
+            connections[connection] = time.monotonic() + self.ttl
+
+    async def disconnect(self, identifier, connection):
+        now = time.monotonic()
+        connections = self._connections.get(identifier)
+        if connections is not None:
+            connections.pop(connection, None)
+        self._sweep(now)
+        return self._live(identifier, now)
+
+    async def count(self, identifier):
+        return self._live(identifier, time.monotonic())
+
+    def _live(self, identifier, now):
+        connections = self._connections.get(identifier)
+        if not connections:
+            return 0
+        return sum(1 for expires in connections.values() if expires > now)
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for identifier in list(self._connections):
+            connections = self._connections[identifier]
+            for connection in [c for c, expires in connections.items() if expires <= now]:
+                del connections[connection]
+            if not connections:
+                del self._connections[identifier]
+
+
+class RedisPresence(BasePresence):
+    """
+    Backend shared by all workers, using the Redis server the channel layer
+    already talks to.
+
+    Each identifier is a sorted set of its connections scored by expiry
+    time. The key itself expires ``ttl`` seconds after the last write, so
+    abandoned identifiers never accumulate.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL, address="redis://127.0.0.1:6379/0", prefix="sage_ref:presence"):
+        super().__init__(ttl)
+        self.address = address
+        self.prefix = prefix
+        # redis.asyncio clients are bound to the loop that created them.
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.Redis.from_url(self.address)
+        return client
+
+    def _key(self, identifier):
+        return f"{self.prefix}:{identifier}"
+
+    async def connect(self, identifier, connection):
+        key = self._key(identifier)
+        now = time.time()
+        pipeline = self._client().pipeline(transaction=True)
+        pipeline.zremrangebyscore(key, "-inf", now)
+        pipeline.zadd(key, {connection: now + self.ttl})
+        pipeline.zcard(key)
+        pipeline.expire(key, self.ttl)
+        _, _, count, _ = await pipeline.execute()
+        return count
+
+    async def heartbeat(self, identifier, connection):
+        key = self._key(identifier)
+        pipeline = self._client().pipeline(transaction=True)
+        pipeline.zadd(key, {connection: time.time() + self.ttl}, xx=True)
+        pipeline.expire(key, self.ttl)
+        await pipeline.execute()
+
+    async def disconnect(self, identifier, connection):
+        key = self._key(identifier)
+        pipeline = self._client().pipeline(transaction=True)
+        pipeline.zrem(key, connection)
+        pipeline.zremrangebyscore(key, "-inf", time.time())
+        pipeline.zcard(key)
+        _, _, count = await pipeline.execute()
+        return count
+
+    async def count(self, identifier):
+        return await self._client().zcount(self._key(identifier), time.time(), "+inf")
+
+
+def _load_presence():
+    backend = import_string(PRESENCE.get("BACKEND", "sage_ref.service.presence.InMemoryPresence"))
+    return backend(ttl=PRESENCE_TTL, **PRESENCE.get("OPTIONS", {}))
+
+
+presence = _load_presence()
+
+
+class PresenceSession:
+    """
+    One socket's registration with the presence backend, kept alive by a
+    heartbeat task on the event loop until ``stop`` is called.
+    """
+
+    def __init__(self, identifier, connection, backend=None):
+        self.identifier = str(identifier)
+        self.connection = connection
+        self.backend = backend or presence
+        self._heartbeat = None
+
+    async def start(self):
+        """
+        Register the socket; return ``True`` if the identifier just came online.
+        """
+        count = await self.backend.connect(self.identifier, self.connection)
+        self._heartbeat = asyncio.get_running_loop().create_task(self._keep_alive())
+        return count == 1
+
+    async def stop(self):
+        """
+        Unregister the socket; return ``True`` if the identifier just went offline.
+        """
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        return await self.backend.disconnect(self.identifier, self.connection) == 0
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.backend.ttl / 3)
+            await self.backend.heartbeat(self.identifier, self.connection)
+
+
+class PresenceBroadcaster:
+    """
+    Collects presence changes per room group and sends one ``presence_diff``
+    event per group per window, listing the identifiers that joined and
+    left.
+
+    An identifier that flaps (online, offline, online) inside a window ends
+    up where it started and is left out of the diff entirely.
+    """
+
+    def __init__(self, window=PRESENCE_BROADCAST_WINDOW):
+        self.window = window
+        self._pending = {}
+        self._flushes = {}
+
+    async def changed(self, group, identifier, status):
+        changes = self._pending.setdefault(group, {})
+        flush = self._flushes.get(group)
+        if flush is None or flush.done():
+            self._flushes[group] = asyncio.get_running_loop().create_task(self._flush_later(group))
+        identifier = str(identifier)
+        before = changes[identifier][0] if identifier in changes else (OFFLINE if status == ONLINE else ONLINE)
+        changes[identifier] = (before, status)
+
+    async def _flush_later(self, group):
+        await asyncio.sleep(self.window)
+        await self.flush(group)
+
+    async def flush(self, group):
+        self._flushes.pop(group, None)
+        changes = self._pending.pop(group, {})
+        joined = sorted(i for i, (before, after) in changes.items() if before != after and after == ONLINE)
+        left = sorted(i for i, (before, after) in changes.items() if before != after and after == OFFLINE)
+        if joined or left:
+            await get_channel_layer().group_send(group, {
+                'type': 'presence_diff',
+                'group': group,
+                'joined': joined,
+                'left': left,
+            })
+
+
+presence_broadcaster = PresenceBroadcaster()
+
+
+def diff_status(event, identifier):
+    """
+    The status a ``presence_diff`` event reports for ``identifier``, if any.
+    """
+    if identifier in event['joined']:
+        return ONLINE
+    if identifier in event['left']:
+        return OFFLINE
+    return None
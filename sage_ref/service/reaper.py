@@ -0,0 +1,100 @@
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from sage_ref.models.chat import ChatMessage
+from sage_ref.models.room import Room
+
+logger = logging.getLogger(__name__)
+
+ROOM_REAPER = getattr(settings, "SAGE_REF_ROOM_REAPER", {})
+# Run the reaper in a background thread of the ASGI process. The
+# ``reap_rooms`` command does the same from cron.
+ROOM_REAPER_ENABLED = ROOM_REAPER.get("ENABLED", False)
+# Seconds a room may stay without any message before it is deleted.
+ROOM_REAPER_TTL = ROOM_REAPER.get("TTL", 24 * 60 * 60)
+# Seconds between two runs of the background reaper.
+ROOM_REAPER_INTERVAL = ROOM_REAPER.get("INTERVAL", 60 * 60)
+# Rooms deleted per statement, so no delete holds locks for long...
+ROOM_REAPER_BATCH_SIZE = ROOM_REAPER.get("BATCH_SIZE", 500)
+# ...and seconds to wait between two batches.
+ROOM_REAPER_PAUSE = ROOM_REAPER.get("PAUSE", 0.1)
+
+
+class RoomReaper:
+    """
+    Deletes rooms that never got a message, left by visitors from before
+    rooms were created lazily or by rooms whose first message never came.
+
+    Rooms with an agent are kept, since they count towards the agent's
+    load. Every batch is its own short statement, re-checking that the room
+    is still empty, so a message arriving meanwhile keeps its room.
+    """
+
+    def __init__(self, ttl=ROOM_REAPER_TTL, batch_size=ROOM_REAPER_BATCH_SIZE, pause=ROOM_REAPER_PAUSE):
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+
+    def empty_rooms(self, now=None):
+        cutoff = (now or timezone.now()) - timedelta(seconds=self.ttl)
+        return Room.objects.filter(
+            last_message_at__isnull=True,
+            agent__isnull=True,
+            created_at__lt=cutoff,
+        ).exclude(Exists(ChatMessage.objects.filter(room=OuterRef('pk'))))
+
+    def reap(self, now=None, on_batch=None):
+        """
+        Delete every empty room older than the TTL; return how many went.
+        """
+        deleted = 0
+        while not self._stop.is_set():
+            rooms = self.empty_rooms(now)
+            pks = list(rooms.values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                break
+            count, _ = rooms.filter(pk__in=pks).delete()
+            deleted += count
+            if on_batch is not None:
+                on_batch(deleted)
+            if len(pks) < self.batch_size:
+                break
+            self._stop.wait(self.pause)
+        return deleted
+
+    def start(self, interval=ROOM_REAPER_INTERVAL):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="sage_ref-room-reaper", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                deleted = self.reap()
+                if deleted:
+                    logger.info("Deleted %d empty rooms", deleted)
+            except Exception:
+                logger.exception("Could not delete empty rooms")
+            finally:
+                close_old_connections()
+            self._stop.wait(interval)
+
+
+room_reaper = RoomReaper()
+
+
+def start_room_reaper():
+    # Does nothing unless SAGE_REF_ROOM_REAPER["ENABLED"] is set
+    if ROOM_REAPER_ENABLED:
+        room_reaper.start()
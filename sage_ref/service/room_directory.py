@@ -0,0 +1,123 @@
+import hashlib
+from dataclasses import dataclass
+from django.conf import settings
+from django.core.cache import caches
+from sage_ref.models.room import Room
+
+# Cache alias holding the room directory. Use a shared backend (Redis,
+# Memcached) when running more than one worker, so invalidations reach
+# every process.
+ROOM_DIRECTORY_CACHE = getattr(settings, "SAGE_REF_ROOM_DIRECTORY_CACHE", "default")
+# Seconds a snapshot is kept even if no invalidation arrives.
+ROOM_DIRECTORY_TTL = getattr(settings, "SAGE_REF_ROOM_DIRECTORY_TTL", 300)
+
+
+@dataclass(frozen=True)
+class RoomSnapshot:
+    """
+    What a chat connection needs to know about its room, loaded once.
+
+    ``agent`` has the same shape as the ``agent`` of an
+    ``agent_status_update`` event, or is ``None`` for an unassigned room.
+    ``last_sequence`` is deliberately left out since it changes with every
+    message. ``id`` is ``None`` for a room that does not exist yet.
+    """
+    id: int
+    name: str
+    agent: dict | None
+
+    @property
+    def agent_id(self):
+        return self.agent['id'] if self.agent else None
+
+    @classmethod
+    def pending(cls, name):
+        """
+        Snapshot of a visitor's room before its first message creates it.
+        """
+        return cls(id=None, name=name, agent=None)
+
+    @classmethod
+    def from_room(cls, room):
+        agent = room.agent
+        return cls(
+            id=room.pk,
+            name=room.name,
+            agent={
+                'id': agent.pk,
+                'username': agent.user.username,
+                'status': agent.status,
+                'avatar_url': agent.avatar_url,
+            } if agent else None,
+        )
+
+    def as_room(self):
+        """
+        A ``Room`` carrying the snapshot's fields, usable for foreign keys
+        and history lookups without another query.
+        """
+        return Room(pk=self.id, name=self.name, agent_id=self.agent_id)
+
+
+class RoomDirectory:
+    """
+    Room snapshots keyed by room name, kept in the Django cache.
+
+    Entries are dropped when a room or its agent is saved (see
+    ``sage_ref.signals``) and when the agent's status changes.
+    """
+
+    def __init__(self, alias=ROOM_DIRECTORY_CACHE, ttl=ROOM_DIRECTORY_TTL):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, name):
+        return "sage_ref:room:" + hashlib.md5(name.encode()).hexdigest()
+
+    def get(self, name):
+        """
+        The snapshot of the room called ``name``, or ``None`` if there is none.
+        """
+        snapshot = self.cache.get(self.key(name))
+        if snapshot is None:
+            room = Room.objects.select_related('agent__user').filter(name=name).first()
+            if room is None:
+                return None
+            snapshot = RoomSnapshot.from_room(room)
+            self.cache.set(self.key(name), snapshot, self.ttl)
+        return snapshot
+
+    async def aget(self, name):
+        snapshot = await self.cache.aget(self.key(name))
+        if snapshot is None:
+            room = await Room.objects.select_related('agent__user').filter(name=name).afirst()
+            if room is None:
+                return None
+            snapshot = RoomSnapshot.from_room(room)
+            await self.cache.aset(self.key(name), snapshot, self.ttl)
+        return snapshot
+
+    def create(self, name):
+        """
+        The snapshot of the room called ``name``, creating the room first if
+        it does not exist yet.
+        """
+        Room.objects.get_or_create(name=name)
+        return self.get(name)
+
+    async def acreate(self, name):
+        await Room.objects.aget_or_create(name=name)
+        return await self.aget(name)
+
+    def invalidate(self, *names):
+        self.cache.delete_many([self.key(name) for name in names])
+
+    async def ainvalidate(self, *names):
+        await self.cache.adelete_many([self.key(name) for name in names])
+
+
+room_directory = RoomDirectory()
@@ -0,0 +1,184 @@
+import re
+from dataclasses import dataclass
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, QuerySet
+
+# Results per page of a search.
+SEARCH_PAGE_SIZE = getattr(settings, "SAGE_REF_SEARCH_PAGE_SIZE", 20)
+# Ranked results are paged by offset, which gets slower the deeper it
+# goes; nobody reads past this many pages.
+SEARCH_MAX_PAGES = getattr(settings, "SAGE_REF_SEARCH_MAX_PAGES", 50)
+
+
+@dataclass(frozen=True)
+class SearchIndex:
+    """
+    A text column with a full-text index: an FTS5 ``table`` kept in step by
+    triggers on SQLite, a GIN ``index`` on its tsvector on PostgreSQL.
+    Results can be limited to one ``scope`` (a foreign key) or a queryset of
+    them, one author and a range of ``timestamp``.
+    """
+    model: str
+    column: str
+    scope: str
+    timestamp: str
+    table: str
+    index: str
+
+    @property
+    def app_label(self):
+        return self.model.split(".")[0]
+
+    def get_model(self):
+        return apps.get_model(self.model)
+
+
+MESSAGE_SEARCH = SearchIndex(
+    "sage_ref.ChatMessage", "message", "room", "timestamp",
+    table="sage_ref_message_search", index="sage_ref_msg_search_idx",
+)
+# Only used when a_rtchat is installed
+GROUP_MESSAGE_SEARCH = SearchIndex(
+    "a_rtchat.GroupMessage", "body", "group", "created",
+    table="a_rtchat_message_search", index="a_rtchat_msg_search_idx",
+)
+SEARCH_INDEXES = (MESSAGE_SEARCH, GROUP_MESSAGE_SEARCH)
+
+_WORD = re.compile(r"\w+")
+
+
+def search_terms(text):
+    """
+    The words of a search, lowercased. Everything else is dropped, so
+    operators typed by a user never reach the index's query syntax.
+    """
+    return [word.lower() for word in _WORD.findall(text or "")][:16]
+
+
+def _fts5_query(terms):
+    # Every word must match; the last one may still be being typed
+    return " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+def _tsquery(terms):
+    return " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+
+
+def _filters(search, alias, scope, author, since, until):
+    meta = search.get_model()._meta
+    clauses, params = [], []
+    if isinstance(scope, QuerySet):
+        # Any of several, e.g. the groups a user may read
+        subquery, subparams = scope.values('pk').query.sql_with_params()
+        clauses.append(f"{alias}.{meta.get_field(search.scope).column} IN ({subquery})")
+        params.extend(subparams)
+    elif scope is not None:
+        clauses.append(f"{alias}.{meta.get_field(search.scope).column} = %s")
+        params.append(scope.pk)
+    if author is not None:
+        clauses.append(f"{alias}.author_id = %s")
+        params.append(author.pk)
+    timestamp = meta.get_field(search.timestamp).column
+    if since is not None:
+        clauses.append(f"{alias}.{timestamp} >= %s")
+        params.append(connection.ops.adapt_datetimefield_value(since))
+    if until is not None:
+        clauses.append(f"{alias}.{timestamp} < %s")
+        params.append(connection.ops.adapt_datetimefield_value(until))
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+
+def _ranked_ids(search, terms, scope, author, since, until, limit, offset):
+    table = search.get_model()._meta.db_table
+    filters, params = _filters(search, "m", scope, author, since, until)
+    if connection.vendor == "sqlite":
+        sql = (
+            f"SELECT m.id FROM {search.table} s JOIN {table} m ON m.id = s.rowid "
+            f"WHERE {search.table} MATCH %s{filters} "
+            f"ORDER BY s.rank, m.id DESC LIMIT %s OFFSET %s"
+        )
+        params = [_fts5_query(terms), *params, limit, offset]
+    else:
+        # Same expression as the index, so the planner uses it
+        vector = f"to_tsvector('simple', m.{search.column})"
+        sql = (
+            f"SELECT m.id FROM {table} m, to_tsquery('simple', %s) q "
+            f"WHERE {vector} @@ q{filters} "
+            f"ORDER BY ts_rank({vector}, q) DESC, m.id DESC LIMIT %s OFFSET %s"
+        )
+        params = [_tsquery(terms), *params, limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [pk for pk, in cursor.fetchall()]
+
+
+def _scanned_ids(search, terms, scope, author, since, until, limit, offset):
+    # Backends without a full-text index: unranked, newest first
+    queryset = search.get_model().objects.filter(*[Q(**{f"{search.column}__icontains": term}) for term in terms])
+    if isinstance(scope, QuerySet):
+        queryset = queryset.filter(**{f"{search.scope}__in": scope})
+    elif scope is not None:
+        queryset = queryset.filter(**{search.scope: scope})
+    if author is not None:
+        queryset = queryset.filter(author=author)
+    if since is not None:
+        queryset = queryset.filter(**{f"{search.timestamp}__gte": since})
+    if until is not None:
+        queryset = queryset.filter(**{f"{search.timestamp}__lt": until})
+    ordering = queryset.order_by(f"-{search.timestamp}", "-id")
+    return list(ordering.values_list('pk', flat=True)[offset:offset + limit])
+
+
+def _search(search, related, text, scope, author, since, until, page, page_size):
+    terms = search_terms(text)
+    if not terms or not 1 <= page <= SEARCH_MAX_PAGES:
+        return [], False
+    find = _ranked_ids if connection.vendor in ("sqlite", "postgresql") else _scanned_ids
+    ids = find(search, terms, scope, author, since, until, page_size + 1, (page - 1) * page_size)
+    found = search.get_model().objects.select_related(*related).in_bulk(ids[:page_size])
+    results = [found[pk] for pk in ids[:page_size] if pk in found]
+    return results, len(ids) > page_size and page < SEARCH_MAX_PAGES
+
+
+def search_messages(text, room=None, author=None, since=None, until=None, page=1, page_size=SEARCH_PAGE_SIZE):
+    """
+    One page of the messages matching every word of ``text``, best match
+    first, optionally limited to a room, an author and ``[since, until)``.
+    Returns the messages and whether there is a next page.
+    """
+    return _search(
+        MESSAGE_SEARCH, ('room', 'author', 'agent__user'), text, room, author, since, until, page, page_size
+    )
+
+
+def search_group_messages(text, group=None, author=None, since=None, until=None, page=1,
+                          page_size=SEARCH_PAGE_SIZE):
+    """
+    ``search_messages`` over the bodies of a_rtchat group messages,
+    optionally limited to one group or to a queryset of groups. Requires
+    a_rtchat to be installed.
+    """
+    return _search(
+        GROUP_MESSAGE_SEARCH, ('group', 'author'), text, group, author, since, until, page, page_size
+    )
+
+
+def installed_search_indexes():
+    return [search for search in SEARCH_INDEXES if apps.is_installed(search.app_label)]
+
+
+def rebuild_search_index():
+    """
+    Index every stored message again, e.g. after the migration that adds
+    the index or a bulk load that bypassed it. Covers group messages too
+    when a_rtchat is installed.
+    """
+    with connection.cursor() as cursor:
+        for search in installed_search_indexes():
+            if connection.vendor == "sqlite":
+                cursor.execute(f"INSERT INTO {search.table}({search.table}) VALUES ('rebuild')")
+                cursor.execute(f"INSERT INTO {search.table}({search.table}) VALUES ('optimize')")
+            elif connection.vendor == "postgresql":
+                cursor.execute(f"REINDEX INDEX CONCURRENTLY {search.index}")
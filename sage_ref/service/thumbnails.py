@@ -0,0 +1,122 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS = getattr(settings, "SAGE_REF_THUMBNAILS", {})
+# Threads making thumbnails. Pillow releases the GIL while decoding,
+# resizing and encoding, so threads use several cores without a broker.
+THUMBNAIL_WORKERS = THUMBNAILS.get("WORKERS", 2)
+# Storage directory of the variants, under MEDIA_ROOT.
+THUMBNAIL_DIRECTORY = THUMBNAILS.get("DIRECTORY", "thumbnails")
+THUMBNAIL_FORMAT = THUMBNAILS.get("FORMAT", "WEBP")
+THUMBNAIL_QUALITY = THUMBNAILS.get("QUALITY", 80)
+# Bounding box of each variant: twice the size it is shown at, for
+# high-density screens.
+THUMBNAIL_SIZES = {
+    "avatar": (100, 100),
+    "preview": (576, 576),
+    **THUMBNAILS.get("SIZES", {}),
+}
+
+
+def variant_name(digest, variant):
+    width, height = THUMBNAIL_SIZES[variant]
+    extension = THUMBNAIL_FORMAT.lower()
+    return f"{THUMBNAIL_DIRECTORY}/{digest[:2]}/{digest}-{width}x{height}.{extension}"
+
+
+def render_thumbnail(file, size):
+    """
+    The image in ``file`` scaled down to fit ``size``, encoded in
+    ``THUMBNAIL_FORMAT``.
+    """
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        output = io.BytesIO()
+        image.save(output, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        return output.getvalue()
+
+
+def make_thumbnail(field_file, variant, storage=default_storage):
+    """
+    Store the ``variant`` of an image field's file and return its storage
+    name.
+
+    Variants are named by the SHA-256 of the source, so the same image
+    uploaded twice is only scaled once.
+    """
+    digest = hashlib.sha256()
+    field_file.open("rb")
+    try:
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+        name = variant_name(digest.hexdigest(), variant)
+        if storage.exists(name):
+            return name
+        field_file.seek(0)
+        data = render_thumbnail(field_file, THUMBNAIL_SIZES[variant])
+    finally:
+        field_file.close()
+    return storage.save(name, ContentFile(data))
+
+
+class ThumbnailPool:
+    """
+    Makes thumbnail variants in background threads.
+
+    ``submit`` returns at once. Once the surrounding transaction commits, a
+    worker renders the variant of the instance's ``field`` and stores its
+    name in ``target``. The name is only written if ``field`` still holds
+    the same file, so a replaced image never gets a stale thumbnail.
+    ``on_done(pk)`` runs in the worker afterwards, whether or not it
+    succeeded.
+    """
+
+    def __init__(self, workers=THUMBNAIL_WORKERS):
+        self.workers = workers
+        self._executor = None
+
+    def submit(self, instance, field, target, variant, on_done=None):
+        job = (type(instance), instance.pk, field, target, variant, getattr(instance, field).name, on_done)
+        transaction.on_commit(lambda: self.executor().submit(self._run, *job))
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="thumbnails")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _run(self, model, pk, field, target, variant, source, on_done):
+        close_old_connections()
+        try:
+            instance = model.objects.filter(pk=pk).first()
+            if instance is not None and getattr(instance, field).name == source:
+                name = make_thumbnail(getattr(instance, field), variant)
+                model.objects.filter(pk=pk, **{field: source}).update(**{target: name})
+        except Exception:
+            logger.exception("Could not make the %s thumbnail of %s %s", variant, model.__name__, pk)
+        finally:
+            if on_done is not None:
+                try:
+                    on_done(pk)
+                except Exception:
+                    logger.exception("Thumbnail callback failed for %s %s", model.__name__, pk)
+            close_old_connections()
+
+
+thumbnail_pool = ThumbnailPool()
@@ -0,0 +1,179 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time
+from itertools import chain, islice
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from sage_ref.models.agent import Agent
+from sage_ref.models.chat import ChatMessage
+from sage_ref.models.room import Room
+from sage_ref.service.archive import message_archive
+
+User = get_user_model()
+
+# Rows read per database round trip, and per username lookup.
+TRANSCRIPT_CHUNK_SIZE = getattr(settings, "SAGE_REF_TRANSCRIPT_CHUNK_SIZE", 2000)
+# Uncompressed bytes collected before a compressed chunk is sent.
+TRANSCRIPT_BUFFER_BYTES = 64 * 1024
+TRANSCRIPT_FIELDS = ("room", "id", "sequence", "timestamp", "author", "agent", "session_key", "message")
+TRANSCRIPT_FORMATS = ("jsonl", "csv")
+
+
+def parse_bound(value):
+    """
+    The datetime of an ISO date or date-time (midnight for a date, the
+    current time zone when none is given), or ``None`` for an empty value.
+    Raises ``ValueError`` if it is malformed.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date: {value!r}")
+        parsed = datetime.combine(date, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Usernames:
+    """
+    Usernames of message authors and agents, fetched for a whole chunk of
+    rows at once. Only a bounded number of names is kept between chunks.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.users = {}
+        self.agents = {}
+
+    def load(self, rows):
+        if len(self.users) + len(self.agents) > self.max_size:
+            self.users.clear()
+            self.agents.clear()
+        users = {row[4] for row in rows if row[4] is not None} - self.users.keys()
+        if users:
+            self.users.update(User.objects.filter(pk__in=users).values_list('pk', User.USERNAME_FIELD))
+        agents = {row[5] for row in rows if row[5] is not None} - self.agents.keys()
+        if agents:
+            self.agents.update(Agent.objects.filter(pk__in=agents).values_list('pk', 'user__username'))
+
+
+def _room_rows(room, since, until, chunk_size):
+    # Archived messages first, then the live ones after the archive's end
+    for record in message_archive.records(room.pk, since, until):
+        yield (
+            room.name, record['id'], record['sequence'], record['timestamp'],
+            record['author'], record['agent'], record['session_key'], record['message'],
+        )
+    queryset = ChatMessage.objects.filter(room=room)
+    archived = message_archive.last_key(room.pk)
+    if archived is not None:
+        queryset = queryset.filter(timestamp__gte=archived[0]).exclude(timestamp=archived[0], id__lte=archived[1])
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+    rows = queryset.order_by('timestamp', 'id').values_list(
+        'id', 'sequence', 'timestamp', 'author_id', 'agent_id', 'session_key', 'message'
+    )
+    for pk, sequence, timestamp, author_id, agent_id, session_key, message in rows.iterator(chunk_size=chunk_size):
+        yield room.name, pk, sequence, timestamp.isoformat(), author_id, agent_id, session_key, message
+
+
+def _rooms(since, until, chunk_size):
+    # Paged by primary key rather than held open, since every room runs
+    # its own message query
+    rooms = Room.objects.filter(last_message_at__isnull=False)
+    if since is not None:
+        rooms = rooms.filter(last_message_at__gte=since)
+    if until is not None:
+        rooms = rooms.filter(created_at__lt=until)
+    last_pk = 0
+    while page := list(rooms.filter(pk__gt=last_pk).order_by('pk').only('pk', 'name')[:chunk_size]):
+        yield from page
+        last_pk = page[-1].pk
+
+
+def transcript_rows(room=None, since=None, until=None, chunk_size=TRANSCRIPT_CHUNK_SIZE):
+    """
+    Every message of ``room`` (or of all rooms) sent in ``[since, until)``,
+    archived ones included, as dicts of ``TRANSCRIPT_FIELDS``.
+
+    Rooms come one after another with their messages oldest first. Rows are
+    read ``chunk_size`` at a time and the usernames of a chunk are looked up
+    together, so memory does not grow with the size of the export.
+    """
+    rooms = [room] if room is not None else _rooms(since, until, chunk_size)
+    rows = chain.from_iterable(_room_rows(room, since, until, chunk_size) for room in rooms)
+    usernames = Usernames()
+    while chunk := list(islice(rows, chunk_size)):
+        usernames.load(chunk)
+        for name, pk, sequence, timestamp, author_id, agent_id, session_key, message in chunk:
+            yield {
+                'room': name,
+                'id': pk,
+                'sequence': sequence,
+                'timestamp': timestamp,
+                'author': usernames.users.get(author_id, ""),
+                'agent': usernames.agents.get(agent_id, ""),
+                'session_key': session_key or "",
+                'message': message,
+            }
+
+
+def _jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, TRANSCRIPT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def transcript_stream(rows, format="jsonl", buffer_bytes=TRANSCRIPT_BUFFER_BYTES):
+    """
+    ``rows`` encoded as JSON lines or CSV and gzip-compressed, yielded in
+    chunks.
+    """
+    lines = _csv_lines(rows) if format == "csv" else _jsonl_lines(rows)
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    pending, size = [], 0
+    for line in lines:
+        pending.append(line.encode())
+        size += len(pending[-1])
+        if size >= buffer_bytes:
+            data = compressor.compress(b"".join(pending))
+            pending, size = [], 0
+            if data:
+                yield data
+    yield compressor.compress(b"".join(pending)) + compressor.flush()
+
+
+async def aiter_sync(iterator):
+    """
+    Consume a synchronous iterator from async code one item at a time, in
+    the thread sync database code runs in.
+
+    Django reads a plain iterator passed to ``StreamingHttpResponse`` into
+    a list when serving it over ASGI.
+    """
+    iterator = iter(iterator)
+    next_item = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    while (item := await next_item(iterator, done)) is not done:
+        yield item
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between two typing broadcasts from one connection.
+TYPING_MIN_INTERVAL = getattr(settings, "SAGE_REF_TYPING_MIN_INTERVAL", 1.0)
+# A connection that reported typing and then went quiet for this many
+# seconds is broadcast as stopped.
+TYPING_IDLE_TIMEOUT = getattr(settings, "SAGE_REF_TYPING_IDLE_TIMEOUT", 5.0)
+
+
+class TypingMetrics:
+    def __init__(self):
+        self.forwarded = 0
+        self.suppressed = 0
+
+    def record(self, forwarded):
+        if forwarded:
+            self.forwarded += 1
+        else:
+            self.suppressed += 1
+        if (self.forwarded + self.suppressed) % 1000 == 0:
+            logger.info("Typing events: %s", self.stats())
+
+    def stats(self):
+        return {'forwarded': self.forwarded, 'suppressed': self.suppressed}
+
+
+typing_metrics = TypingMetrics()
+
+
+class TypingThrottle:
+    """
+    Turns one connection's stream of typing frames into start/stop edges.
+
+    Repeated states are dropped, edges are at most one per ``min_interval``
+    (a change inside the interval is sent when it ends, if it still holds)
+    and a connection that stays silent for ``idle_timeout`` after typing is
+    reported as stopped. ``emit`` is awaited with the new state.
+    """
+
+    def __init__(self, emit, min_interval=TYPING_MIN_INTERVAL, idle_timeout=TYPING_IDLE_TIMEOUT):
+        self.emit = emit
+        self.min_interval = min_interval
+        self.idle_timeout = idle_timeout
+        self.wanted = False
+        self.sent = False
+        self.last_sent = float('-inf')
+        self._deferred = None
+        self._idle = None
+
+    async def update(self, typing):
+        self.wanted = bool(typing)
+        self._cancel_idle()
+        if self.wanted:
+            self._idle = asyncio.get_running_loop().create_task(self._expire())
+        typing_metrics.record(await self._flush())
+
+    async def stop(self):
+        """
+        Report a typing connection as stopped right away, e.g. on disconnect.
+        """
+        self._cancel_idle()
+        if self._deferred is not None:
+            self._deferred.cancel()
+            self._deferred = None
+        self.wanted = False
+        if self.sent:
+            await self._send()
+
+    async def _flush(self):
+        if self.wanted == self.sent:
+            return False
+        wait = self.last_sent + self.min_interval - time.monotonic()
+        if wait > 0:
+            if self._deferred is None:
+                self._deferred = asyncio.get_running_loop().create_task(self._flush_later(wait))
+            return False
+        await self._send()
+        return True
+
+    async def _send(self):
+        self.sent = self.wanted
+        self.last_sent = time.monotonic()
+        await self.emit(self.sent)
+
+    async def _flush_later(self, wait):
+        await asyncio.sleep(wait)
+        self._deferred = None
+        await self._flush()
+
+    async def _expire(self):
+        await asyncio.sleep(self.idle_timeout)
+        self._idle = None
+        self.wanted = False
+        await self._flush()
+
+    def _cancel_idle(self):
+        if self._idle is not None:
+            self._idle.cancel()
+            self._idle = None
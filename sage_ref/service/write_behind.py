@@ -0,0 +1,378 @@
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from sage_ref.models.room import Room
+from sage_ref.models.chat import ChatMessage
+from sage_ref.service.history import recent_message_cache
+from sage_ref.service.inbox import INBOX_GROUP, inbox_event
+from sage_ref.service.messages import room_activity
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND = getattr(settings, "SAGE_REF_WRITE_BEHIND", {})
+# Queue chat messages in memory and store them in batches instead of
+# writing each one inside ``receive``.
+WRITE_BEHIND_ENABLED = WRITE_BEHIND.get("ENABLED", False)
+# A batch is written once it holds this many messages...
+WRITE_BEHIND_BATCH_SIZE = WRITE_BEHIND.get("BATCH_SIZE", 200)
+# ...or this many seconds after its first message was queued.
+WRITE_BEHIND_FLUSH_INTERVAL = WRITE_BEHIND.get("FLUSH_INTERVAL", 0.05)
+# Messages waiting to be written; senders are slowed down beyond this.
+WRITE_BEHIND_MAX_QUEUE = WRITE_BEHIND.get("MAX_QUEUE", 10000)
+# Further attempts at storing a batch that failed, the first one after
+# this many seconds and each next one after twice as long.
+WRITE_BEHIND_RETRIES = WRITE_BEHIND.get("RETRIES", 3)
+WRITE_BEHIND_RETRY_DELAY = WRITE_BEHIND.get("RETRY_DELAY", 0.1)
+# Ids and sequence numbers are reserved in the database this many at a
+# time per room, so several workers never hand out the same one. Each
+# worker numbers a room's messages from its own block, so the history of
+# a room several workers write to follows the blocks rather than strict
+# arrival; smaller blocks keep it closer at the cost of more reservations.
+WRITE_BEHIND_RESERVE_SIZE = WRITE_BEHIND.get("RESERVE_SIZE", 20)
+
+_STOP = object()
+
+
+class PendingMessage:
+    __slots__ = ("message", "group", "reply_channel", "loop")
+
+    def __init__(self, message, group, reply_channel, loop):
+        self.message = message
+        self.group = group
+        self.reply_channel = reply_channel
+        self.loop = loop
+
+
+class Reservation:
+    """
+    Ids and sequence numbers of a room reserved in the database, handed out
+    in order. ``ids`` is empty where ids cannot be reserved ahead.
+    """
+    __slots__ = ("ids", "next_sequence", "last_sequence")
+
+    def __init__(self, ids, next_sequence, last_sequence):
+        self.ids = ids
+        self.next_sequence = next_sequence
+        self.last_sequence = last_sequence
+
+    @property
+    def exhausted(self):
+        return self.next_sequence > self.last_sequence
+
+    def take(self):
+        if self.exhausted:
+            return None
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        return (self.ids.popleft() if self.ids else None), sequence
+
+
+def reserve_message_ids(count):
+    """
+    Reserve ``count`` ids of ``ChatMessage`` rows not inserted yet, in the
+    current transaction. Returns an empty list where the backend cannot.
+    """
+    table = ChatMessage._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            # AUTOINCREMENT never hands out an id at or below this counter
+            cursor.execute("UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s", [count, table])
+            if not cursor.rowcount:
+                cursor.execute(
+                    f"INSERT INTO sqlite_sequence (name, seq) SELECT %s, COALESCE(MAX(id), 0) + %s FROM {table}",
+                    [table, count],
+                )
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            last_id = cursor.fetchone()[0]
+            return list(range(last_id - count + 1, last_id + 1))
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, count]
+            )
+            return [pk for pk, in cursor.fetchall()]
+    return []
+
+
+async def _running_loop():
+    return asyncio.get_running_loop()
+
+
+class MessageWriter:
+    """
+    Write-behind store for chat messages.
+
+    ``submit`` gives the message an id and sequence number reserved in
+    the database, adds it to the room's recent history and returns it
+    unsaved, so it can be broadcast right away. A background thread stores
+    queued messages with one ``bulk_create`` per batch and then sends a
+    ``message_ack`` event to the channel of each sender, from the event
+    loop the sender submitted on. ``close`` writes whatever is still
+    queued; it runs at interpreter exit.
+
+    A batch that cannot be stored is retried with backoff. If it still
+    fails, the senders are acked with ``persisted=False`` so their clients
+    send the messages again, the other sockets of the room are sent a
+    ``message_dropped`` event to take them off the page, and the rooms'
+    recent history is reloaded from the database. Their numbers are never
+    handed out again.
+    """
+
+    def __init__(self, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_queue=WRITE_BEHIND_MAX_QUEUE, retries=WRITE_BEHIND_RETRIES,
+                 retry_delay=WRITE_BEHIND_RETRY_DELAY, reserve_size=WRITE_BEHIND_RESERVE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.reserve_size = reserve_size
+        self.written = 0
+        self.batches = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._reservations = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, room, message, author=None, session_key=None, agent=None, group=None, reply_channel=None):
+        """
+        Queue a message and return it, numbered but not yet saved.
+
+        ``group`` is the channel layer group the message is broadcast to;
+        it is told if the message is dropped. Blocks while the queue is
+        full. Call from sync code only.
+        """
+        loop = async_to_sync(_running_loop)()
+        fields = dict(message=message, author=author, session_key=session_key, agent=agent)
+        while (pending := self._prepare(room, group, reply_channel, loop, **fields)) is None:
+            self._reserve(room)
+        self._enqueue(pending)
+        return pending.message
+
+    async def asubmit(self, room, message, author=None, session_key=None, agent=None, group=None,
+                      reply_channel=None):
+        loop = asyncio.get_running_loop()
+        fields = dict(message=message, author=author, session_key=session_key, agent=agent)
+        while (pending := self._prepare(room, group, reply_channel, loop, **fields)) is None:
+            await database_sync_to_async(self._reserve)(room)
+        try:
+            self._enqueue(pending, block=False)
+        except queue.Full:
+            # Wait in a thread rather than blocking the event loop.
+            await asyncio.to_thread(self._enqueue, pending)
+        return pending.message
+
+    def _reserve(self, room):
+        """
+        Reserve the room's next block of ids and sequence numbers.
+        """
+        size = self.reserve_size
+        with transaction.atomic():
+            # Moves the counter past the block, so no other writer, here or
+            # in another worker, is given the same numbers
+            Room.objects.filter(pk=room.pk).update(last_sequence=F('last_sequence') + size)
+            last_sequence = Room.objects.filter(pk=room.pk).values_list('last_sequence', flat=True).get()
+            ids = reserve_message_ids(size)
+        with self._lock:
+            # A block reserved meanwhile by another sender goes first; a
+            # block below numbers already handed out is left unused
+            current = self._reservations.get(room.pk)
+            if current is None or (current.exhausted and current.last_sequence < last_sequence):
+                self._reservations[room.pk] = Reservation(deque(ids), last_sequence - size + 1, last_sequence)
+
+    def _prepare(self, room, group, reply_channel, loop, **fields):
+        # None once the room's reservation has run out
+        with self._lock:
+            reservation = self._reservations.get(room.pk)
+            numbers = reservation.take() if reservation is not None else None
+            if numbers is None:
+                return None
+            pk, sequence = numbers
+            chat_message = ChatMessage(pk=pk, room=room, sequence=sequence, **fields)
+            recent_message_cache.append(room.pk, chat_message)
+        room.last_sequence = sequence
+        return PendingMessage(chat_message, group, reply_channel, loop)
+
+    def _enqueue(self, pending, block=True):
+        if self._closed:
+            raise RuntimeError("The message writer has been closed.")
+        self._ensure_started()
+        self._queue.put(pending, block=block)
+
+    def close(self):
+        """
+        Stop accepting queued writes and store everything still pending.
+        """
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sage_ref-message-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if stopping:
+                # Anything queued behind the stop marker still gets written.
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+        close_old_connections()
+
+    def _write(self, batch):
+        messages = [pending.message for pending in batch]
+        rooms = {}
+        for pending in sorted(batch, key=lambda pending: pending.message.sequence):
+            rooms.setdefault(pending.message.room_id, []).append(pending)
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                close_old_connections()
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create(messages)
+                    # In a fixed order, so concurrent writers lock rooms alike
+                    for room_id, room_batch in sorted(rooms.items()):
+                        Room.objects.filter(pk=room_id).update(**self._room_update(room_batch))
+            except Exception:
+                if attempt == self.retries:
+                    logger.exception("Could not store %d chat messages", len(messages))
+                    persisted = False
+                    break
+                logger.warning("Could not store %d chat messages, retrying", len(messages), exc_info=True)
+                time.sleep(delay)
+                delay *= 2
+            else:
+                persisted = True
+                self.written += len(messages)
+                self.batches += 1
+                break
+        if not persisted:
+            self._forget(rooms)
+            self._withdraw(batch)
+        self._acknowledge(batch, persisted)
+        if persisted:
+            self._notify_inbox(rooms)
+
+    def _forget(self, rooms):
+        # The history is read again from the database
+        with self._lock:
+            for room_id in rooms:
+                recent_message_cache.invalidate(room_id)
+
+    def _withdraw(self, batch):
+        """
+        Take the messages of a batch that was never stored off the pages
+        they were broadcast to. Their senders resend them on the ack.
+        """
+        dropped = {}
+        for pending in batch:
+            if pending.group and pending.loop is not None:
+                event = dropped.setdefault((pending.loop, pending.group, pending.message.room_id), {
+                    'type': 'message_dropped',
+                    'room_id': pending.message.room_id,
+                    'sequences': [],
+                    'senders': {},
+                })
+                event['sequences'].append(pending.message.sequence)
+                if pending.reply_channel:
+                    event['senders'].setdefault(pending.reply_channel, []).append(pending.message.sequence)
+        for (loop, group, room_id), event in dropped.items():
+            self._deliver(loop, 'group_send', group, event)
+
+    def _room_update(self, room_batch):
+        """
+        Field updates applying a room's batch of messages, oldest first, in
+        the same way ``post_message`` applies a single one.
+        """
+        latest = room_batch[-1].message
+        replied = [i for i, pending in enumerate(room_batch) if pending.message.agent_id is not None]
+        if replied:
+            unread_count = len(room_batch) - replied[-1] - 1
+        else:
+            unread_count = F('unread_count') + len(room_batch)
+        return {
+            'last_sequence': Greatest(F('last_sequence'), latest.sequence),
+            'message_count': F('message_count') + len(room_batch),
+            'unread_count': unread_count,
+            **room_activity(latest),
+        }
+
+    def _notify_inbox(self, rooms):
+        stored = Room.objects.filter(pk__in=rooms).select_related('agent__user')
+        for room in stored:
+            loop = rooms[room.pk][-1].loop
+            if loop is not None:
+                agent_username = room.agent.user.username if room.agent else ""
+                self._deliver(loop, 'group_send', INBOX_GROUP, inbox_event(room, agent_username))
+
+    def _acknowledge(self, batch, persisted):
+        sequences = {}
+        for pending in batch:
+            if pending.reply_channel:
+                key = (pending.loop, pending.reply_channel, pending.message.room_id)
+                sequences.setdefault(key, []).append(pending.message.sequence)
+        for (loop, channel, room_id), channel_sequences in sequences.items():
+            self._deliver(loop, 'send', channel, {
+                'type': 'message_ack',
+                'room_id': room_id,
+                'sequences': channel_sequences,
+                'persisted': persisted,
+            })
+
+    def _deliver(self, loop, method, target, event):
+        # Channel layers are not thread safe, so events are sent from the
+        # loop that owns the sender's connection.
+        try:
+            loop.call_soon_threadsafe(_send_event, method, target, event)
+        except RuntimeError:
+            # The loop has already shut down, nobody is left to tell.
+            pass
+
+
+def _send_event(method, target, event):
+    asyncio.ensure_future(getattr(get_channel_layer(), method)(target, event))
+
+
+message_writer = MessageWriter()
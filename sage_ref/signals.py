@@ -0,0 +1,71 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from sage_ref.models.agent import Agent
+from sage_ref.models.room import Room
+from sage_ref.service.agent_status import agent_presence_changed
+from sage_ref.service.assignment import assignment_scheduler
+from sage_ref.service.handshake import handshake_users
+from sage_ref.service.inbox import INBOX_GROUP, inbox_event
+from sage_ref.service.room_directory import room_directory
+from sage_ref.service.thumbnails import thumbnail_pool
+
+
+@receiver([post_save, post_delete], sender=Room)
+def invalidate_room_snapshot(sender, instance, **kwargs):
+    room_directory.invalidate(instance.name)
+
+
+@receiver(post_save, sender=Room)
+def notify_inbox_of_room_change(sender, instance, created, update_fields=None, **kwargs):
+    # Rooms enter the inbox with their first message; after that, saves
+    # that may change the assigned agent are pushed to the agents.
+    if created or instance.last_message_at is None:
+        return
+    if update_fields is not None and 'agent' not in update_fields:
+        return
+    agent_username = ""
+    if instance.agent_id is not None:
+        agent_username = Agent.objects.filter(pk=instance.agent_id).values_list('user__username', flat=True).first() or ""
+    # Built now, sent once the change is visible to the agents' pages
+    event = inbox_event(instance, agent_username)
+    transaction.on_commit(lambda: async_to_sync(get_channel_layer().group_send)(INBOX_GROUP, event))
+
+
+@receiver(user_logged_out)
+def forget_handshake_user(sender, request, **kwargs):
+    # Sent before the session is flushed, while its key is still known
+    if request.session.session_key:
+        handshake_users.invalidate(request.session.session_key)
+
+
+@receiver(agent_presence_changed)
+async def schedule_agent(sender, agent, online, **kwargs):
+    if online:
+        await assignment_scheduler.agent_online(agent)
+    else:
+        await assignment_scheduler.agent_offline(agent)
+
+
+# Before delete, while the rooms still point at the agent
+@receiver([post_save, pre_delete], sender=Agent)
+def invalidate_agent_room_snapshots(sender, instance, **kwargs):
+    forget_agent_rooms(instance.pk)
+
+
+def forget_agent_rooms(agent_id):
+    names = list(Room.objects.filter(agent_id=agent_id).values_list('name', flat=True))
+    if names:
+        room_directory.invalidate(*names)
+
+
+@receiver(post_save, sender=Agent)
+def make_avatar_thumbnail(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    if instance.avatar:
+        # Snapshots carry the avatar URL; drop them once the thumbnail is in
+        thumbnail_pool.submit(instance, 'avatar', 'avatar_thumbnail', 'avatar', on_done=forget_agent_rooms)
@@ -0,0 +1,120 @@
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connections
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+
+from sage_ref.helpers.enums import AgentStatus
+from sage_ref.models import Agent, Room
+from sage_ref.service.async_consumer import AsyncChatConsumer
+from sage_ref.service.consumer import ChatConsumer
+
+User = get_user_model()
+
+
+class UserScope:
+    def __init__(self, inner, user):
+        self.inner = inner
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=self.user, session=SessionStore(session_key=uuid.uuid4().hex))
+        return await self.inner(scope, receive, send)
+
+
+class AgentStatusWritesTests(TransactionTestCase):
+    """
+    Each agent status transition writes the Agent row once, however many
+    sockets the agent and the room's visitors have open.
+    """
+
+    consumer = AsyncChatConsumer
+    members = 5
+
+    def setUp(self):
+        self.user = User.objects.create(username="agent")
+        self.agent = Agent.objects.create(user=self.user)
+        self.room = Room.objects.create(name="room", agent=self.agent)
+
+    def socket(self, user):
+        router = URLRouter([path("ws/chatroom/<str:chatroom_name>/", self.consumer.as_asgi())])
+        return WebsocketCommunicator(UserScope(router, user), f"/ws/chatroom/{self.room.name}/")
+
+    async def settle(self, sockets):
+        for socket in sockets:
+            while not await socket.receive_nothing(timeout=0.05):
+                await socket.receive_from()
+
+    def agent_updates(self, queries):
+        table = Agent._meta.db_table
+        return sum(
+            1 for query in queries
+            if query['sql'].lstrip().upper().startswith("UPDATE") and table in query['sql']
+        )
+
+    def test_one_write_per_transition(self):
+        # Pinned to this thread's connection, which the consumers' database
+        # calls share
+        queries = CaptureQueriesContext(connections['default'])
+        marks = []
+
+        async def run():
+            visitors = [self.socket(AnonymousUser()) for _ in range(self.members)]
+            for visitor in visitors:
+                await visitor.connect()
+            tabs = [self.socket(self.user), self.socket(self.user)]
+            for tab in tabs:
+                start = len(queries)
+                await tab.connect()
+                await self.settle(visitors)
+                marks.append(queries.captured_queries[start:])
+            for tab in tabs:
+                start = len(queries)
+                await tab.disconnect()
+                await self.settle(visitors)
+                marks.append(queries.captured_queries[start:])
+            for visitor in visitors:
+                await visitor.disconnect()
+
+        with queries:
+            async_to_sync(run)()
+
+        first_tab, second_tab, first_close, last_close = (self.agent_updates(mark) for mark in marks)
+        self.assertEqual(first_tab, 1)
+        self.assertEqual(second_tab, 0)
+        self.assertEqual(first_close, 0)
+        self.assertEqual(last_close, 1)
+        self.agent.refresh_from_db()
+        self.assertEqual(self.agent.status, AgentStatus.OFFLINE)
+
+    def test_back_at_capacity_goes_straight_to_busy(self):
+        Agent.objects.filter(pk=self.agent.pk).update(capacity=1)
+        queries = CaptureQueriesContext(connections['default'])
+        marks = []
+
+        async def run():
+            tab = self.socket(self.user)
+            await tab.connect()
+            await self.settle([tab])
+            marks.append(queries.captured_queries[:])
+            marks.append(await Agent.objects.values_list('status', flat=True).aget(pk=self.agent.pk))
+            await tab.disconnect()
+
+        with queries:
+            async_to_sync(run)()
+
+        # The open chat in the room fills its one slot
+        connect, status = marks
+        self.assertEqual(status, AgentStatus.BUSY)
+        self.assertEqual(self.agent_updates(connect), 1)
+
+
+class SyncAgentStatusWritesTests(AgentStatusWritesTests):
+    consumer = ChatConsumer
@@ -0,0 +1,81 @@
+import json
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.exceptions import PermissionDenied
+from django.test import TransactionTestCase
+from django.urls import path
+
+from sage_ref.models import Agent, Room
+from sage_ref.service.assignment import AssignmentScheduler
+from sage_ref.service.multiplex_consumer import AgentMultiplexConsumer
+
+User = get_user_model()
+
+
+class UserScope:
+    def __init__(self, inner, user):
+        self.inner = inner
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=self.user, session=SessionStore(session_key=uuid.uuid4().hex))
+        return await self.inner(scope, receive, send)
+
+
+class CloseRoomTests(TransactionTestCase):
+    """
+    Only the room's agent or staff can close a chat, whichever way the
+    request comes in.
+    """
+
+    def setUp(self):
+        self.owner = Agent.objects.create(user=User.objects.create(username="owner"))
+        self.other = Agent.objects.create(user=User.objects.create(username="other"))
+        self.staff = User.objects.create(username="staff", is_staff=True)
+        self.room = Room.objects.create(name="room", agent=self.owner)
+        self.scheduler = AssignmentScheduler()
+
+    def close(self, user):
+        return async_to_sync(self.scheduler.close)(Room.objects.get(pk=self.room.pk), user)
+
+    def test_other_agent_cannot_close(self):
+        with self.assertRaises(PermissionDenied):
+            self.close(self.other.user)
+        self.room.refresh_from_db()
+        self.assertIsNone(self.room.closed_at)
+        self.assertEqual(self.room.agent_id, self.owner.pk)
+
+    def test_assigned_agent_closes(self):
+        self.assertTrue(self.close(self.owner.user))
+        self.assertFalse(self.close(self.owner.user))
+        self.room.refresh_from_db()
+        self.assertIsNotNone(self.room.closed_at)
+
+    def test_staff_closes(self):
+        self.assertTrue(self.close(self.staff))
+
+    def test_multiplex_close_of_another_agents_room(self):
+        router = URLRouter([path("ws/agent/", AgentMultiplexConsumer.as_asgi())])
+
+        async def run():
+            socket = WebsocketCommunicator(UserScope(router, self.other.user), "/ws/agent/")
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            await socket.send_json_to({"action": "subscribe", "room": self.room.name})
+            while not await socket.receive_nothing(timeout=0.1):
+                await socket.receive_from()
+            await socket.send_json_to({"action": "close", "room": self.room.name})
+            frame = json.loads(await socket.receive_from())
+            await socket.disconnect()
+            return frame
+
+        frame = async_to_sync(run)()
+        self.assertEqual(frame["room"], self.room.name)
+        self.assertIn("error", frame)
+        self.room.refresh_from_db()
+        self.assertIsNone(self.room.closed_at)
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+
+from sage_ref.service.presence import RedisPresence
+
+REDIS_ADDRESS = "redis://127.0.0.1:6379/0"
+
+
+class RedisPresenceTests(SimpleTestCase):
+    """
+    Connections registered in Redis expire without heartbeats and are
+    counted alike by every worker. Skipped without a Redis server.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        try:
+            import redis
+
+            redis.Redis.from_url(REDIS_ADDRESS, socket_connect_timeout=1).ping()
+        except Exception as e:
+            raise unittest.SkipTest(f"Redis is not available: {e}")
+
+    def run_with(self, test, workers=1, ttl=30):
+        # One backend per worker, all on the same keys
+        prefix = f"sage_ref-test:{uuid.uuid4().hex}"
+        backends = [RedisPresence(ttl=ttl, address=REDIS_ADDRESS, prefix=prefix) for _ in range(workers)]
+
+        async def run():
+            try:
+                await test(*backends)
+            finally:
+                for backend in backends:
+                    await backend._client().aclose()
+
+        async_to_sync(run)()
+
+    def test_connection_expires_without_heartbeat(self):
+        async def test(backend):
+            self.assertEqual(await backend.connect("alice", "socket-1"), 1)
+            self.assertEqual(await backend.status("alice"), "online")
+            await asyncio.sleep(1.2)
+            self.assertEqual(await backend.count("alice"), 0)
+            self.assertEqual(await backend.status("alice"), "offline")
+            # The key goes with it
+            self.assertFalse(await backend._client().exists(backend._key("alice")))
+
+        self.run_with(test, ttl=1)
+
+    def test_heartbeat_keeps_connection_alive(self):
+        async def test(backend):
+            await backend.connect("alice", "socket-1")
+            for _ in range(3):
+                await asyncio.sleep(0.6)
+                await backend.heartbeat("alice", "socket-1")
+            self.assertEqual(await backend.count("alice"), 1)
+
+        self.run_with(test, ttl=1)
+
+    def test_heartbeat_does_not_register(self):
+        async def test(backend):
+            await backend.heartbeat("alice", "socket-1")
+            self.assertEqual(await backend.count("alice"), 0)
+            await backend.connect("alice", "socket-1")
+            await backend.heartbeat("alice", "socket-2")
+            self.assertEqual(await backend.count("alice"), 1)
+
+        self.run_with(test)
+
+    def test_counts_across_workers(self):
+        async def test(first, second):
+            self.assertEqual(await first.connect("alice", "socket-1"), 1)
+            self.assertEqual(await second.connect("alice", "socket-2"), 2)
+            self.assertEqual(await first.count("alice"), 2)
+            self.assertEqual(await first.disconnect("alice", "socket-1"), 1)
+            self.assertEqual(await second.count("alice"), 1)
+            self.assertEqual(await first.disconnect("alice", "socket-2"), 0)
+            self.assertEqual(await second.status("alice"), "offline")
+
+        self.run_with(test, workers=2)
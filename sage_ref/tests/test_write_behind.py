@@ -0,0 +1,81 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import DatabaseError
+from django.test import TransactionTestCase
+
+from sage_ref.models import ChatMessage, Room
+from sage_ref.service.messages import dropped_sequences
+from sage_ref.service.write_behind import MessageWriter
+
+
+class WriteBehindTests(TransactionTestCase):
+    """
+    Write-behind numbers messages from blocks reserved in the database, so
+    writers in several workers never share an id or sequence number, and
+    takes back what it broadcast ahead of a write that failed.
+    """
+
+    def setUp(self):
+        self.room = Room.objects.create(name="room")
+
+    def test_writers_never_share_numbers(self):
+        # One writer per worker, each with its own reservations; both
+        # store everything on close
+        writers = [MessageWriter(flush_interval=60, reserve_size=3) for _ in range(2)]
+
+        async def run():
+            sent = []
+            for i in range(10):
+                for n, writer in enumerate(writers):
+                    sent.append(await writer.asubmit(self.room, f"message {n}-{i}", session_key=f"s{n}"))
+            return sent
+
+        sent = async_to_sync(run)()
+        for writer in writers:
+            writer.close()
+        stored = ChatMessage.objects.filter(room=self.room)
+        self.assertEqual(stored.count(), 20)
+        self.assertEqual(len({message.sequence for message in sent}), 20)
+        self.assertEqual(
+            {(message.pk, message.sequence, message.message) for message in sent},
+            set(stored.values_list('pk', 'sequence', 'message')),
+        )
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 20)
+        self.assertGreaterEqual(self.room.last_sequence, max(message.sequence for message in sent))
+
+    def test_failed_batch_is_withdrawn(self):
+        writer = MessageWriter(flush_interval=0.01, retries=0)
+        self.addCleanup(writer.close)
+        layer = get_channel_layer()
+
+        async def run():
+            sender = await layer.new_channel()
+            viewer = await layer.new_channel()
+            await layer.group_add("chat_room", viewer)
+            with self.assertLogs('sage_ref.service.write_behind', 'ERROR'), \
+                    mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=DatabaseError):
+                lost = await writer.asubmit(
+                    self.room, "hello", session_key="s", group="chat_room", reply_channel=sender
+                )
+                ack = await asyncio.wait_for(layer.receive(sender), 5)
+                dropped = await asyncio.wait_for(layer.receive(viewer), 5)
+            resent = await writer.asubmit(
+                self.room, "hello", session_key="s", group="chat_room", reply_channel=sender
+            )
+            return sender, lost, ack, dropped, resent, await asyncio.wait_for(layer.receive(sender), 5)
+
+        sender, lost, ack, dropped, resent, resent_ack = async_to_sync(run)()
+        self.assertEqual((ack['sequences'], ack['persisted']), ([lost.sequence], False))
+        self.assertEqual(dropped['type'], 'message_dropped')
+        # Everyone else takes it off the page, the sender resends it
+        self.assertEqual(dropped_sequences(dropped, "viewer"), [lost.sequence])
+        self.assertEqual(dropped_sequences(dropped, sender), [])
+        # The numbers of the lost message are not handed out again
+        self.assertGreater(resent.sequence, lost.sequence)
+        self.assertNotEqual(resent.pk, lost.pk)
+        self.assertEqual((resent_ack['sequences'], resent_ack['persisted']), ([resent.sequence], True))
+        self.assertEqual(list(ChatMessage.objects.values_list('pk', 'sequence')), [(resent.pk, resent.sequence)])
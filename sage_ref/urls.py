@@ -3,7 +3,11 @@ from django.urls import path
 from .views import (
     ChatRoomView,
     AgentChatPanelView,
-    AgentChatRoomView
+    AgentChatRoomView,
+    AgentCloseRoomView,
+    RoomHistoryView,
+    TranscriptExportView,
+    MessageSearchView,
 )
 
 urlpatterns = [
@@ -14,5 +18,9 @@ urlpatterns = [
         'agent/<str:chatroom_name>/', 
         AgentChatRoomView.as_view(), name='chatroom'
     ),
+    path('agent/<str:chatroom_name>/close/', AgentCloseRoomView.as_view(), name='close_room'),
+    path('history/<str:chatroom_name>/', RoomHistoryView.as_view(), name='room_history'),
+    path('transcripts/', TranscriptExportView.as_view(), name='transcript_export'),
+    path('search/', MessageSearchView.as_view(), name='message_search'),
 
 ]
\ No newline at end of file
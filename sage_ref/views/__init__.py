@@ -1,2 +1,5 @@
 from .room import ChatRoomView
-from .agent import AgentChatPanelView,AgentChatRoomView
\ No newline at end of file
+from .agent import AgentChatPanelView,AgentChatRoomView,AgentCloseRoomView
+from .history import RoomHistoryView
+from .search import MessageSearchView
+from .transcripts import TranscriptExportView
\ No newline at end of file
@@ -1,20 +1,31 @@
-from django.views.generic import TemplateView
-from django.shortcuts import get_object_or_404
-from django.db.models import Count
-from sage_ref.models import Room, ChatMessage,Agent
+from asgiref.sync import async_to_sync
+from django.views.generic import TemplateView, View
+from django.shortcuts import get_object_or_404, redirect
+from django.http import HttpResponseBadRequest
+from sage_ref.models import Room, Agent
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.contrib.auth import get_user_model
+from sage_ref.service.assignment import assignment_scheduler
+from sage_ref.service.history import older_cursor, recent_messages
+from sage_ref.service.inbox import inbox_page
 
 User = get_user_model()
 @method_decorator(login_required, name='dispatch')
 class AgentChatPanelView(TemplateView):
     template_name = 'agent.html'
 
+    def get(self, request, *args, **kwargs):
+        try:
+            self.rooms, self.next_cursor = inbox_page(after=request.GET.get('after'))
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        return super().get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['rooms'] = Room.objects.annotate(message_count=Count('messages')).filter(message_count__gt=0)
-        context['messages'] = ChatMessage.objects.all().order_by('timestamp')[:50]
+        context['rooms'] = self.rooms
+        context['next_cursor'] = self.next_cursor
         return context
 
 
@@ -27,19 +38,32 @@ class AgentChatRoomView(TemplateView):
         chatroom_name = self.kwargs['chatroom_name']
         room = get_object_or_404(Room, name=chatroom_name)
         agent = get_object_or_404(Agent, user=self.request.user)
-        room.agent = agent
-        room.save()
-        is_agent = str(room.agent) == str(self.request.user)
-        print(is_agent)
-        context['is_agent'] = is_agent
+        # Rooms are assigned by the scheduler; opening one only reads it
+        context['is_agent'] = room.agent_id == agent.pk
         context['chatroom'] = room
         context['chatroom_name'] = room.name
-        context['messages'] = ChatMessage.objects.filter(room=room).order_by('timestamp')[:50]
-        messages = list(ChatMessage.objects.filter(room=room).order_by('timestamp')[:50])
-        first_message = messages[0]
+        messages = recent_messages(room)
+        context['messages'] = messages
+        context['older_cursor'] = older_cursor(messages)
+        first_message = messages[0] if messages else None
         username = getattr(
             first_message.author, User.USERNAME_FIELD, "Anonymous"
-        ) if first_message.author else "Anonymous"
+        ) if first_message and first_message.author else "Anonymous"
         context['rooms'] = Room.objects.all()
         context['username'] = username
-        return context
\ No newline at end of file
+        return context
+
+
+@method_decorator(login_required, name='dispatch')
+class AgentCloseRoomView(View):
+    """
+    Close a chat, freeing a slot of its agent for the next waiting room.
+
+    Only the agent assigned to the room can close it, or a staff member.
+    """
+
+    def post(self, request, chatroom_name):
+        room = get_object_or_404(Room, name=chatroom_name)
+        # Raises PermissionDenied for anyone else
+        async_to_sync(assignment_scheduler.close)(room, request.user)
+        return redirect('agent_chat_panel')
@@ -0,0 +1,38 @@
+from django.http import Http404, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.views.generic import TemplateView
+from sage_ref.models import Agent, Room
+from sage_ref.helpers.cursors import encode_cursor
+from sage_ref.helpers.visitors import anonymous_identity
+from sage_ref.service.history import history_page
+
+
+class RoomHistoryView(TemplateView):
+    """
+    A page of a room's history as message fragments, for "load older"
+    (``?before=<cursor>``) and catching up (``?after=<cursor>``).
+    """
+    template_name = 'history_page.html'
+
+    def get(self, request, *args, **kwargs):
+        room = get_object_or_404(Room, name=self.kwargs['chatroom_name'])
+        if not self.can_read(room):
+            raise Http404
+        before = request.GET.get('before')
+        after = request.GET.get('after')
+        try:
+            messages, has_more = history_page(room, before=before, after=after)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        context = self.get_context_data(room=room, messages=messages, newer=after is not None)
+        if has_more and messages:
+            edge = messages[-1] if after is not None else messages[0]
+            context['next_cursor'] = encode_cursor(edge.timestamp, edge.pk)
+        return self.render_to_response(context)
+
+    def can_read(self, room):
+        # Visitors only see their own room, agents see every room
+        user = self.request.user
+        if user.is_authenticated:
+            return room.name == user.username or Agent.objects.filter(user=user).exists()
+        return room.name == anonymous_identity(self.request.session.session_key, self.request.COOKIES)
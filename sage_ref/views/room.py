@@ -1,18 +1,31 @@
 from django.views.generic import TemplateView
-from sage_ref.models import ChatMessage,Room
+from sage_ref.models import Room
+from sage_ref.helpers.visitors import anonymous_identity, new_visitor_id, set_visitor_cookie
+from sage_ref.service.history import older_cursor, recent_messages
 
 class ChatRoomView(TemplateView):
     template_name = 'chat.html'
+
+    def get(self, request, *args, **kwargs):
+        self.new_visitor = None
+        response = super().get(request, *args, **kwargs)
+        if self.new_visitor:
+            set_visitor_cookie(response, self.new_visitor)
+        return response
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         if user.is_authenticated:
             chatroom_name = user.username
         else:
-            if not self.request.session.session_key:
-                self.request.session.save() 
-            chatroom_name = self.request.session.session_key
-        room, created = Room.objects.get_or_create(name=chatroom_name)
-        context['messages'] = ChatMessage.objects.filter(room=room).order_by('timestamp'        )[:50]
-        context['chatroom_name'] = room.name
+            # Identified by a signed cookie, so no session row is written
+            chatroom_name = anonymous_identity(self.request.session.session_key, self.request.COOKIES)
+            if chatroom_name is None:
+                chatroom_name = self.new_visitor = new_visitor_id()
+        # The room is created with its first message, see the chat consumers
+        room = Room.objects.filter(name=chatroom_name).first()
+        context['messages'] = messages = recent_messages(room) if room else []
+        context['older_cursor'] = older_cursor(messages)
+        context['chatroom_name'] = chatroom_name
         return context
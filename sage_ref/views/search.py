@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.generic import TemplateView
+from sage_ref.models import Agent, Room
+from sage_ref.service.search import search_messages
+from sage_ref.service.transcripts import parse_bound
+
+User = get_user_model()
+
+
+@method_decorator(login_required, name='dispatch')
+class MessageSearchView(TemplateView):
+    """
+    A page of messages matching ``?q=``, best match first, optionally in one
+    ``?room=``, by one ``?author=`` and between ``?since=`` and ``?until=``.
+    Agents only.
+    """
+    template_name = 'search_results.html'
+
+    def get(self, request, *args, **kwargs):
+        if not Agent.objects.filter(user=request.user).exists():
+            raise PermissionDenied
+        params = request.GET
+        room = get_object_or_404(Room, name=params['room']) if params.get('room') else None
+        author = get_object_or_404(User, **{User.USERNAME_FIELD: params['author']}) if params.get('author') else None
+        try:
+            since = parse_bound(params.get('since'))
+            until = parse_bound(params.get('until'))
+            page = int(params.get('page', 1))
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        messages, has_more = search_messages(
+            params.get('q', ''), room=room, author=author, since=since, until=until, page=page
+        )
+        query = params.copy()
+        query['page'] = page + 1
+        context = self.get_context_data(
+            query=params.get('q', ''),
+            messages=messages,
+            next_page=query.urlencode() if has_more else None,
+        )
+        return self.render_to_response(context)
@@ -0,0 +1,46 @@
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.generic import View
+from sage_ref.models import Agent, Room
+from sage_ref.service.transcripts import (
+    TRANSCRIPT_FORMATS,
+    aiter_sync,
+    parse_bound,
+    transcript_rows,
+    transcript_stream,
+)
+
+
+@method_decorator(login_required, name='dispatch')
+class TranscriptExportView(View):
+    """
+    Gzip-compressed transcript of one room (``?room=<name>``) or of all
+    rooms, optionally limited to ``?since=`` and ``?until=`` (ISO dates or
+    date-times), as JSON lines or ``?format=csv``. Agents only.
+    """
+
+    def get(self, request):
+        if not Agent.objects.filter(user=request.user).exists():
+            raise PermissionDenied
+        name = request.GET.get('room')
+        room = get_object_or_404(Room, name=name) if name else None
+        format = request.GET.get('format', 'jsonl')
+        if format not in TRANSCRIPT_FORMATS:
+            return HttpResponseBadRequest(f"Unknown format: {format!r}")
+        try:
+            since = parse_bound(request.GET.get('since'))
+            until = parse_bound(request.GET.get('until'))
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+        chunks = transcript_stream(transcript_rows(room, since, until), format)
+        if isinstance(request, ASGIRequest):
+            chunks = aiter_sync(chunks)
+        response = StreamingHttpResponse(chunks, content_type='application/gzip')
+        filename = f"transcript-{room.name if room else 'all'}.{format}.gz"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response